@@ -0,0 +1,174 @@
+from contextlib import contextmanager
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts import views
+from transfers.models import DownloadEvent, Transfer
+
+# (description, Accept-Language, session lang, ?lang=)
+VISITORS = [
+    ('New visitor from a shared link', 'en-US,en;q=0.9', None, None),
+    ('New visitor, other browser language', 'de-DE,de;q=0.9', None, None),
+    ('Returning visitor', 'en-US,en;q=0.9', 'en', None),
+    ('Visitor picking a language', 'en-US,en;q=0.9', None, 'fr'),
+]
+
+DEFAULT_SHARES = '70,10,15,5'
+
+
+def parse_shares(value):
+    try:
+        shares = [float(share) for share in value.split(',')]
+    except ValueError:
+        raise CommandError(f'--shares must be numbers separated by commas, got {value!r}')
+    if len(shares) != len(VISITORS) or sum(shares) <= 0:
+        raise CommandError(f'--shares needs {len(VISITORS)} numbers, one per visitor type')
+    total = sum(shares)
+    return [share / total for share in shares]
+
+
+@contextmanager
+def counting_saves(store_class):
+    """Count the saves of store_class and delete the sessions they wrote afterwards."""
+    counter = {'saves': 0, 'keys': set(), 'depth': 0}
+    had_own_save = 'save' in store_class.__dict__
+    original = store_class.save
+
+    def save(store, *args, **kwargs):
+        # Saving a new session goes through create(), which saves again
+        if counter['depth'] == 0:
+            counter['saves'] += 1
+        counter['depth'] += 1
+        try:
+            result = original(store, *args, **kwargs)
+        finally:
+            counter['depth'] -= 1
+        counter['keys'].add(store.session_key)
+        return result
+
+    store_class.save = save
+    try:
+        yield counter
+    finally:
+        if had_own_save:
+            store_class.save = original
+        else:
+            del store_class.save
+        for key in counter['keys']:
+            store_class(session_key=key).delete()
+
+
+@contextmanager
+def storing_language_on_every_view():
+    """Restore the behaviour before the change: every view assigns session['lang']."""
+    original = views.should_store_language
+    views.should_store_language = lambda request, lang_iso: True
+    try:
+        yield
+    finally:
+        views.should_store_language = original
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay download page views through the middleware stack and count the '
+        'session saves, with and without storing the language on every view'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Page views replayed per visitor type')
+        parser.add_argument('--path', help='Page to replay (default: download page of the newest ready transfer)')
+        parser.add_argument(
+            '--shares',
+            default=DEFAULT_SHARES,
+            help='Share of page views per visitor type, in the order listed (default: %(default)s)',
+        )
+        parser.add_argument('--rps', type=float, help='Page views per second to project (default: recent download rate)')
+        parser.add_argument('--days', type=int, default=7, help='Days of DownloadEvents used for the default rate')
+
+    def handle(self, *args, **options):
+        shares = parse_shares(options['shares'])
+        path = options['path'] or self.default_path()
+        count = options['requests']
+        store_class = import_module(settings.SESSION_ENGINE).SessionStore
+
+        print(f'Replaying {count} views of {path} per visitor type')
+        print('%-40s %6s %14s %8s' % ('Visitor type', 'share', 'saves/view was', 'now'))
+
+        weighted = {'before': 0, 'now': 0}
+        for (name, accept_language, session_lang, query_lang), share in zip(VISITORS, shares):
+            ratios = {}
+            for mode in ('before', 'now'):
+                saves = self.replay(store_class, mode, path, count, accept_language, session_lang, query_lang)
+                ratios[mode] = saves / count
+                weighted[mode] += share * ratios[mode]
+            print('%-40s %5.0f%% %14.3f %8.3f' % (name, share * 100, ratios['before'], ratios['now']))
+
+        print('Measured session saves per page view, weighted by --shares: was %.3f, now %.3f' % (
+            weighted['before'],
+            weighted['now'],
+        ))
+
+        rps = options['rps']
+        if rps is None:
+            since = timezone.now() - timedelta(days=options['days'])
+            downloads = DownloadEvent.objects.filter(downloaded_at__gte=since).count()
+            rps = downloads / (options['days'] * 86400)
+            print('Download rate over the last %s days: %.3f/s (a floor for download page views)' % (options['days'], rps))
+
+        print('Estimate at %.3f views/s with the --shares mix: %.3f session writes/s before, %.3f now (%.3f/s removed)' % (
+            rps,
+            rps * weighted['before'],
+            rps * weighted['now'],
+            rps * (weighted['before'] - weighted['now']),
+        ))
+
+    @staticmethod
+    def default_path():
+        transfer = (
+            Transfer.objects
+            .filter(status=Transfer.READY, expires_at__gt=timezone.now(), purged_at__isnull=True)
+            .order_by('-created_at')
+            .first()
+        )
+        if transfer is None:
+            raise CommandError('No ready transfer to replay; pass --path')
+        return reverse('download_page', args=[transfer.short_id])
+
+    def replay(self, store_class, mode, path, count, accept_language, session_lang, query_lang):
+        """Send count views of path and return how many times the session was saved."""
+        seeded = None
+        if session_lang:
+            seeded = store_class()
+            seeded['lang'] = session_lang
+            seeded.create()
+
+        try:
+            with counting_saves(store_class) as counter:
+                if mode == 'before':
+                    with storing_language_on_every_view():
+                        self.send(path, count, accept_language, seeded, query_lang)
+                else:
+                    self.send(path, count, accept_language, seeded, query_lang)
+        finally:
+            if seeded is not None:
+                seeded.delete()
+
+        return counter['saves']
+
+    @staticmethod
+    def send(path, count, accept_language, seeded, query_lang):
+        for _ in range(count):
+            # A fresh client per view: visitors without a session don't carry one over
+            client = Client(HTTP_ACCEPT_LANGUAGE=accept_language, raise_request_exception=False)
+            if seeded is not None:
+                client.cookies[settings.SESSION_COOKIE_NAME] = seeded.session_key
+            response = client.get(path, {'lang': query_lang} if query_lang else {})
+            if response.status_code >= 400:
+                raise CommandError(f'{path} answered {response.status_code}')
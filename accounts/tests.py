@@ -1,3 +1,82 @@
-from django.test import TestCase
+import io
+from contextlib import redirect_stdout
 
-# Create your tests here.
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, TestCase, override_settings
+
+from accounts.management.commands.measure_session_writes import parse_shares
+from accounts.views import GlobalVars, should_store_language
+from transfers.models import Transfer
+from translations import catalog
+from translations.models.language import Language
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LanguageSessionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        catalog._languages = None
+        self.addCleanup(setattr, catalog, '_languages', None)
+        for iso, name in (('en', 'English'), ('fr', 'Français')):
+            Language.objects.create(name=name, en_label=name, iso=iso)
+
+    def make_request(self, path='/', session=None, **headers):
+        request = RequestFactory().get(path, **headers)
+        request.session = SessionStore()
+        request.session.update(session or {})
+        request.session.modified = False
+        return request
+
+    def test_should_store_language(self):
+        self.assertFalse(should_store_language(self.make_request(session={'lang': 'fr'}), 'fr'))
+        self.assertTrue(should_store_language(self.make_request(session={'lang': 'en'}), 'fr'))
+        self.assertTrue(should_store_language(self.make_request('/?lang=fr'), 'fr'))
+        self.assertFalse(should_store_language(self.make_request(), 'fr'))
+
+    def test_accept_language_does_not_touch_the_session(self):
+        request = self.make_request(HTTP_ACCEPT_LANGUAGE='fr-FR,fr;q=0.9')
+
+        self.assertEqual(GlobalVars.get_globals(request)['lang'].iso, 'fr')
+        self.assertFalse(request.session.modified)
+        self.assertNotIn('lang', request.session)
+
+    def test_same_language_does_not_touch_the_session(self):
+        request = self.make_request('/?lang=fr', session={'lang': 'fr'})
+
+        GlobalVars.get_globals(request)
+        self.assertFalse(request.session.modified)
+
+    def test_picked_language_is_stored(self):
+        request = self.make_request('/?lang=fr-CA', session={'lang': 'en'})
+
+        self.assertEqual(GlobalVars.get_globals(request)['lang'].iso, 'fr')
+        self.assertTrue(request.session.modified)
+        self.assertEqual(request.session['lang'], 'fr')
+
+    def test_unknown_language_falls_back_to_english(self):
+        request = self.make_request('/?lang=xx')
+
+        self.assertEqual(GlobalVars.get_globals(request)['lang'].iso, 'en')
+        self.assertEqual(request.session['lang'], 'en')
+
+    def test_measure_session_writes(self):
+        transfer = Transfer.objects.create(sender_ip='127.0.0.1', status=Transfer.READY)
+        output = io.StringIO()
+
+        with redirect_stdout(output):
+            call_command('measure_session_writes', '--requests', '3', '--rps', '10')
+
+        self.assertIn(f'/d/{transfer.short_id}/', output.getvalue())
+        # Only visitors picking a language (5% by default) still write
+        self.assertIn('weighted by --shares: was 1.000, now 0.050', output.getvalue())
+        self.assertIn('0.500 now (9.500/s removed)', output.getvalue())
+
+    def test_measure_session_writes_shares(self):
+        self.assertEqual(parse_shares('1,1,1,1'), [0.25] * 4)
+        with self.assertRaises(CommandError):
+            parse_shares('50,50')
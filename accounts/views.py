@@ -1,38 +1,41 @@
 from hashlib import md5
-from translations.models.translation import Translation
+from translations.catalog import LazyI18n, get_language_index
 from django.http import JsonResponse
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.core.cache import cache
 from accounts.models import CustomUser
 from app.utils import Utils
 from config import RATE_LIMIT, FILES_LIMIT, SCRIPT_VERSION
 
 
+def should_store_language(request, lang_iso):
+    """Check if the resolved language differs from what the session remembers."""
+    stored = request.session.get('lang')
+    if stored == lang_iso:
+        return False
+    # A language picked with ?lang= is remembered; one derived from
+    # Accept-Language isn't worth creating a session for
+    return stored is not None or bool(request.GET.get('lang'))
+
+
 class GlobalVars:
     @staticmethod
     def get_globals(request):
         lang_iso = Utils.get_language(request)
-        # Utils.clear_cache()
-        languages = cache.get('languages')
-
-        if not languages:
-            from translations.models.language import Language
-            languages = Language.objects.all()
-            cache.set('languages', languages)
-
-        try:
-            lang = languages.get(iso=lang_iso)
-        except:
-            lang = languages.get(iso='en')
+        languages = get_language_index()
+        lang = languages.get(lang_iso) or languages.get('en')
 
-        request.session['lang'] = lang.iso
+        # Assigning marks the session modified, which costs a session write
+        # and a Set-Cookie, so only persist an explicit change of language.
+        # Without one, the next request resolves the same language again.
+        if should_store_language(request, lang.iso):
+            request.session['lang'] = lang.iso
 
         return {
             'lang': lang,
-            'i18n': Translation.get_text_by_lang(lang.iso),
-            'languages': languages,
+            'i18n': LazyI18n(lang.iso),
+            'languages': languages.languages,
             'scripts_version': SCRIPT_VERSION,
         }
 class RateLimit(APIView):
@@ -6,6 +6,8 @@ DEBUG = True
 
 # Google Translate API (for translations)
 GOOGLE_API = ''
+# Backend for manage.py run_translation: 'google', or 'fake' to work offline
+TRANSLATION_BACKEND = 'google'
 
 # Email Configuration (Native SMTP)
 # For production, set up Postfix on your server with DKIM/SPF/DMARC
@@ -22,6 +24,13 @@ SERVER_EMAIL = 'server@example.com'  # For error emails
 # For development, use console backend to see emails in terminal:
 # EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Notification emails are sent by the rq worker (manage.py rqworker
+# --with-scheduler), retried after each of these delays, then kept as dead
+# letters (manage.py mail_dead_letters)
+MAIL_QUEUE = 'high'
+MAIL_RETRY_DELAYS = (30, 120, 600, 1800, 3600)  # Seconds
+MAIL_CONNECTION_IDLE = 30  # Seconds an SMTP connection is kept open between jobs
+
 # Database
 DATABASE = {
     'default': {
@@ -67,6 +76,54 @@ PAYPAL_KEYS = {
 RATE_LIMIT = 10
 FILES_LIMIT = 2147483648  # 2GB
 
+# File delivery backend
+# 'python' streams files from Django (fine for development).
+# 'x-accel-redirect' lets nginx send files from an internal location that
+# aliases MEDIA_ROOT (see ansible/files/nginx.conf.j2).
+# 'x-sendfile' is for Apache/lighttpd with mod_xsendfile.
+FILE_DELIVERY_BACKEND = 'python'
+FILE_DELIVERY_ACCEL_PREFIX = '/protected-uploads/'
+FILE_DELIVERY_ZIP_OFFLOAD = False  # Requires the nginx mod_zip module
+
+# File storage
+# 'local' keeps files under MEDIA_ROOT.
+# 's3' stores them in an S3-compatible bucket (requires boto3). For local
+# development run MinIO and point endpoint_url at it, e.g.
+#   docker run -p 9000:9000 minio/minio server /data
+# then create the bucket with manage.py setup_bucket.
+# Web server offload (x-accel-redirect/x-sendfile) only applies to 'local'.
+STORAGE_BACKEND = 'local'
+S3_STORAGE = {
+    'bucket': 'sendfiles',
+    'endpoint_url': 'http://localhost:9000',  # Leave empty for AWS
+    'access_key': 'minioadmin',
+    'secret_key': 'minioadmin',
+    'region': 'us-east-1',
+    'prefix': '',
+}
+# With 's3', downloads redirect to short-lived presigned URLs and clients can
+# upload straight to the bucket (CreateTransferAPI with direct_upload). The
+# bucket needs CORS allowing PUT from the site and exposing ETag, and a
+# lifecycle rule aborting incomplete multipart uploads (manage.py setup_bucket).
+STORAGE_PRESIGNED_DOWNLOADS = True
+STORAGE_PRESIGN_EXPIRY = 300  # Seconds
+STORAGE_DIRECT_UPLOADS = True
+
+# Virus scanning
+# Finalized transfers are queued for a background scan (run manage.py
+# rqworker). Files are streamed to clamd: a unix socket path or host:port.
+# Raise StreamMaxLength in clamd.conf to at least FILES_LIMIT. Without
+# ClamAV, run manage.py fake_clamd for development.
+VIRUS_SCAN_ENABLED = True
+VIRUS_SCAN_QUEUE = 'default'
+VIRUS_SCAN_WORKERS = 4  # Files of a transfer scanned at the same time
+VIRUS_SCAN_RETRY_DELAYS = (300, 1800, 7200)  # Seconds; rescans after clamd/storage errors
+CLAMD_ADDRESS = '/var/run/clamav/clamd.ctl'
+
+# Record which translation keys each page template uses (manage.py
+# i18n_usage); defaults to DEBUG
+I18N_USAGE_TRACKING = DEBUG
+
 # Script Version (for cache busting)
 SCRIPT_VERSION = '1.0.0'
 
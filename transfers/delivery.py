@@ -0,0 +1,291 @@
+"""
+File delivery for downloads and previews.
+
+Serves stored transfer files with conditional request and HTTP Range support
+(single ranges and multipart/byteranges), so interrupted downloads can resume
+and media previews can seek without fetching the whole file.
+
+The delivery backend is configured with FILE_DELIVERY_BACKEND in config.py:
+- 'python': stream bytes from Django (development default)
+- 'x-accel-redirect': hand the file to an internal nginx location
+- 'x-sendfile': hand the file path to Apache/lighttpd (mod_xsendfile)
+
+With an offload backend Django only runs the access checks; the web server
+sends the bytes and handles Range itself, so no worker is tied up. Offload
+needs the files on local disk; with remote storage (see transfers.storage)
+clients are redirected to a short-lived presigned URL on the object store
+(STORAGE_PRESIGNED_DOWNLOADS, default on), or bytes are streamed from
+ranged reads of it.
+"""
+import os
+import re
+import uuid
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.http import http_date
+
+from transfers.ranges import RangeNotSatisfiable, parse_range_header, if_range_matches, content_range
+from transfers.storage import get_storage
+
+# Read size when streaming file data through Python. Only used when the WSGI
+# server can't sendfile (runserver, TLS terminated in gunicorn); otherwise
+# wsgi.file_wrapper hands the descriptor to os.sendfile and bytes never
+# enter Python. Override with FILE_DELIVERY_BLOCK_SIZE.
+BLOCK_SIZE = 512 * 1024
+
+# More ranges than this (after merging) are ignored and the full file is sent
+MAX_RANGES = 16
+
+# Lifetime of presigned download URLs, in seconds
+PRESIGN_EXPIRY = 300
+
+# Line breaks and other control characters, which would end a mod_zip line
+CONTROL_CHARS = re.compile(r'[\x00-\x1f\x7f-\x9f\u2028\u2029]')
+
+BACKEND_PYTHON = 'python'
+BACKEND_X_ACCEL = 'x-accel-redirect'
+BACKEND_X_SENDFILE = 'x-sendfile'
+
+
+def get_delivery_backend():
+    """Return the configured delivery backend."""
+    return getattr(settings, 'FILE_DELIVERY_BACKEND', BACKEND_PYTHON)
+
+
+def accel_uri(file_path):
+    """Map a path under MEDIA_ROOT to the internal nginx location for it."""
+    prefix = getattr(settings, 'FILE_DELIVERY_ACCEL_PREFIX', '/protected-uploads/')
+    relative = os.path.relpath(file_path, settings.MEDIA_ROOT)
+    return prefix.rstrip('/') + '/' + quote(relative.replace(os.sep, '/'))
+
+
+def get_block_size():
+    """Return the block size for Python-side file streaming."""
+    return getattr(settings, 'FILE_DELIVERY_BLOCK_SIZE', BLOCK_SIZE)
+
+
+def file_etag(transfer_file, size, mtime):
+    """Return a strong ETag from the content checksum, or size and mtime."""
+    if transfer_file.checksum:
+        return f'"{transfer_file.checksum}"'
+    return f'"{size:x}-{int(mtime):x}"'
+
+
+def merge_ranges(ranges):
+    """Sort ranges and merge the ones that overlap or touch."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def starts_download(response):
+    """
+    Check if a delivery response counts as a new download.
+
+    Full responses (and redirects to presigned URLs) do, and so does a range
+    starting at byte 0; continuation ranges (resumes, video seeks) and 304s
+    do not.
+    """
+    if response.status_code not in (200, 206, 302):
+        return False
+    byte_ranges = getattr(response, 'byte_ranges', None)
+    return not byte_ranges or byte_ranges[0][0] == 0
+
+
+def serve_file(request, transfer_file, disposition):
+    """
+    Build a response for a stored file, honouring Range and conditional headers.
+
+    The returned response has a `byte_ranges` attribute listing the ranges
+    being sent (None for a full response), see starts_download().
+    """
+    storage = get_storage()
+    if storage.supports_presigned and getattr(settings, 'STORAGE_PRESIGNED_DOWNLOADS', True):
+        return _presigned_response(request, transfer_file, disposition, storage)
+
+    backend = get_delivery_backend()
+    if backend != BACKEND_PYTHON and storage.is_local:
+        return _offload_response(request, transfer_file, disposition, backend)
+
+    key = transfer_file.storage_key
+    if storage.is_local:
+        stat = os.stat(transfer_file.storage_path)
+        size = stat.st_size
+        last_modified = stat.st_mtime
+    else:
+        size = transfer_file.size
+        last_modified = transfer_file.uploaded_at.timestamp()
+    etag = file_etag(transfer_file, size, last_modified)
+
+    # Conditional GET: the client already has this exact file
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]):
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        response.byte_ranges = None
+        return response
+
+    ranges = None
+    if if_range_matches(request, etag, last_modified):
+        try:
+            ranges = parse_range_header(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            response.byte_ranges = None
+            return response
+
+    if ranges:
+        ranges = merge_ranges(ranges)
+        if len(ranges) > MAX_RANGES:
+            ranges = None
+
+    if not ranges:
+        response = FileResponse(storage.open(key), content_type=transfer_file.mime_type)
+        response['Content-Length'] = size
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = FileResponse(
+            storage.open(key, start, end - start + 1),
+            status=206,
+            content_type=transfer_file.mime_type,
+        )
+        response['Content-Range'] = content_range(start, end, size)
+        response['Content-Length'] = end - start + 1
+    else:
+        response = _multipart_response(storage, key, ranges, size, transfer_file.mime_type)
+
+    response.block_size = get_block_size()
+    response.byte_ranges = ranges
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Content-Disposition'] = disposition
+    return response
+
+
+def _multipart_response(storage, key, ranges, size, content_type):
+    """Build a multipart/byteranges response for several ranges."""
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (
+            f'--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: {content_range(start, end, size)}\r\n\r\n'
+        ).encode('latin-1')
+        for start, end in ranges
+    ]
+    closing = f'--{boundary}--\r\n'.encode('latin-1')
+
+    content_length = len(closing)
+    for header, (start, end) in zip(part_headers, ranges):
+        content_length += len(header) + (end - start + 1) + 2
+
+    block_size = get_block_size()
+
+    def parts():
+        for header, (start, end) in zip(part_headers, ranges):
+            yield header
+            window = storage.open(key, start, end - start + 1)
+            try:
+                while True:
+                    data = window.read(block_size)
+                    if not data:
+                        break
+                    yield data
+            finally:
+                window.close()
+            yield b'\r\n'
+        yield closing
+
+    response = StreamingHttpResponse(
+        parts(),
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+    )
+    response['Content-Length'] = content_length
+    return response
+
+
+def _offload_response(request, transfer_file, disposition, backend):
+    """Let the front web server send the file after Django's access checks."""
+    file_path = transfer_file.storage_path
+
+    response = HttpResponse(content_type=transfer_file.mime_type)
+    if backend == BACKEND_X_ACCEL:
+        response['X-Accel-Redirect'] = accel_uri(file_path)
+    elif backend == BACKEND_X_SENDFILE:
+        response['X-Sendfile'] = file_path
+    else:
+        raise ValueError(f"Unknown FILE_DELIVERY_BACKEND: {backend}")
+    response['Content-Disposition'] = disposition
+
+    # The web server answers the Range itself; parse it only for download counting
+    response.byte_ranges = _requested_ranges(request, transfer_file)
+    return response
+
+
+def _presigned_response(request, transfer_file, disposition, storage):
+    """Redirect to a short-lived URL so the object store sends the bytes."""
+    expiry = getattr(settings, 'STORAGE_PRESIGN_EXPIRY', PRESIGN_EXPIRY)
+    url = storage.presigned_url(
+        transfer_file.storage_key,
+        expiry,
+        disposition=disposition,
+        content_type=transfer_file.mime_type,
+    )
+    response = HttpResponseRedirect(url)
+    response['Cache-Control'] = 'no-store'
+
+    # Clients repeat the Range on the redirect; parse it only for download counting
+    response.byte_ranges = _requested_ranges(request, transfer_file)
+    return response
+
+
+def _requested_ranges(request, transfer_file):
+    """Parse the request's Range header without answering it."""
+    try:
+        return parse_range_header(request.headers.get('Range'), transfer_file.size)
+    except RangeNotSatisfiable:
+        return None
+
+
+def zip_offload_enabled():
+    """Check if full-transfer ZIPs should be built by nginx mod_zip."""
+    return (
+        get_delivery_backend() == BACKEND_X_ACCEL
+        and get_storage().is_local
+        and getattr(settings, 'FILE_DELIVERY_ZIP_OFFLOAD', False)
+    )
+
+
+def zip_member_name(name):
+    """
+    Return a file name safe for a mod_zip line.
+
+    Names come from the uploader; a line break in one would add lines of
+    its own to the list, so control characters are replaced.
+    """
+    return CONTROL_CHARS.sub('_', name).strip() or 'file'
+
+
+def zip_offload_response(transfer_files):
+    """
+    Build a mod_zip file list so nginx assembles and sends the archive.
+
+    Each line is "<crc32> <size> <location> <name>"; the CRC is not stored,
+    so "-" is sent and nginx streams the archive without Range support.
+    """
+    lines = [
+        f'- {f.size} {accel_uri(f.storage_path)} {zip_member_name(f.original_name)}'
+        for f in transfer_files
+    ]
+    response = HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; charset=utf-8')
+    response['X-Archive-Files'] = 'zip'
+    return response
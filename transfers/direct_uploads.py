@@ -0,0 +1,106 @@
+"""
+Direct-to-storage uploads.
+
+With an object store backend, clients upload file data straight to the
+bucket using presigned multipart URLs, so bytes never pass through Django:
+
+1. CreateTransferAPI is given the file list and returns, per file, a
+   signed token, the part size and a presigned PUT URL for each part.
+2. The client PUTs the parts to the bucket and keeps each part's ETag.
+3. The client posts the token and ETags to DirectUploadCompleteAPI, which
+   completes the upload and records the TransferFile.
+
+The token carries the object key and declared size, signed so a client
+can only complete uploads this server started for that transfer. The
+bucket must allow cross-origin PUT from the site and expose the ETag header.
+"""
+import os
+import uuid
+
+from django.conf import settings
+from django.core import signing
+
+from transfers.storage import StorageError, get_storage, shard_name
+
+TOKEN_SALT = 'transfers.direct_upload'
+
+# Presigned part URLs (and tokens) are valid for this long (6 hours)
+DIRECT_UPLOAD_EXPIRY = 6 * 3600
+
+
+class DirectUploadError(Exception):
+    """A direct upload could not be completed."""
+
+
+def direct_uploads_enabled():
+    """Check if clients can upload straight to the storage backend."""
+    return get_storage().supports_presigned and getattr(settings, 'STORAGE_DIRECT_UPLOADS', True)
+
+
+def get_upload_expiry():
+    return getattr(settings, 'STORAGE_DIRECT_UPLOAD_EXPIRY', DIRECT_UPLOAD_EXPIRY)
+
+
+def upload_key(stored_name):
+    """Storage key of a directly uploaded file (see TransferFile.storage_key)."""
+    return f'transfers/{stored_name}'
+
+
+def start_direct_upload(transfer, name, size, mime_type=''):
+    """Start a direct upload of one file. Returns the data for the client."""
+    stored_name = shard_name(f"{uuid.uuid4().hex}{os.path.splitext(name)[1]}")
+
+    upload = get_storage().start_direct_upload(upload_key(stored_name), size, get_upload_expiry())
+    token = signing.dumps({
+        'transfer_id': str(transfer.id),
+        'stored_name': stored_name,
+        'upload_id': upload['upload_id'],
+        'name': name,
+        'size': size,
+        'mime_type': mime_type,
+    }, salt=TOKEN_SALT)
+
+    return {
+        'name': name,
+        'token': token,
+        'part_size': upload['part_size'],
+        'parts': upload['parts'],
+    }
+
+
+def load_upload_token(token, transfer):
+    """
+    Return the upload details signed into a token for this transfer.
+
+    Raises signing.BadSignature if the token is invalid, expired or
+    belongs to another transfer.
+    """
+    info = signing.loads(token, salt=TOKEN_SALT, max_age=get_upload_expiry())
+    if info.get('transfer_id') != str(transfer.id):
+        raise signing.BadSignature('Token is for another transfer')
+    return info
+
+
+def complete_direct_upload(info, parts):
+    """
+    Assemble the parts of a direct upload and check the result.
+
+    parts is a list of (part_number, etag). Completing an upload that was
+    already completed is not an error. Returns the stored size; raises
+    DirectUploadError if the upload is incomplete or not the declared size.
+    """
+    storage = get_storage()
+    key = upload_key(info['stored_name'])
+
+    try:
+        storage.complete_direct_upload(key, info['upload_id'], parts)
+    except StorageError as e:
+        # A retried callback finds the upload already completed by the first
+        if not storage.exists(key):
+            raise DirectUploadError(f'Upload incomplete: {e}')
+
+    size = storage.size(key)
+    if size != info['size']:
+        storage.delete(key)
+        raise DirectUploadError('Uploaded size does not match the declared size')
+    return size
@@ -0,0 +1,123 @@
+"""
+A stand-in for clamd speaking the same socket protocol, for development and
+tests where ClamAV isn't installed (manage.py fake_clamd).
+
+Streams containing the EICAR test string are reported as infected, and
+streams longer than max_stream_length are rejected like clamd does.
+"""
+import os
+import socketserver
+import struct
+import threading
+import time
+
+EICAR = b'X5O!P%@AP[4\\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!H+H*'
+EICAR_SIGNATURE = 'Eicar-Test-Signature'
+
+VERSION = 'ClamAV 1.0.0/27000/Fake'
+
+
+class FakeClamdHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        command = self.read_command()
+        if command is None:
+            return
+        if command == 'PING':
+            self.reply('PONG')
+        elif command == 'VERSION':
+            self.reply(VERSION)
+        elif command == 'INSTREAM':
+            self.instream()
+        else:
+            self.reply('UNKNOWN COMMAND')
+
+    def read_command(self):
+        data = b''
+        while not data.endswith((b'\0', b'\n')):
+            chunk = self.request.recv(1)
+            if not chunk:
+                return None
+            data += chunk
+        return data.strip(b'\0\n').decode().lstrip('zn')
+
+    def read_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('Stream ended early')
+            data += chunk
+        return data
+
+    def instream(self):
+        server = self.server
+        received = 0
+        # Keep the tail of the previous chunk so a signature split across
+        # chunks is still found
+        tail = b''
+        found = False
+
+        while True:
+            size = struct.unpack('!L', self.read_exactly(4))[0]
+            if not size:
+                break
+            data = self.read_exactly(size)
+            received += size
+            if server.max_stream_length and received > server.max_stream_length:
+                self.reply('INSTREAM size limit exceeded. ERROR')
+                return
+            if EICAR in tail + data:
+                found = True
+            tail = data[-len(EICAR):]
+
+        if server.delay:
+            time.sleep(server.delay)
+        self.reply(f'stream: {EICAR_SIGNATURE} FOUND' if found else 'stream: OK')
+
+    def reply(self, message):
+        self.request.sendall(f'{message}\0'.encode())
+
+
+class FakeClamd:
+    """
+    Run a fake clamd on a unix socket path or "host:port" ("127.0.0.1:0"
+    picks a free port; see address once started).
+    """
+
+    def __init__(self, address, max_stream_length=25 * 1024 * 1024, delay=0):
+        self.address = address
+        self.max_stream_length = max_stream_length
+        self.delay = delay
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        if self.address.startswith('/'):
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            server = socketserver.ThreadingUnixStreamServer(self.address, FakeClamdHandler)
+        else:
+            host, port = self.address.rsplit(':', 1)
+            server = socketserver.ThreadingTCPServer((host, int(port)), FakeClamdHandler)
+            self.address = '%s:%s' % server.server_address[:2]
+        server.daemon_threads = True
+        server.max_stream_length = self.max_stream_length
+        server.delay = self.delay
+        self.server = server
+
+        self.thread = threading.Thread(target=server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.address.startswith('/') and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,142 @@
+"""
+Resumable SHA-256 hashing for uploads.
+
+hashlib objects can't be serialized, so the hash of a tus upload could not
+survive between PATCH requests (which may land on different workers). When
+OpenSSL's libcrypto is available its SHA256_CTX is a plain struct that can be
+saved and restored byte for byte, letting each PATCH pick up where the last
+one stopped. Without libcrypto, state can't be exported and callers replay
+the bytes already on disk instead.
+
+The struct layout belongs to the library build and the machine, and an
+upload can be resumed on another host. Saved state therefore starts with a
+tag naming the libcrypto version and platform; state saved under a
+different tag is not restored, and callers replay the data instead.
+"""
+import ctypes
+import ctypes.util
+import hashlib
+import platform
+import sys
+
+SHA256_CTX_SIZE = 112
+SHA256_DIGEST_SIZE = 32
+
+# Size of reads when hashing data already on disk
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def _load_libcrypto():
+    """Load libcrypto's SHA-256 functions, or None if unusable."""
+    path = ctypes.util.find_library('crypto')
+    if not path:
+        return None
+
+    try:
+        lib = ctypes.CDLL(path)
+        lib.SHA256_Init.argtypes = [ctypes.c_char_p]
+        lib.SHA256_Update.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t]
+        lib.SHA256_Final.argtypes = [ctypes.c_char_p, ctypes.c_char_p]
+    except (OSError, AttributeError):
+        return None
+
+    # Known-answer check, including a save/restore of the context
+    ctx = ctypes.create_string_buffer(SHA256_CTX_SIZE)
+    lib.SHA256_Init(ctx)
+    lib.SHA256_Update(ctx, b'ab', 2)
+    ctx = ctypes.create_string_buffer(ctx.raw, SHA256_CTX_SIZE)
+    lib.SHA256_Update(ctx, b'c', 1)
+    digest = ctypes.create_string_buffer(SHA256_DIGEST_SIZE)
+    lib.SHA256_Final(digest, ctx)
+    if digest.raw != hashlib.sha256(b'abc').digest():
+        return None
+
+    return lib
+
+
+def _load_state_tag(lib):
+    """Identify the libcrypto build and platform a saved context belongs to."""
+    for name in ('OpenSSL_version', 'SSLeay_version'):
+        function = getattr(lib, name, None)
+        if function is not None:
+            function.argtypes = [ctypes.c_int]
+            function.restype = ctypes.c_char_p
+            version = function(0).decode('ascii', 'replace')
+            break
+    else:
+        return None
+    return f'{version};{platform.machine()};{sys.byteorder};{SHA256_CTX_SIZE}|'.encode()
+
+
+_libcrypto = _load_libcrypto()
+_state_tag = _load_state_tag(_libcrypto) if _libcrypto else None
+if _state_tag is None:
+    # Without a version to check saved state against, always replay
+    _libcrypto = None
+
+
+class ResumableSHA256:
+    """SHA-256 hasher whose intermediate state can be saved and restored."""
+
+    def __init__(self):
+        if _libcrypto:
+            self._ctx = ctypes.create_string_buffer(SHA256_CTX_SIZE)
+            _libcrypto.SHA256_Init(self._ctx)
+            self._hash = None
+        else:
+            self._ctx = None
+            self._hash = hashlib.sha256()
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Restore a hasher from state(), or return None if that's not possible
+        (no libcrypto, or state saved by another libcrypto or platform).
+        """
+        if not _libcrypto or not state:
+            return None
+        state = bytes(state)
+        if not state.startswith(_state_tag) or len(state) != len(_state_tag) + SHA256_CTX_SIZE:
+            return None
+
+        hasher = cls.__new__(cls)
+        hasher._ctx = ctypes.create_string_buffer(state[len(_state_tag):], SHA256_CTX_SIZE)
+        hasher._hash = None
+        return hasher
+
+    def update(self, data):
+        if self._ctx is None:
+            self._hash.update(data)
+        else:
+            data = bytes(data)
+            _libcrypto.SHA256_Update(self._ctx, data, len(data))
+
+    def state(self):
+        """Return the serialized intermediate state, or None if unsupported."""
+        if self._ctx is None:
+            return None
+        return _state_tag + self._ctx.raw
+
+    def hexdigest(self):
+        if self._ctx is None:
+            return self._hash.hexdigest()
+
+        # Finalize a copy so this hasher can keep going
+        ctx = ctypes.create_string_buffer(self._ctx.raw, SHA256_CTX_SIZE)
+        digest = ctypes.create_string_buffer(SHA256_DIGEST_SIZE)
+        _libcrypto.SHA256_Final(digest, ctx)
+        return digest.raw.hex()
+
+
+def hash_file_range(hasher, file_path, start, end):
+    """Feed bytes start..end (exclusive) of a file into a hasher."""
+    remaining = end - start
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        while remaining > 0:
+            data = f.read(min(HASH_BLOCK_SIZE, remaining))
+            if not data:
+                break
+            hasher.update(data)
+            remaining -= len(data)
+    return hasher
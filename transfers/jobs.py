@@ -0,0 +1,77 @@
+"""
+Background jobs run by the django_rq workers (manage.py rqworker).
+"""
+import logging
+from datetime import timedelta
+
+import django_rq
+from django.conf import settings
+from django.db import transaction
+
+from transfers.models import Transfer
+from transfers.security import scan_transfer
+
+logger = logging.getLogger(__name__)
+
+# A 2 GB transfer streams in a few minutes; leave room for a busy clamd
+SCAN_JOB_TIMEOUT = 3600
+
+# Seconds to wait before scanning a transfer again after scan errors
+SCAN_RETRY_DELAYS = (300, 1800, 7200)
+
+
+def get_scan_queue():
+    return django_rq.get_queue(getattr(settings, 'VIRUS_SCAN_QUEUE', 'default'))
+
+
+def scan_transfer_job(transfer_id, attempt=1):
+    """
+    Virus-scan a finalized transfer.
+
+    When a file could not be scanned (clamd or storage unavailable) the scan
+    is scheduled again after VIRUS_SCAN_RETRY_DELAYS; files that already got
+    a verdict come from the verdict cache then.
+    """
+    try:
+        transfer = Transfer.objects.get(id=transfer_id)
+    except Transfer.DoesNotExist:
+        return None
+
+    if transfer.status != Transfer.READY:
+        return None
+
+    transfer.virus_scan_status = Transfer.SCAN_PENDING
+    transfer.virus_scan_result = ''
+    transfer.save(update_fields=['virus_scan_status', 'virus_scan_result'])
+
+    result = scan_transfer(transfer)
+
+    if transfer.virus_scan_status == Transfer.SCAN_ERROR:
+        retry_delays = getattr(settings, 'VIRUS_SCAN_RETRY_DELAYS', SCAN_RETRY_DELAYS)
+        if attempt <= len(retry_delays):
+            delay = retry_delays[attempt - 1]
+            logger.warning(f"Virus scan of transfer {transfer_id} incomplete; retrying in {delay}s")
+            get_scan_queue().enqueue_in(
+                timedelta(seconds=delay),
+                scan_transfer_job,
+                transfer_id,
+                attempt + 1,
+                job_timeout=SCAN_JOB_TIMEOUT,
+            )
+        else:
+            logger.error(f"Virus scan of transfer {transfer_id} failed after {attempt} attempts")
+
+    return result
+
+
+def enqueue_virus_scan(transfer):
+    """Queue a virus scan of a transfer once the current transaction commits."""
+    if not getattr(settings, 'VIRUS_SCAN_ENABLED', True):
+        return
+
+    queue = get_scan_queue()
+    transaction.on_commit(lambda: queue.enqueue(
+        scan_transfer_job,
+        str(transfer.id),
+        job_timeout=SCAN_JOB_TIMEOUT,
+    ))
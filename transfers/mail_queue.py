@@ -0,0 +1,282 @@
+"""
+Outbound mail queue.
+
+Notification emails are put on a django_rq queue (MAIL_QUEUE, "high" by
+default) instead of being sent inside the request, so views never wait on
+SMTP. One job carries the messages of one notification (one per
+recipient), which the worker sends back to back over a single SMTP
+connection; the connection stays open between jobs for MAIL_CONNECTION_IDLE
+seconds when the worker doesn't fork per job (rq.SimpleWorker). Each
+recipient is still handled on its own:
+
+- a failed send is retried with backoff (MAIL_RETRY_DELAYS); the retries
+  are scheduled, so the worker must run with --with-scheduler
+- after the last attempt the message goes to a dead-letter list in Redis,
+  which manage.py mail_dead_letters shows and can requeue
+- a dedup key makes queueing the same notification for the same
+  recipient twice a no-op (double-clicked finalize, concurrent downloads)
+
+Delivery counters are kept in Redis for manage.py mail_stats.
+"""
+import json
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+import django_rq
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before each retry; the message is dead-lettered after the last
+MAIL_RETRY_DELAYS = (30, 120, 600, 1800, 3600)
+
+DEAD_LETTER_KEY = 'transfers:mail:dead_letter'
+
+# Dead letters kept, newest first
+DEAD_LETTER_LIMIT = 1000
+
+# How long a dedup key blocks the same message to the same recipient
+DEDUP_TIMEOUT = 24 * 3600
+
+# Close the pooled SMTP connection after this many idle seconds (servers
+# drop idle clients after a few minutes anyway)
+MAIL_CONNECTION_IDLE = 30
+
+METRICS_KEY = 'transfers:mail:metrics'
+
+# Errors about one message; the connection is still usable for the next
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+_connection = None
+_connection_used_at = 0
+
+
+def get_queue():
+    return django_rq.get_queue(getattr(settings, 'MAIL_QUEUE', 'high'))
+
+
+def get_retry_delays():
+    return getattr(settings, 'MAIL_RETRY_DELAYS', MAIL_RETRY_DELAYS)
+
+
+def queue_mail(subject, message, recipients, html_message=None, dedup_key=None, dedup_timeout=DEDUP_TIMEOUT):
+    """
+    Queue an email to each recipient once the current transaction commits.
+
+    With dedup_key, a recipient who already had a message queued under the
+    same key within dedup_timeout seconds is skipped. The key is only taken
+    when the transaction commits, so a rolled back notification doesn't
+    block the real one. Returns the number of messages handed over, before
+    duplicates are dropped.
+    """
+    mails = [
+        {
+            'subject': subject,
+            'message': message,
+            'html_message': html_message,
+            'from_email': settings.DEFAULT_FROM_EMAIL,
+            'to': recipient,
+            'dedup_key': dedup_key,
+        }
+        for recipient in recipients
+    ]
+
+    if mails:
+        transaction.on_commit(lambda: enqueue_mails(mails, dedup_timeout))
+    return len(mails)
+
+
+def enqueue_mails(mails, dedup_timeout=DEDUP_TIMEOUT):
+    """Put the messages not sent under their dedup key recently on the queue as one job."""
+    unique = []
+    for mail in mails:
+        dedup_key = mail['dedup_key']
+        if dedup_key and not cache.add(f"transfers:mail:dedup:{dedup_key}:{mail['to']}", 1, dedup_timeout):
+            logger.info(f"Skipping duplicate {dedup_key} email to {mail['to']}")
+            continue
+        unique.append(mail)
+
+    if unique:
+        get_queue().enqueue(deliver_mail, unique)
+    return len(unique)
+
+
+def get_mail_connection():
+    """
+    Return this process's open SMTP connection, opening one if needed.
+
+    A connection idle for longer than MAIL_CONNECTION_IDLE is replaced
+    rather than reused.
+    """
+    global _connection, _connection_used_at
+
+    idle = getattr(settings, 'MAIL_CONNECTION_IDLE', MAIL_CONNECTION_IDLE)
+    if _connection is not None and time.monotonic() - _connection_used_at > idle:
+        close_mail_connection()
+
+    if _connection is None:
+        connection = get_connection(fail_silently=False)
+        connection.open()
+        _connection = connection
+        record_metrics(connections=1)
+
+    _connection_used_at = time.monotonic()
+    return _connection
+
+
+def close_mail_connection():
+    global _connection
+    if _connection is not None:
+        try:
+            _connection.close()
+        except Exception:
+            pass
+        _connection = None
+
+
+def build_message(mail, connection):
+    email = EmailMultiAlternatives(
+        subject=mail['subject'],
+        body=mail['message'],
+        from_email=mail['from_email'],
+        to=[mail['to']],
+        connection=connection,
+    )
+    if mail.get('html_message'):
+        email.attach_alternative(mail['html_message'], 'text/html')
+    return email
+
+
+def send_one(mail):
+    """
+    Send one message over the pooled connection.
+
+    A dropped connection is reopened once before giving up.
+    """
+    for retry in (False, True):
+        connection = get_mail_connection()
+        try:
+            connection.send_messages([build_message(mail, connection)])
+            return
+        except MESSAGE_ERRORS:
+            raise
+        except OSError:
+            # Disconnected or timed out; the connection is unusable
+            close_mail_connection()
+            if retry:
+                raise
+
+
+def deliver_mail(mails, attempt=1):
+    """
+    Send queued emails (runs in the rq worker).
+
+    Messages that fail are rescheduled together, or dead-lettered after
+    the last attempt. Returns the number sent.
+    """
+    if isinstance(mails, dict):
+        # Jobs queued before messages were batched
+        mails = [mails]
+
+    started = time.monotonic()
+    failed = []
+
+    for mail in mails:
+        try:
+            send_one(mail)
+        except Exception as e:
+            logger.warning(f"Email to {mail['to']} failed (attempt {attempt}): {e}")
+            failed.append((mail, e))
+            continue
+        logger.info(f"Sent \"{mail['subject']}\" to {mail['to']}")
+
+    record_metrics(
+        batches=1,
+        sent=len(mails) - len(failed),
+        failed=len(failed),
+        send_seconds=time.monotonic() - started,
+    )
+
+    if failed:
+        retry_delays = get_retry_delays()
+        if attempt <= len(retry_delays):
+            delay = retry_delays[attempt - 1]
+            logger.warning(f"Retrying {len(failed)} emails in {delay}s")
+            retry = [mail for mail, _ in failed]
+            get_queue().enqueue_in(timedelta(seconds=delay), deliver_mail, retry, attempt + 1)
+        else:
+            for mail, error in failed:
+                logger.error(f"Email to {mail['to']} failed after {attempt} attempts: {error}")
+                dead_letter(mail, attempt, error)
+
+    return len(mails) - len(failed)
+
+
+def record_metrics(**counters):
+    """Add to the delivery counters in Redis."""
+    try:
+        pipeline = get_queue().connection.pipeline()
+        for name, value in counters.items():
+            if isinstance(value, float):
+                pipeline.hincrbyfloat(METRICS_KEY, name, value)
+            else:
+                pipeline.hincrby(METRICS_KEY, name, value)
+        pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Could not record mail metrics: {e}")
+
+
+def get_metrics():
+    """Return the delivery counters with derived throughput figures."""
+    raw = get_queue().connection.hgetall(METRICS_KEY)
+    metrics = {name.decode(): float(value) for name, value in raw.items()}
+    for name in ('connections', 'batches', 'sent', 'failed', 'send_seconds'):
+        metrics.setdefault(name, 0)
+
+    seconds = metrics['send_seconds']
+    metrics['messages_per_second'] = round(metrics['sent'] / seconds, 1) if seconds else 0
+    metrics['messages_per_connection'] = round(metrics['sent'] / metrics['connections'], 1) if metrics['connections'] else 0
+    return metrics
+
+
+def reset_metrics():
+    get_queue().connection.delete(METRICS_KEY)
+
+
+def dead_letter(mail, attempts, error):
+    """Keep an undeliverable email for inspection and manual requeue."""
+    entry = dict(mail, attempts=attempts, error=str(error), failed_at=timezone.now().isoformat())
+    connection = get_queue().connection
+    connection.lpush(DEAD_LETTER_KEY, json.dumps(entry))
+    connection.ltrim(DEAD_LETTER_KEY, 0, DEAD_LETTER_LIMIT - 1)
+
+
+def get_dead_letters():
+    """Return the dead-lettered emails, newest first."""
+    return [json.loads(entry) for entry in get_queue().connection.lrange(DEAD_LETTER_KEY, 0, -1)]
+
+
+def requeue_dead_letters():
+    """Move every dead-lettered email back onto the queue. Returns how many."""
+    queue = get_queue()
+    count = 0
+    while True:
+        entry = queue.connection.rpop(DEAD_LETTER_KEY)
+        if entry is None:
+            break
+        mail = json.loads(entry)
+        for field in ('attempts', 'error', 'failed_at'):
+            mail.pop(field, None)
+        queue.enqueue(deliver_mail, [mail])
+        count += 1
+    return count
+
+
+def clear_dead_letters():
+    get_queue().connection.delete(DEAD_LETTER_KEY)
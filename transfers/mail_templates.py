@@ -0,0 +1,38 @@
+"""
+Rendering of notification emails.
+
+Each email is three templates under templates/mailing/transfers/:
+<name>.subject.txt, <name>.txt and <name>.html, rendered together from one
+context. Templates are compiled once per process and kept, so a burst of
+notifications only pays for rendering. Text comes from the translation
+catalog of the given language ({{ i18n.<code_name> }}), with the English
+wording as the template default.
+"""
+from functools import lru_cache
+
+from django.template.loader import get_template
+
+from translations.models.translation import Translation
+
+
+@lru_cache(maxsize=None)
+def get_mail_template(path):
+    """Return the compiled template at path, loading it on first use."""
+    return get_template(path)
+
+
+def get_mail_texts(lang):
+    return Translation.get_text_by_lang(lang)
+
+
+def render_mail(name, context, lang='en'):
+    """Render an email. Returns (subject, text, html)."""
+    context = dict(context, i18n=get_mail_texts(lang))
+    base = f'mailing/transfers/{name}'
+
+    subject = get_mail_template(f'{base}.subject.txt').render(context)
+    text = get_mail_template(f'{base}.txt').render(context)
+    html = get_mail_template(f'{base}.html').render(context)
+
+    # Subjects must be a single line
+    return ' '.join(subject.split()), text.strip() + '\n', html
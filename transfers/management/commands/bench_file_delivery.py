@@ -0,0 +1,93 @@
+import os
+import tempfile
+import time
+
+from django.core.management import BaseCommand
+from django.http import FileResponse
+
+from transfers.delivery import get_block_size
+from transfers.storage import open_for_sendfile, RangeFile
+
+
+class Command(BaseCommand):
+    help = 'Compare throughput and CPU per GB of the file delivery paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=512, help='Size of the test file')
+        parser.add_argument('--rounds', type=int, default=3, help='Runs per method (best is reported)')
+        parser.add_argument('--path', help='Use an existing file instead of a temporary one')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        temp_path = None
+
+        if not path:
+            fd, temp_path = tempfile.mkstemp(prefix='bench_delivery_')
+            with os.fdopen(fd, 'wb') as f:
+                block = os.urandom(1024 * 1024)
+                for _ in range(options['size_mb']):
+                    f.write(block)
+            path = temp_path
+
+        size = os.path.getsize(path)
+        methods = [
+            ('FileResponse(open()) [old path]', self.file_response),
+            (f'FileResponse tuned ({get_block_size() // 1024} KB blocks)', self.tuned_file_response),
+            ('os.sendfile (wsgi.file_wrapper)', self.sendfile),
+        ]
+
+        try:
+            print(f'File: {path} ({size / (1024 ** 2):.0f} MB)')
+            for name, method in methods:
+                best = None
+                for _ in range(options['rounds']):
+                    with open(os.devnull, 'wb') as sink:
+                        wall_start = time.perf_counter()
+                        cpu_start = time.process_time()
+                        sent = method(path, size, sink)
+                        cpu = time.process_time() - cpu_start
+                        wall = time.perf_counter() - wall_start
+                    assert sent == size, f'{name} sent {sent} of {size} bytes'
+                    if best is None or wall < best[0]:
+                        best = (wall, cpu)
+
+                wall, cpu = best
+                gigabytes = size / (1024 ** 3)
+                print(
+                    f'{name:45s} {size / (1024 ** 2) / wall:9.0f} MB/s'
+                    f'   {cpu / gigabytes:7.3f} CPU s/GB'
+                )
+        finally:
+            if temp_path:
+                os.remove(temp_path)
+
+    @staticmethod
+    def _drain(response, sink):
+        sent = 0
+        for chunk in response:
+            sink.write(chunk)
+            sent += len(chunk)
+        response.close()
+        return sent
+
+    def file_response(self, path, size, sink):
+        """What the views did before: default FileResponse block size, Python loop."""
+        return self._drain(FileResponse(open(path, 'rb')), sink)
+
+    def tuned_file_response(self, path, size, sink):
+        """Python fallback of the current path (no wsgi.file_wrapper available)."""
+        response = FileResponse(RangeFile(open_for_sendfile(path), 0, size))
+        response.block_size = get_block_size()
+        return self._drain(response, sink)
+
+    @staticmethod
+    def sendfile(path, size, sink):
+        """What gunicorn's file wrapper does with the descriptor we hand it."""
+        sent = 0
+        with open_for_sendfile(path) as f:
+            while sent < size:
+                count = os.sendfile(sink.fileno(), f.fileno(), sent, size - sent)
+                if count == 0:
+                    break
+                sent += count
+        return sent
@@ -0,0 +1,100 @@
+import time
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.template.loader import get_template
+from django.utils import timezone
+
+from transfers.mail_templates import get_mail_template, get_mail_texts, render_mail
+from transfers.models import Transfer
+
+TEMPLATES = ['transfer-ready', 'download', 'portal-upload', 'verification-code']
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-message cost of rendering notification emails in a burst'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=5000, help='Messages rendered per template')
+        parser.add_argument('--lang', default='en', help='Language of the texts')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        lang = options['lang']
+        now = timezone.now()
+
+        # Unsaved, so nothing is written
+        transfer = Transfer(
+            short_id='bench123',
+            title='Quarterly report',
+            sender_email='sender@example.com',
+            message='Here are the files <we> talked about',
+            file_count=12,
+            total_size=734003200,
+            download_count=3,
+            max_downloads=10,
+            expires_at=now + timedelta(days=7),
+        )
+        contexts = {
+            'transfer-ready': {
+                'sender_email': transfer.sender_email,
+                'message': transfer.message,
+                'file_count': transfer.file_count,
+                'size': transfer.format_size(),
+                'expires_at': transfer.expires_at,
+                'password_protected': False,
+                'share_url': transfer.share_url,
+            },
+            'download': {
+                'transfer_title': transfer.title,
+                'file_count': transfer.file_count,
+                'size': transfer.format_size(),
+                'downloaded_at': now,
+                'download_count': transfer.download_count,
+                'downloads_remaining': transfer.max_downloads - transfer.download_count,
+                'share_url': transfer.share_url,
+            },
+            'portal-upload': {
+                'portal_name': 'Client uploads',
+                'uploader': 'client@example.com',
+                'message': 'Signed contracts attached',
+                'file_count': transfer.file_count,
+                'size': transfer.format_size(),
+                'uploaded_at': now,
+                'share_url': transfer.share_url,
+                'manage_url': 'https://example.com/portals/client-uploads/',
+            },
+            'verification-code': {
+                'transfer_title': transfer.title,
+                'code': '123456',
+            },
+        }
+
+        print(f'{count} messages per template, language {lang}')
+        for name in TEMPLATES:
+            context = contexts[name]
+
+            get_mail_template.cache_clear()
+            started = time.perf_counter()
+            render_mail(name, context, lang)
+            cold = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for _ in range(count):
+                render_mail(name, context, lang)
+            warm = (time.perf_counter() - started) / count
+
+            # Loading the templates for every message, as a view would without
+            # the cached loader (DEBUG)
+            i18n = get_mail_texts(lang)
+            started = time.perf_counter()
+            for _ in range(min(count, 500)):
+                for suffix in ('subject.txt', 'txt', 'html'):
+                    get_template(f'mailing/transfers/{name}.{suffix}').render(dict(context, i18n=i18n))
+            uncached = (time.perf_counter() - started) / min(count, 500)
+
+            print(
+                f'{name:20s} first {cold * 1000:7.2f} ms'
+                f'   cached {warm * 1e6:8.1f} us/msg ({1 / warm:7.0f} msg/s)'
+                f'   loading per send {uncached * 1e6:8.1f} us/msg'
+            )
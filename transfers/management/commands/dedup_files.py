@@ -0,0 +1,76 @@
+import hashlib
+import os
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from transfers.analytics import format_bytes
+from transfers.hashing import hash_file_range
+from transfers.models import Blob, TransferFile
+
+
+class Command(BaseCommand):
+    help = 'Move existing transfer files into the blob store, deduplicating identical content'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Files loaded per query')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be reclaimed')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        queryset = TransferFile.objects.filter(blob__isnull=True, upload_complete=True).exclude(stored_name='').order_by('id')
+
+        # Hashes seen in this run, for dry-run accounting
+        seen = set()
+        migrated = 0
+        duplicates = 0
+        missing = 0
+        reclaimed = 0
+
+        last_id = None
+        while True:
+            batch = queryset
+            if last_id is not None:
+                batch = batch.filter(id__gt=last_id)
+            batch = list(batch[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            for transfer_file in batch:
+                path = transfer_file.storage_path
+                if not os.path.exists(path):
+                    missing += 1
+                    continue
+
+                checksum = transfer_file.checksum
+                if not checksum:
+                    checksum = hash_file_range(hashlib.sha256(), path, 0, os.path.getsize(path)).hexdigest()
+
+                if dry_run:
+                    if checksum in seen or Blob.objects.filter(sha256=checksum).exists():
+                        duplicates += 1
+                        reclaimed += transfer_file.size
+                    seen.add(checksum)
+                    continue
+
+                # Hard-link into the store so the old path stays valid until
+                # the row points at the blob
+                temp_path = Blob.temp_path()
+                os.link(path, temp_path)
+                with transaction.atomic():
+                    blob, created = Blob.store(temp_path, checksum, transfer_file.size)
+                    TransferFile.objects.filter(id=transfer_file.id).update(blob=blob, checksum=checksum)
+                os.remove(path)
+
+                migrated += 1
+                if not created:
+                    duplicates += 1
+                    reclaimed += transfer_file.size
+
+        if dry_run:
+            print('Dry run: %s duplicate files, %s would be reclaimed (%s files missing)' % (
+                duplicates, format_bytes(reclaimed), missing))
+        else:
+            print('Moved %s files into the blob store: %s duplicates, %s reclaimed (%s files missing)' % (
+                migrated, duplicates, format_bytes(reclaimed), missing))
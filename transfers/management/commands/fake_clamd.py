@@ -0,0 +1,31 @@
+import time
+
+from django.core.management import BaseCommand
+
+from transfers.clamd import DEFAULT_ADDRESS
+from transfers.fake_clamd import FakeClamd
+
+
+class Command(BaseCommand):
+    help = 'Run a fake clamd (flags the EICAR test string) for development without ClamAV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', default=DEFAULT_ADDRESS, help='Unix socket path or host:port to listen on')
+        parser.add_argument('--max-stream-mb', type=int, default=25, help='Reject streams longer than this, like StreamMaxLength')
+        parser.add_argument('--delay', type=float, default=0, help='Seconds to wait before each scan result')
+
+    def handle(self, *args, **options):
+        clamd = FakeClamd(
+            options['address'],
+            max_stream_length=options['max_stream_mb'] * 1024 * 1024,
+            delay=options['delay'],
+        ).start()
+        print('Fake clamd listening on %s (set CLAMD_ADDRESS to match), Ctrl-C to stop' % clamd.address)
+
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            clamd.stop()
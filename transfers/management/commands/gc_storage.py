@@ -0,0 +1,44 @@
+from django.core.management import BaseCommand
+
+from transfers.analytics import format_bytes
+from transfers.storage_gc import GC_GRACE, Collector
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned uploads and stored data no longer referenced by the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+        parser.add_argument('--grace-hours', type=float, default=GC_GRACE / 3600, help='Leave anything younger than this alone')
+        parser.add_argument('--workers', type=int, default=8, help='Threads listing storage in parallel')
+        parser.add_argument('--rate', type=float, default=50, help='Max deletions per second (0 for no limit)')
+        parser.add_argument('--restart', action='store_true', help='Ignore the cursor of an interrupted run')
+
+    def handle(self, *args, **options):
+        stats = Collector(
+            dry_run=options['dry_run'],
+            grace=int(options['grace_hours'] * 3600),
+            workers=options['workers'],
+            rate=options['rate'],
+            resume=not options['restart'],
+        ).run()
+
+        prefix = 'Would delete' if stats['dry_run'] else 'Deleted'
+        print('%s %s abandoned transfers (%s files, %s)' % (
+            prefix,
+            stats['abandoned_transfers'],
+            stats['abandoned_files'],
+            format_bytes(stats['abandoned_bytes']),
+        ))
+        print('%s %s blobs without files (%s)' % (
+            prefix,
+            stats['orphan_blob_rows'],
+            format_bytes(stats['orphan_blob_rows_bytes']),
+        ))
+        print('%s %s of %s stored objects with no database row (%s)' % (
+            prefix,
+            stats['orphans'],
+            stats['scanned'],
+            format_bytes(stats['orphan_bytes']),
+        ))
+        print('%s errors in %ss' % (stats['errors'], stats['seconds']))
@@ -0,0 +1,32 @@
+from django.core.management import BaseCommand
+
+from transfers.mail_queue import clear_dead_letters, get_dead_letters, requeue_dead_letters
+
+
+class Command(BaseCommand):
+    help = 'Show emails that could not be delivered after all retries, or requeue them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requeue', action='store_true', help='Put every dead letter back on the mail queue')
+        parser.add_argument('--clear', action='store_true', help='Delete every dead letter')
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            print('Requeued %s emails' % requeue_dead_letters())
+            return
+
+        if options['clear']:
+            clear_dead_letters()
+            print('Dead letters cleared')
+            return
+
+        dead_letters = get_dead_letters()
+        for mail in dead_letters:
+            print('%s  %s  "%s"  after %s attempts: %s' % (
+                mail['failed_at'],
+                mail['to'],
+                mail['subject'],
+                mail['attempts'],
+                mail['error'],
+            ))
+        print('%s dead letters' % len(dead_letters))
@@ -0,0 +1,25 @@
+from django.core.management import BaseCommand
+
+from transfers.mail_queue import get_metrics, reset_metrics
+
+
+class Command(BaseCommand):
+    help = 'Show outbound mail delivery counters and throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after showing them')
+
+    def handle(self, *args, **options):
+        metrics = get_metrics()
+
+        print('Sent: %d, failed: %d' % (metrics['sent'], metrics['failed']))
+        print('Jobs: %d, SMTP connections opened: %d (%s messages per connection)' % (
+            metrics['batches'],
+            metrics['connections'],
+            metrics['messages_per_connection'],
+        ))
+        print('Time sending: %.1fs (%s messages/s)' % (metrics['send_seconds'], metrics['messages_per_second']))
+
+        if options['reset']:
+            reset_metrics()
+            print('Counters reset')
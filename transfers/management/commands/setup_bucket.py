@@ -0,0 +1,48 @@
+from django.core.management import BaseCommand, CommandError
+
+from transfers.storage import S3Storage, get_storage
+
+
+class Command(BaseCommand):
+    help = 'Create the S3_STORAGE bucket with the CORS and lifecycle rules direct uploads need (e.g. on a local MinIO)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--origin', action='append', help='Site origin allowed to upload (repeatable, default: *)')
+        parser.add_argument('--abort-days', type=int, default=1, help='Abort incomplete multipart uploads after this many days')
+
+    def handle(self, *args, **options):
+        from botocore.exceptions import ClientError
+
+        storage = get_storage()
+        if not isinstance(storage, S3Storage):
+            raise CommandError("STORAGE_BACKEND is not 's3'")
+
+        client = storage.client
+        try:
+            client.head_bucket(Bucket=storage.bucket)
+            print(f'Bucket {storage.bucket} exists')
+        except ClientError:
+            client.create_bucket(Bucket=storage.bucket)
+            print(f'Created bucket {storage.bucket}')
+
+        # Browsers PUT the parts straight to the bucket and read back each ETag
+        client.put_bucket_cors(Bucket=storage.bucket, CORSConfiguration={
+            'CORSRules': [{
+                'AllowedOrigins': options['origin'] or ['*'],
+                'AllowedMethods': ['GET', 'PUT'],
+                'AllowedHeaders': ['*'],
+                'ExposeHeaders': ['ETag'],
+                'MaxAgeSeconds': 3600,
+            }],
+        })
+        print('Set CORS for direct uploads')
+
+        client.put_bucket_lifecycle_configuration(Bucket=storage.bucket, LifecycleConfiguration={
+            'Rules': [{
+                'ID': 'abort-incomplete-uploads',
+                'Status': 'Enabled',
+                'Filter': {'Prefix': storage.prefix},
+                'AbortIncompleteMultipartUpload': {'DaysAfterInitiation': options['abort_days']},
+            }],
+        })
+        print(f"Incomplete multipart uploads are aborted after {options['abort_days']} days")
@@ -0,0 +1,121 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from transfers.models import TransferFile, TusUpload
+from transfers.storage import get_storage, shard_name, sharded_path
+from transfers.tus_views import get_info_path, get_tus_upload_path
+
+
+class Command(BaseCommand):
+    help = 'Move flat transfers/ and tus_uploads/ files into the sharded layout while the site is running'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Files moved per batch')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        if get_storage().is_local:
+            moved, missing = self.shard_transfer_files(options['batch_size'], options['sleep'])
+            print('Moved %s transfer files (%s missing on disk)' % (moved, missing))
+        else:
+            print('Transfer files are not on local storage; only moving tus uploads')
+
+        moved, skipped = self.shard_tus_uploads()
+        print('Moved %s tus uploads (%s busy, run again later)' % (moved, skipped))
+
+    @staticmethod
+    def shard_transfer_files(batch_size, sleep):
+        """
+        Move legacy (non-blob) files into transfers/ab/cd/.
+
+        Each file is hard-linked to its new path, the row is switched, and
+        only then is the old name removed, so downloads keep working
+        throughout.
+        """
+        transfers_dir = os.path.join(settings.MEDIA_ROOT, 'transfers')
+        queryset = TransferFile.objects.filter(blob__isnull=True).exclude(stored_name__contains='/').exclude(stored_name='').order_by('id')
+        moved = 0
+        missing = 0
+
+        last_id = None
+        while True:
+            batch = queryset
+            if last_id is not None:
+                batch = batch.filter(id__gt=last_id)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            for transfer_file in batch:
+                old_path = os.path.join(transfers_dir, transfer_file.stored_name)
+                new_path = sharded_path(transfers_dir, transfer_file.stored_name, create=True)
+
+                if not os.path.exists(new_path):
+                    if not os.path.exists(old_path):
+                        missing += 1
+                        continue
+                    os.link(old_path, new_path)
+
+                # Only switch rows nobody changed in the meantime
+                updated = TransferFile.objects.filter(
+                    id=transfer_file.id,
+                    stored_name=transfer_file.stored_name,
+                ).update(stored_name=shard_name(transfer_file.stored_name))
+
+                if updated:
+                    if os.path.exists(old_path):
+                        os.remove(old_path)
+                    moved += 1
+                elif not TransferFile.objects.filter(id=transfer_file.id).exists():
+                    # Deleted meanwhile; don't leave our link behind
+                    os.remove(new_path)
+
+            if sleep:
+                time.sleep(sleep)
+
+        return moved, missing
+
+    @staticmethod
+    def shard_tus_uploads():
+        """Move in-progress tus uploads, holding each one's write lease while it moves."""
+        tus_dir = get_tus_upload_path()
+        moved = 0
+        skipped = 0
+
+        for upload in TusUpload.objects.all().iterator():
+            new_path = sharded_path(tus_dir, upload.id)
+            if upload.file_path == new_path:
+                continue
+
+            try:
+                upload, token = TusUpload.acquire(upload.id, upload.offset)
+            except (TusUpload.DoesNotExist, TusUpload.Locked, TusUpload.OffsetMismatch):
+                skipped += 1
+                continue
+
+            try:
+                old_path = upload.file_path
+                pairs = [(old_path, new_path)]
+                if os.path.exists(get_info_path(old_path)):
+                    pairs.append((get_info_path(old_path), get_info_path(new_path)))
+
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                for source, target in pairs:
+                    if not os.path.exists(target):
+                        os.link(source, target)
+
+                updated = TusUpload.objects.filter(id=upload.id, lock_token=token).update(file_path=new_path)
+                for source, target in pairs:
+                    os.remove(source if updated else target)
+                if updated:
+                    moved += 1
+                else:
+                    skipped += 1
+            finally:
+                upload.release(token)
+
+        return moved, skipped
@@ -0,0 +1,32 @@
+from django.core.management import BaseCommand
+
+from transfers.analytics import format_bytes
+from transfers.sweeper import sweep
+
+
+class Command(BaseCommand):
+    help = 'Delete files of expired and deleted transfers and abandoned tus uploads (run from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Transfers loaded per batch')
+        parser.add_argument('--rate', type=float, default=50, help='Max file deletions per second (0 for no limit)')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        stats = sweep(
+            batch_size=options['batch_size'],
+            rate=options['rate'],
+            max_batches=options['max_batches'],
+            pause=options['pause'],
+        )
+
+        print('Purged %s transfers (%s files, %s reclaimed), %s tus uploads (%s reclaimed), %s errors in %ss' % (
+            stats['transfers'],
+            stats['files'],
+            format_bytes(stats['bytes_reclaimed']),
+            stats['tus_uploads'],
+            format_bytes(stats['tus_bytes_reclaimed']),
+            stats['errors'],
+            stats['seconds'],
+        ))
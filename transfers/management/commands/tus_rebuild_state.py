@@ -0,0 +1,42 @@
+import os
+
+from django.core.management import BaseCommand
+
+from transfers.models import TusUpload
+from transfers.tus_views import get_tus_upload_path, rebuild_upload
+
+
+class Command(BaseCommand):
+    help = 'Rebuild missing tus upload state from the files in tus_uploads/ (flat or sharded)'
+
+    def handle(self, *args, **options):
+        upload_dir = get_tus_upload_path()
+        known = set(TusUpload.objects.values_list('id', flat=True))
+        rebuilt = 0
+        reconciled = 0
+
+        names = [
+            name
+            for _, _, files in os.walk(upload_dir)
+            for name in files
+            if not name.endswith('.info')
+        ]
+
+        for name in names:
+
+            if name in known:
+                upload = TusUpload.objects.get(id=name)
+                offset = upload.offset
+                if upload.reconcile() != offset:
+                    reconciled += 1
+                    print('Reconciled %s: %s -> %s' % (name, offset, upload.offset))
+                continue
+
+            upload = rebuild_upload(name)
+            if upload:
+                rebuilt += 1
+                print('Rebuilt %s at offset %s/%s' % (name, upload.offset, upload.length))
+            else:
+                print('Skipped %s (no metadata or transfer)' % name)
+
+        print('Rebuilt %s uploads, reconciled %s' % (rebuilt, reconciled))
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfers', '0007_add_team_to_transfer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TusUpload',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=512)),
+                ('filetype', models.CharField(default='application/octet-stream', max_length=255)),
+                ('length', models.BigIntegerField()),
+                ('offset', models.BigIntegerField(default=0)),
+                ('file_path', models.CharField(max_length=1024)),
+                ('lock_token', models.CharField(blank=True, max_length=32)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('transfer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tus_uploads', to='transfers.transfer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='transfers_t_updated_ebfcc7_idx')],
+            },
+        ),
+    ]
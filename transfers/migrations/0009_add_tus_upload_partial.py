@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfers', '0008_add_tus_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tusupload',
+            name='is_partial',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfers', '0009_add_tus_upload_partial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tusupload',
+            name='hash_state',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tusupload',
+            name='hash_offset',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfers', '0011_add_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='purged_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transfers', '0012_add_transfer_purged_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transferfile',
+            index=models.Index(fields=['stored_name'], name='transfers_t_stored__d46e99_idx'),
+        ),
+    ]
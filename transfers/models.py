@@ -2,11 +2,14 @@ import uuid
 import os
 from datetime import timedelta
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils import timezone
 from django.conf import settings
 
 from accounts.models import CustomUser, Team
+from transfers.storage import get_storage, shard_name
 
 
 def generate_short_id():
@@ -125,6 +128,7 @@ class Transfer(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=UPLOADING)
     total_size = models.BigIntegerField(default=0)
     file_count = models.PositiveIntegerField(default=0)
+    purged_at = models.DateTimeField(null=True, blank=True)  # Files removed by the sweeper
 
     class Meta:
         ordering = ['-created_at']
@@ -164,7 +168,8 @@ class Transfer(models.Model):
 
     @property
     def is_expired(self):
-        return timezone.now() > self.expires_at or self.status == self.EXPIRED
+        # Purged transfers keep their rows but no longer have any data
+        return timezone.now() > self.expires_at or self.status == self.EXPIRED or self.purged_at is not None
 
     @property
     def is_download_limited(self):
@@ -247,6 +252,102 @@ class Transfer(models.Model):
         return self.virus_scan_status == self.SCAN_CLEAN
 
 
+class Blob(models.Model):
+    """
+    Content-addressed file data, shared by every TransferFile with the same
+    SHA-256.
+
+    Stored once under the storage key blobs/ab/cd/<sha256>; ref_count
+    tracks the TransferFiles pointing at it and the data is removed with the
+    last one.
+    """
+
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count} refs)"
+
+    @staticmethod
+    def get_blob_dir():
+        return os.path.join(settings.MEDIA_ROOT, 'blobs')
+
+    @staticmethod
+    def key_for(sha256):
+        """Return the storage key for a blob hash."""
+        return f'blobs/{shard_name(sha256)}'
+
+    @classmethod
+    def temp_path(cls):
+        """
+        Return a new local temporary path for data headed to the store.
+
+        Uploads are written here first; with local storage adding them is a
+        rename on the same filesystem.
+        """
+        temp_dir = os.path.join(cls.get_blob_dir(), 'tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        return os.path.join(temp_dir, uuid.uuid4().hex)
+
+    @property
+    def storage_key(self):
+        return self.key_for(self.sha256)
+
+    @classmethod
+    def store(cls, source_path, sha256, size):
+        """
+        Add a reference to the blob for a file with this content.
+
+        The source file is moved into the store, or deleted if the content is
+        already there. Returns (blob, created).
+        """
+        storage = get_storage()
+        with transaction.atomic():
+            blob, created = cls.objects.select_for_update().get_or_create(
+                sha256=sha256,
+                defaults={'size': size},
+            )
+
+            if created or not storage.exists(blob.storage_key):
+                storage.save(blob.storage_key, source_path)
+                created = True
+            else:
+                os.remove(source_path)
+
+            blob.ref_count += 1
+            blob.save(update_fields=['ref_count'])
+
+        return blob, created
+
+    @classmethod
+    def release(cls, sha256):
+        """
+        Drop a reference, deleting the blob with its last one.
+
+        Returns True if the data was removed.
+        """
+        with transaction.atomic():
+            try:
+                blob = cls.objects.select_for_update().get(sha256=sha256)
+            except cls.DoesNotExist:
+                return False
+
+            if blob.ref_count > 1:
+                blob.ref_count -= 1
+                blob.save(update_fields=['ref_count'])
+                return False
+
+            # Removed while the row is locked, so a concurrent store() of the
+            # same content waits and then puts a fresh copy in place. The key
+            # is read first: delete() clears the primary key
+            key = blob.storage_key
+            blob.delete()
+            get_storage().delete(key)
+        return True
+
+
 class TransferFile(models.Model):
     """A single file within a transfer."""
 
@@ -268,6 +369,20 @@ class TransferFile(models.Model):
         (PREVIEW_NONE, 'No Preview'),
     ]
 
+    # Formats that are already compressed; deflating them again only burns CPU
+    COMPRESSED_EXTENSIONS = [
+        'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'avif',  # Images
+        'mp4', 'mov', 'avi', 'mkv', 'webm', 'm4v', 'wmv', 'flv',  # Video
+        'mp3', 'aac', 'ogg', 'flac', 'm4a', 'opus', 'wma',  # Audio
+        'zip', 'rar', '7z', 'gz', 'tgz', 'bz2', 'xz', 'zst', 'lz4',  # Archives
+        'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp', 'epub', 'jar', 'apk',  # Zip containers
+    ]
+    COMPRESSED_MIME_TYPES = [
+        'application/zip', 'application/gzip', 'application/x-7z-compressed',
+        'application/x-rar-compressed', 'application/vnd.rar', 'application/x-xz',
+        'application/x-bzip2', 'application/zstd',
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     transfer = models.ForeignKey(
         Transfer,
@@ -277,10 +392,17 @@ class TransferFile(models.Model):
 
     # File info
     original_name = models.CharField(max_length=512)
-    stored_name = models.CharField(max_length=128)  # UUID-based for storage
+    stored_name = models.CharField(max_length=128)  # UUID-based, relative to MEDIA_ROOT/transfers (ab/cd/<name>)
     size = models.BigIntegerField()
     mime_type = models.CharField(max_length=255, default='application/octet-stream')
     checksum = models.CharField(max_length=64, blank=True)  # SHA-256
+    blob = models.ForeignKey(
+        Blob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='files'
+    )  # Shared content; files stored before dedup have none
 
     # Preview fields
     preview_type = models.CharField(max_length=10, choices=PREVIEW_TYPES, default=PREVIEW_NONE)
@@ -293,6 +415,9 @@ class TransferFile(models.Model):
 
     class Meta:
         ordering = ['original_name']
+        indexes = [
+            models.Index(fields=['stored_name']),
+        ]
 
     def __str__(self):
         return self.original_name
@@ -306,10 +431,31 @@ class TransferFile(models.Model):
             size /= 1024
         return f"{size:.1f} PB"
 
+    @property
+    def storage_key(self):
+        """Return the key of the stored data in the storage backend."""
+        if self.blob_id:
+            return Blob.key_for(self.blob_id)
+        return f'transfers/{self.stored_name}'
+
     @property
     def storage_path(self):
-        """Return the full path to the stored file."""
-        return os.path.join(settings.MEDIA_ROOT, 'transfers', self.stored_name)
+        """Return the full path to the stored file (local storage only)."""
+        return os.path.join(settings.MEDIA_ROOT, self.storage_key)
+
+    def release_storage(self):
+        """
+        Free this file's data: drop the blob reference, or remove the legacy file.
+
+        Returns the number of bytes actually freed (0 while a shared blob
+        still has other references).
+        """
+        if self.blob_id:
+            return self.size if Blob.release(self.blob_id) else 0
+        if self.stored_name:
+            get_storage().delete(self.storage_key)
+            return self.size
+        return 0
 
     @property
     def extension(self):
@@ -342,6 +488,18 @@ class TransferFile(models.Model):
         else:
             return 'file'
 
+    @property
+    def is_compressed_format(self):
+        """Check if the file is already compressed (stored as-is in ZIPs)."""
+        if self.extension in self.COMPRESSED_EXTENSIONS:
+            return True
+        mime = self.mime_type.lower()
+        if mime.startswith('video/') or mime in ('audio/mpeg', 'audio/aac', 'audio/ogg', 'audio/flac'):
+            return True
+        if mime in ('image/jpeg', 'image/png', 'image/gif', 'image/webp'):
+            return True
+        return mime in self.COMPRESSED_MIME_TYPES
+
     def detect_preview_type(self):
         """Detect the preview type based on file extension and mime type."""
         ext = self.extension
@@ -687,3 +845,190 @@ class DownloadEvent(models.Model):
 
     def __str__(self):
         return f"Download of {self.transfer.short_id} at {self.downloaded_at}"
+
+
+class TusUpload(models.Model):
+    """
+    Durable state of an in-progress tus resumable upload.
+
+    Writers take a short lease on the row (lock_token/locked_until) so only
+    one PATCH can append at a time, and the offset only moves through a
+    compare-and-set on that lease.
+    """
+
+    class Locked(Exception):
+        """Another request is currently writing to this upload."""
+
+    class OffsetMismatch(Exception):
+        """The client's Upload-Offset does not match the stored offset."""
+
+        def __init__(self, offset):
+            super().__init__(f"Offset mismatch, expected {offset}")
+            self.offset = offset
+
+    # How long a writer's lease lasts without being renewed
+    LOCK_TIMEOUT = timedelta(minutes=5)
+
+    id = models.CharField(max_length=32, primary_key=True)
+    transfer = models.ForeignKey(
+        Transfer,
+        on_delete=models.CASCADE,
+        related_name='tus_uploads'
+    )
+
+    filename = models.CharField(max_length=512)
+    filetype = models.CharField(max_length=255, default='application/octet-stream')
+    length = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    file_path = models.CharField(max_length=1024)
+
+    # Partial uploads (concatenation extension) are stitched into a final
+    # upload instead of becoming a TransferFile themselves
+    is_partial = models.BooleanField(default=False)
+
+    # Saved SHA-256 context covering the first hash_offset bytes, so a
+    # resumed upload doesn't re-read what is already on disk
+    hash_state = models.BinaryField(null=True, blank=True)
+    hash_offset = models.BigIntegerField(default=0)
+
+    # Write lease
+    lock_token = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.offset}/{self.length})"
+
+    @property
+    def is_locked(self):
+        return bool(self.lock_token) and self.locked_until is not None and self.locked_until > timezone.now()
+
+    @property
+    def is_complete(self):
+        return self.offset >= self.length
+
+    @classmethod
+    def acquire(cls, upload_id, client_offset):
+        """
+        Take the write lease for an upload at the client's offset.
+
+        Returns (upload, token). Raises Locked if another writer holds a live
+        lease, OffsetMismatch if the client is not at the stored offset, and
+        DoesNotExist if the upload is unknown.
+        """
+        with transaction.atomic():
+            upload = cls.objects.select_for_update().get(id=upload_id)
+            if upload.is_locked:
+                raise cls.Locked()
+            if client_offset != upload.offset:
+                raise cls.OffsetMismatch(upload.offset)
+
+            upload.lock_token = uuid.uuid4().hex
+            upload.locked_until = timezone.now() + cls.LOCK_TIMEOUT
+            upload.save(update_fields=['lock_token', 'locked_until', 'updated_at'])
+
+        return upload, upload.lock_token
+
+    def advance(self, token, new_offset, hash_state=None):
+        """
+        Move the offset forward and renew the lease, if we still hold it.
+
+        hash_state, when given, is the checksum state covering the data up to
+        new_offset and is saved along with it.
+
+        Returns False when the lease was lost (expired and taken over), in
+        which case the caller must stop writing.
+        """
+        now = timezone.now()
+        fields = {
+            'offset': new_offset,
+            'locked_until': now + self.LOCK_TIMEOUT,
+            'updated_at': now,
+        }
+        if hash_state is not None:
+            fields['hash_state'] = hash_state
+            fields['hash_offset'] = new_offset
+
+        updated = TusUpload.objects.filter(id=self.id, lock_token=token).update(**fields)
+        if updated:
+            self.offset = new_offset
+            if hash_state is not None:
+                self.hash_state = hash_state
+                self.hash_offset = new_offset
+        return bool(updated)
+
+    def renew(self, token):
+        """Extend the lease without moving the offset. Returns False if lost."""
+        now = timezone.now()
+        updated = TusUpload.objects.filter(id=self.id, lock_token=token).update(
+            locked_until=now + self.LOCK_TIMEOUT,
+            updated_at=now,
+        )
+        return bool(updated)
+
+    def release(self, token):
+        """Give up the write lease."""
+        TusUpload.objects.filter(id=self.id, lock_token=token).update(
+            lock_token='',
+            locked_until=None,
+        )
+        self.lock_token = ''
+        self.locked_until = None
+
+    def reconcile(self):
+        """
+        Make the file on disk match the stored offset.
+
+        Bytes past the offset come from a request that died before
+        committing them and were never verified against its Upload-Checksum,
+        so they are cut off and the client sends them again. If the file is
+        shorter than the offset (data lost), the offset moves back to it.
+
+        Skipped while a writer holds the lease. Returns the current offset.
+        """
+        if self.is_locked:
+            return self.offset
+
+        try:
+            disk_size = os.path.getsize(self.file_path)
+        except OSError:
+            disk_size = 0
+
+        if disk_size == self.offset:
+            return self.offset
+
+        try:
+            upload, token = TusUpload.acquire(self.id, self.offset)
+        except (TusUpload.DoesNotExist, TusUpload.Locked, TusUpload.OffsetMismatch):
+            return self.offset
+
+        try:
+            if disk_size > upload.offset:
+                with open(self.file_path, 'r+b') as f:
+                    f.truncate(upload.offset)
+            else:
+                TusUpload.objects.filter(id=self.id, lock_token=token).update(offset=disk_size)
+                self.offset = disk_size
+        finally:
+            upload.release(token)
+
+        return self.offset
+
+
+@receiver(post_delete, sender=TransferFile)
+def release_transfer_file_storage(sender, instance, **kwargs):
+    """
+    Release stored data whenever a TransferFile goes, including cascades.
+
+    Deferred until the deletion commits, so a rollback never leaves rows
+    pointing at removed data. Failures are only logged; the storage GC
+    collects what is left behind.
+    """
+    transaction.on_commit(instance.release_storage, robust=True)
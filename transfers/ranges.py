@@ -0,0 +1,97 @@
+"""
+HTTP Range request helpers for resumable downloads.
+
+Spec: https://www.rfc-editor.org/rfc/rfc9110#section-14
+"""
+from django.utils.http import parse_http_date_safe
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlap the representation."""
+
+
+def parse_range_header(header, size):
+    """
+    Parse a Range header into a list of (start, end) byte positions, inclusive.
+
+    Returns None when the header is missing or malformed, in which case the
+    full representation should be sent. Raises RangeNotSatisfiable when the
+    header is valid but no range overlaps the `size` available bytes.
+    """
+    if not header:
+        return None
+
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+
+        first, sep, last = part.partition('-')
+        if not sep:
+            return None
+        first, last = first.strip(), last.strip()
+
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else None
+                if end is not None and end < start:
+                    return None
+                if start >= size:
+                    # Valid but past the end; unsatisfiable unless another range fits
+                    continue
+                if end is None:
+                    end = size - 1
+            elif last:
+                # Suffix range: the final N bytes
+                suffix_length = int(last)
+                if suffix_length == 0:
+                    continue
+                start = max(size - suffix_length, 0)
+                end = size - 1
+            else:
+                return None
+        except ValueError:
+            return None
+
+        if start < 0:
+            return None
+        if start >= size:
+            continue
+
+        ranges.append((start, min(end, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    return ranges
+
+
+def if_range_matches(request, etag, last_modified=None):
+    """
+    Check an If-Range precondition.
+
+    Returns True when there is no If-Range header or it still matches the
+    current representation, meaning the Range header may be honoured.
+    """
+    if_range = request.headers.get('If-Range', '').strip()
+    if not if_range:
+        return True
+
+    # Entity tag: strong comparison only (weak tags never match)
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+
+    if last_modified is None:
+        return False
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+def content_range(start, end, size):
+    """Return a Content-Range header value."""
+    return f'bytes {start}-{end}/{size}'
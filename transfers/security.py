@@ -2,102 +2,144 @@
 Security utilities for file transfers.
 """
 import logging
-import subprocess
-import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from django.conf import settings
+from django.core.cache import cache
+
+from transfers.clamd import ClamdClient, ClamdError
+from transfers.storage import StorageError
 
 logger = logging.getLogger(__name__)
 
+# Files of one transfer streamed to clamd at the same time
+SCAN_WORKERS = 4
+
+# Verdicts are kept per signature database version; new signatures start
+# a fresh set of keys and the old ones expire
+VERDICT_CACHE_TIMEOUT = 30 * 86400
+
 
-def scan_file_for_viruses(file_path):
+def scan_file_for_viruses(client, storage, key):
     """
-    Scan a file for viruses using ClamAV (clamscan).
+    Stream stored data to clamd.
+
+    Storage failures count as scan errors, like clamd failures, so the file
+    is scanned again on the next attempt instead of failing the whole job.
 
     Returns:
-        tuple: (is_clean: bool, result_message: str)
+        tuple: (is_clean: bool or None on error, result_message: str)
     """
-    if not os.path.exists(file_path):
-        return False, "File not found"
+    try:
+        f = storage.open(key)
+    except FileNotFoundError:
+        return None, "File not found"
+    except (OSError, StorageError) as e:
+        logger.error(f"Cannot read {key} for virus scan: {e}")
+        return None, f"Storage error: {e}"
 
     try:
-        # Try clamscan first (standalone scanner)
-        result = subprocess.run(
-            ['clamscan', '--no-summary', file_path],
-            capture_output=True,
-            text=True,
-            timeout=60
-        )
+        return client.instream(f)
+    except ClamdError as e:
+        logger.error(f"Virus scan error for {key}: {e}")
+        return None, f"Scan error: {e}"
+    except Exception as e:
+        # Reads from a remote store fail with backend-specific errors
+        # (botocore, urllib3) partway through the stream
+        logger.error(f"Storage read error for {key} during virus scan: {e}")
+        return None, f"Storage error: {e}"
+    finally:
+        f.close()
 
-        if result.returncode == 0:
-            return True, "No virus found"
-        elif result.returncode == 1:
-            # Virus found
-            return False, result.stdout.strip() or "Virus detected"
-        else:
-            # Error
-            return False, f"Scan error: {result.stderr.strip()}"
 
-    except FileNotFoundError:
-        # ClamAV not installed, try clamdscan (daemon scanner)
-        try:
-            result = subprocess.run(
-                ['clamdscan', '--no-summary', file_path],
-                capture_output=True,
-                text=True,
-                timeout=60
-            )
-
-            if result.returncode == 0:
-                return True, "No virus found"
-            elif result.returncode == 1:
-                return False, result.stdout.strip() or "Virus detected"
-            else:
-                return False, f"Scan error: {result.stderr.strip()}"
+def verdict_cache_key(sha256, db_version):
+    return f'transfers:scan_verdict:{db_version}:{sha256}'
 
-        except FileNotFoundError:
-            # ClamAV not installed at all
-            logger.warning("ClamAV not installed, skipping virus scan")
-            return True, "Scan skipped (ClamAV not installed)"
 
-    except subprocess.TimeoutExpired:
-        return False, "Scan timed out"
-    except Exception as e:
-        logger.error(f"Virus scan error: {e}")
-        return False, f"Scan error: {str(e)}"
+def scan_file_cached(client, storage, transfer_file, db_version):
+    """
+    Scan a file unless its content already got a verdict from this
+    signature database. Returns (is_clean, message) like scan_file_for_viruses.
+    """
+    sha256 = transfer_file.blob_id or transfer_file.checksum
+    if not sha256 or not db_version:
+        return scan_file_for_viruses(client, storage, transfer_file.storage_key)
+
+    key = verdict_cache_key(sha256, db_version)
+    verdict = cache.get(key)
+    if verdict is not None:
+        return verdict
+
+    verdict = scan_file_for_viruses(client, storage, transfer_file.storage_key)
+    # Errors are not verdicts; the next scan should try again
+    if verdict[0] is not None:
+        cache.set(key, verdict, VERDICT_CACHE_TIMEOUT)
+    return verdict
 
 
 def scan_transfer(transfer):
     """
     Scan all files in a transfer for viruses.
 
+    Files are scanned concurrently by clamd, skipping content with a cached
+    verdict from the current signature database. virus_scan_result is updated as
+    each file finishes, and the transfer is marked infected as soon as one
+    file is; otherwise it stays pending until every file is done.
+
     Returns:
         bool: True if all files are clean
     """
     from transfers.models import Transfer
+    from transfers.storage import get_storage
 
-    all_clean = True
-    results = []
-
-    for transfer_file in transfer.files.all():
-        file_path = transfer_file.storage_path
-        is_clean, message = scan_file_for_viruses(file_path)
+    storage = get_storage()
+    client = ClamdClient()
+    workers = getattr(settings, 'VIRUS_SCAN_WORKERS', SCAN_WORKERS)
+    files = list(transfer.files.all())
 
-        if not is_clean:
-            all_clean = False
-            results.append(f"{transfer_file.original_name}: {message}")
-        else:
-            results.append(f"{transfer_file.original_name}: Clean")
+    try:
+        db_version = client.database_version()
+    except ClamdError as e:
+        # Scanning will fail the same way; report it per file below
+        logger.error(f"Cannot get ClamAV database version: {e}")
+        db_version = None
 
-    if all_clean:
-        transfer.virus_scan_status = Transfer.SCAN_CLEAN
-    else:
+    results = []
+    infected = False
+    errors = False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(scan_file_cached, client, storage, transfer_file, db_version): transfer_file
+            for transfer_file in files
+        }
+        for future in as_completed(futures):
+            transfer_file = futures[future]
+            is_clean, message = future.result()
+
+            if is_clean:
+                results.append(f"{transfer_file.original_name}: Clean")
+            else:
+                results.append(f"{transfer_file.original_name}: {message}")
+                if is_clean is None:
+                    errors = True
+                else:
+                    infected = True
+
+            if infected:
+                transfer.virus_scan_status = Transfer.SCAN_INFECTED
+            transfer.virus_scan_result = "\n".join(results)
+            transfer.save(update_fields=['virus_scan_status', 'virus_scan_result'])
+
+    if infected:
         transfer.virus_scan_status = Transfer.SCAN_INFECTED
+    elif errors:
+        transfer.virus_scan_status = Transfer.SCAN_ERROR
+    else:
+        transfer.virus_scan_status = Transfer.SCAN_CLEAN
+    transfer.save(update_fields=['virus_scan_status'])
 
-    transfer.virus_scan_result = "\n".join(results)
-    transfer.save(update_fields=['virus_scan_status', 'virus_scan_result'])
-
-    return all_clean
+    return not infected and not errors
 
 
 def check_file_extension_safety(filename):
@@ -130,76 +172,28 @@ def check_file_extension_safety(filename):
     return True, "File extension OK"
 
 
-def send_email_verification_code(transfer, recipient_email):
+def send_email_verification_code(transfer, recipient_email, lang='en'):
     """
-    Send a verification code to download files.
+    Send a verification code to download files (queued for delivery).
     """
-    from django.core.mail import send_mail
-    from django.conf import settings
+    from transfers.mail_queue import queue_mail
+    from transfers.mail_templates import render_mail
 
     code = transfer.generate_2fa_code()
 
-    subject = f"Verify your download - {transfer.title or transfer.short_id}"
-
-    message = f"""Hi,
-
-Someone is trying to download files from SendFiles.Online and has requested email verification.
-
-Your verification code is: {code}
-
-This code will expire in 10 minutes.
-
-If you did not request this, please ignore this email.
-
----
-SendFiles.Online - Fast, simple file sharing
-"""
-
-    html_message = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <style>
-        body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; line-height: 1.6; color: #333; }}
-        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-        .header {{ background: #111; color: #fff; padding: 20px; text-align: center; }}
-        .content {{ padding: 30px 20px; background: #fff; }}
-        .code {{ font-size: 32px; font-family: monospace; letter-spacing: 8px; text-align: center; padding: 20px; background: #f5f5f5; margin: 20px 0; }}
-        .footer {{ padding: 20px; text-align: center; color: #666; font-size: 12px; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1 style="margin: 0; font-size: 24px;">SENDFILES</h1>
-        </div>
-        <div class="content">
-            <h2 style="margin-top: 0;">Verify Your Download</h2>
-            <p>Someone is trying to download files and has requested email verification.</p>
-            <p>Your verification code is:</p>
-            <div class="code">{code}</div>
-            <p style="color: #666; font-size: 14px;">This code will expire in 10 minutes.</p>
-        </div>
-        <div class="footer">
-            <p>SendFiles.Online - Fast, simple file sharing</p>
-            <p>If you did not request this, please ignore this email.</p>
-        </div>
-    </div>
-</body>
-</html>
-"""
+    subject, message, html_message = render_mail('verification-code', {
+        'transfer_title': transfer.title or transfer.short_id,
+        'code': code,
+    }, lang)
 
     try:
-        send_mail(
+        queue_mail(
             subject=subject,
             message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[recipient_email],
+            recipients=[recipient_email],
             html_message=html_message,
-            fail_silently=False,
         )
         return True
     except Exception as e:
-        logger.error(f"Failed to send verification code: {e}")
+        logger.error(f"Failed to queue verification code: {e}")
         return False
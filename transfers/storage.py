@@ -0,0 +1,422 @@
+"""
+Storage for transfer file data.
+
+Everything that touches stored bytes (upload, tus finalization, download,
+ZIP, virus scanning) goes through a storage driver, selected with
+STORAGE_BACKEND in config.py:
+- 'local': files under MEDIA_ROOT (default)
+- 's3': an S3-compatible object store (AWS, MinIO, ...), configured with
+  S3_STORAGE; requires boto3
+
+Drivers address data by key, a relative path such as "blobs/ab/cd/<sha256>".
+
+Stored files are fanned out over two directory levels named after the first
+four characters of their name, e.g. transfers/ab/cd/abcd1234....ext. Names
+are random UUIDs or content hashes, so this spreads files evenly and keeps
+every directory small regardless of how many files are stored.
+"""
+import io
+import math
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+BACKEND_LOCAL = 'local'
+BACKEND_S3 = 's3'
+
+
+class StorageError(Exception):
+    """The storage backend rejected an operation."""
+
+
+def shard_name(name):
+    """Return the sharded relative path for a file name ("ab/cd/<name>")."""
+    return f'{name[:2]}/{name[2:4]}/{name}'
+
+
+def sharded_path(root, name, create=False):
+    """Return the sharded path of name under root, optionally creating its directory."""
+    path = os.path.join(root, shard_name(name))
+    if create:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def is_sharded(stored_name):
+    """Check if a stored name already includes its shard directories."""
+    return '/' in stored_name
+
+
+def open_for_sendfile(file_path):
+    """
+    Open a file for delivery and tell the kernel it will be read sequentially.
+
+    The file is opened unbuffered so its descriptor position always matches
+    what has been consumed, which is where os.sendfile starts from.
+    """
+    f = open(file_path, 'rb', buffering=0)
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+    return f
+
+
+class RangeFile:
+    """
+    File-like view of a byte window of an open file.
+
+    Exposes fileno() so wsgi.file_wrapper implementations (gunicorn) can use
+    os.sendfile from the current offset, bounded by Content-Length.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        self.file.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+class StorageDriver:
+    """Interface implemented by the storage backends."""
+
+    # Whether keys map to files on this machine (enables sendfile and
+    # web server offload)
+    is_local = False
+
+    # Whether clients can be sent straight to the store with presigned URLs
+    supports_presigned = False
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def open(self, key, start=0, length=None):
+        """Open data for reading from start, returning at most length bytes."""
+        raise NotImplementedError
+
+    def save(self, key, source_path):
+        """Move a local file into storage under key."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def list(self, prefix):
+        """Yield (key, size, modified timestamp) for every key starting with prefix."""
+        raise NotImplementedError
+
+    @contextmanager
+    def local_path(self, key):
+        """Yield a local path holding the data (a temporary copy if remote)."""
+        raise NotImplementedError
+        yield
+
+
+class LocalStorage(StorageDriver):
+    """Files on local disk under a root directory."""
+
+    is_local = True
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def open(self, key, start=0, length=None):
+        f = open_for_sendfile(self.path(key))
+        if start or length is not None:
+            if length is None:
+                length = os.fstat(f.fileno()).st_size - start
+            return RangeFile(f, start, length)
+        return f
+
+    def save(self, key, source_path):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.rename(source_path, path)
+
+    def delete(self, key):
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def list(self, prefix):
+        # Like an object store, match keys starting with prefix, so
+        # "transfers/ab" covers both transfers/ab/cd/... and legacy flat
+        # transfers/ab... files
+        directory, start = os.path.split(self.path(prefix))
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+
+        for entry in entries:
+            if not entry.name.startswith(start):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                for dirpath, _, names in os.walk(entry.path):
+                    for name in names:
+                        yield from self._list_file(os.path.join(dirpath, name))
+            else:
+                yield from self._list_file(entry.path)
+
+    def _list_file(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        # ctime also moves on rename and hard link, so a file that was just
+        # linked into place doesn't look old
+        key = os.path.relpath(path, self.root).replace(os.sep, '/')
+        yield key, stat.st_size, max(stat.st_mtime, stat.st_ctime)
+
+    @contextmanager
+    def local_path(self, key):
+        yield self.path(key)
+
+
+class S3Storage(StorageDriver):
+    """
+    Objects in an S3-compatible bucket.
+
+    Large files are sent with multipart upload and reads use ranged GETs, so
+    any number of app servers can serve the same data.
+    """
+
+    # Multipart part size (S3 needs at least 5 MB; allows up to 10000 parts)
+    PART_SIZE = 16 * 1024 * 1024
+    MAX_PARTS = 10000
+
+    supports_presigned = True
+
+    def __init__(self, bucket, endpoint_url=None, access_key=None, secret_key=None, region=None, prefix=''):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise ImproperlyConfigured("STORAGE_BACKEND 's3' requires boto3 (pip install boto3)")
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url or None,
+            aws_access_key_id=access_key or None,
+            aws_secret_access_key=secret_key or None,
+            region_name=region or None,
+            config=Config(signature_version='s3v4'),
+        )
+
+    def object_key(self, key):
+        return f'{self.prefix}{key}'
+
+    def _head(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def size(self, key):
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(key)
+        return head['ContentLength']
+
+    def open(self, key, start=0, length=None):
+        if length == 0:
+            # "bytes=N-(N-1)" is not a valid range; there is nothing to fetch
+            return io.BytesIO()
+
+        from botocore.exceptions import ClientError
+
+        kwargs = {}
+        if start or length is not None:
+            end = '' if length is None else start + length - 1
+            kwargs['Range'] = f'bytes={start}-{end}'
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key), **kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(key)
+            raise StorageError(e.response.get('Error', {}).get('Message', str(e)))
+        return response['Body']
+
+    def save(self, key, source_path):
+        object_key = self.object_key(key)
+        size = os.path.getsize(source_path)
+
+        with open(source_path, 'rb') as f:
+            if size <= self.PART_SIZE:
+                self.client.put_object(Bucket=self.bucket, Key=object_key, Body=f)
+            else:
+                self._multipart_upload(object_key, f)
+
+        os.remove(source_path)
+
+    def _multipart_upload(self, object_key, f):
+        upload = self.client.create_multipart_upload(Bucket=self.bucket, Key=object_key)
+        upload_id = upload['UploadId']
+        parts = []
+        try:
+            while True:
+                data = f.read(self.PART_SIZE)
+                if not data:
+                    break
+                part_number = len(parts) + 1
+                result = self.client.upload_part(
+                    Bucket=self.bucket,
+                    Key=object_key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=data,
+                )
+                parts.append({'PartNumber': part_number, 'ETag': result['ETag']})
+
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=object_key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts},
+            )
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id)
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def list(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.object_key(prefix)):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):], item['Size'], item['LastModified'].timestamp()
+
+    def presigned_url(self, key, expires, disposition=None, content_type=None):
+        """Return a short-lived GET URL for key."""
+        params = {'Bucket': self.bucket, 'Key': self.object_key(key)}
+        if disposition:
+            params['ResponseContentDisposition'] = disposition
+        if content_type:
+            params['ResponseContentType'] = content_type
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires)
+
+    def start_direct_upload(self, key, size, expires):
+        """
+        Start a multipart upload the client sends straight to the bucket.
+
+        Returns the upload ID, the part size and a presigned PUT URL per part.
+        """
+        object_key = self.object_key(key)
+        part_size = max(self.PART_SIZE, math.ceil(size / self.MAX_PARTS))
+        part_count = max(1, math.ceil(size / part_size))
+
+        upload = self.client.create_multipart_upload(Bucket=self.bucket, Key=object_key)
+        upload_id = upload['UploadId']
+        parts = [
+            {
+                'part_number': part_number,
+                'url': self.client.generate_presigned_url(
+                    'upload_part',
+                    Params={
+                        'Bucket': self.bucket,
+                        'Key': object_key,
+                        'UploadId': upload_id,
+                        'PartNumber': part_number,
+                    },
+                    ExpiresIn=expires,
+                ),
+            }
+            for part_number in range(1, part_count + 1)
+        ]
+        return {'upload_id': upload_id, 'part_size': part_size, 'parts': parts}
+
+    def complete_direct_upload(self, key, upload_id, parts):
+        """Assemble the parts the client uploaded (list of (part_number, etag))."""
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.object_key(key),
+                UploadId=upload_id,
+                MultipartUpload={
+                    'Parts': [{'PartNumber': number, 'ETag': etag} for number, etag in sorted(parts)],
+                },
+            )
+        except ClientError as e:
+            raise StorageError(e.response.get('Error', {}).get('Message', str(e)))
+
+    @contextmanager
+    def local_path(self, key):
+        fd, path = tempfile.mkstemp(prefix='s3_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                body = self.open(key)
+                try:
+                    shutil.copyfileobj(body, f, self.PART_SIZE)
+                finally:
+                    body.close()
+            yield path
+        finally:
+            os.remove(path)
+
+
+_storage = None
+
+
+def get_storage():
+    """Return the configured storage driver (created once per process)."""
+    global _storage
+    if _storage is None:
+        backend = getattr(settings, 'STORAGE_BACKEND', BACKEND_LOCAL)
+        if backend == BACKEND_LOCAL:
+            _storage = LocalStorage(settings.MEDIA_ROOT)
+        elif backend == BACKEND_S3:
+            options = getattr(settings, 'S3_STORAGE', {})
+            _storage = S3Storage(
+                bucket=options.get('bucket'),
+                endpoint_url=options.get('endpoint_url'),
+                access_key=options.get('access_key'),
+                secret_key=options.get('secret_key'),
+                region=options.get('region'),
+                prefix=options.get('prefix', ''),
+            )
+        else:
+            raise ImproperlyConfigured(f"Unknown STORAGE_BACKEND: {backend}")
+    return _storage
@@ -0,0 +1,302 @@
+"""
+Storage garbage collector: mark-and-sweep between the database and storage.
+
+The expiry sweeper only handles transfers that reached READY or were
+deleted. Two kinds of garbage slip past it:
+- transfers left in UPLOADING forever because the browser went away before
+  FinalizeTransferAPI, along with their files and tus uploads
+- stored data nothing points at: blobs, transfer files and tus uploads
+  whose rows are gone (crashed uploads, interrupted migrations, restores)
+
+The collector (manage.py gc_storage) first purges abandoned transfers and
+blob rows without files, then walks the storage tree. The walk is split
+into units by shard prefix (blobs/00 ... transfers/ff ... tus_uploads/ff),
+which a thread pool lists in parallel; every key older than the grace
+period is checked against the database in batches, and unreferenced ones
+are deleted at a limited rate. Completed units are recorded in a cursor in
+the cache, so an interrupted run resumes where it stopped.
+
+Nothing younger than the grace period is touched, so data that is being
+written, or whose row is about to be created, is safe. With dry_run the
+collector only reports what it would delete.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from transfers.direct_uploads import get_upload_expiry
+from transfers.models import Blob, Transfer, TransferFile, TusUpload
+from transfers.storage import LocalStorage, get_storage
+from transfers.sweeper import Throttle, purge_transfer, purge_tus_upload
+
+logger = logging.getLogger(__name__)
+
+# Last walk unit completed by an interrupted run
+CURSOR_CACHE_KEY = 'transfers:gc:cursor'
+
+# Stats of the last run, for monitoring
+METRICS_CACHE_KEY = 'transfers:gc:last_run'
+
+# Default age before unreferenced data is collected (24 hours)
+GC_GRACE = 24 * 3600
+
+# Keys checked against the database per query
+MARK_BATCH_SIZE = 500
+
+SHARDS = [f'{i:02x}' for i in range(256)]
+
+
+def walk_units():
+    """
+    Return the walk units in order, as (tree, key prefix).
+
+    A two-character prefix matches a shard directory as well as legacy flat
+    files starting with it. tus uploads and the blob temp directory are
+    always on local disk.
+    """
+    units = []
+    for tree in ('blobs', 'transfers', 'tus_uploads'):
+        units.extend((tree, f'{tree}/{shard}') for shard in SHARDS)
+    units.append(('tmp', 'blobs/tmp/'))
+    return units
+
+
+def pending_units(cursor=None):
+    """Return the walk units after cursor, the key prefix of the last completed unit."""
+    units = walk_units()
+    prefixes = [prefix for _, prefix in units]
+    if cursor in prefixes:
+        return units[prefixes.index(cursor) + 1:]
+    return units
+
+
+class Collector:
+    """
+    One garbage collection run.
+
+    grace is in seconds, workers is the size of the walk's thread pool and
+    rate limits deletions per second (0 for no limit).
+    """
+
+    def __init__(self, dry_run=False, grace=GC_GRACE, workers=8, rate=50, resume=True):
+        self.dry_run = dry_run
+        self.grace = grace
+        self.workers = workers
+        self.throttle = Throttle(rate)
+        self.resume = resume
+        self.storage = get_storage()
+        self.local = LocalStorage(settings.MEDIA_ROOT)
+        self.now = timezone.now()
+        self.cutoff = self.now - timedelta(seconds=grace)
+
+    def run(self):
+        started = time.monotonic()
+        stats = {
+            'dry_run': self.dry_run,
+            'abandoned_transfers': 0,
+            'abandoned_files': 0,
+            'abandoned_bytes': 0,
+            'orphan_blob_rows': 0,
+            'orphan_blob_rows_bytes': 0,
+            'scanned': 0,
+            'orphans': 0,
+            'orphan_bytes': 0,
+            'errors': 0,
+        }
+
+        self.collect_abandoned_transfers(stats)
+        self.collect_orphan_blob_rows(stats)
+        self.walk(stats)
+
+        stats['seconds'] = round(time.monotonic() - started, 1)
+        stats['finished_at'] = timezone.now().isoformat()
+        if not self.dry_run:
+            cache.set(METRICS_CACHE_KEY, stats, None)
+        logger.info('Storage GC finished: %s', stats)
+        return stats
+
+    def abandoned_transfers(self):
+        """
+        UPLOADING transfers with no upload activity within the grace period.
+
+        Direct uploads leave no trace until they complete, so a transfer is
+        never considered abandoned before its presigned URLs have expired.
+        """
+        cutoff = self.now - timedelta(seconds=max(self.grace, get_upload_expiry()))
+        return (
+            Transfer.objects
+            .filter(status=Transfer.UPLOADING, created_at__lt=cutoff, purged_at__isnull=True)
+            .exclude(files__uploaded_at__gte=cutoff)
+            .exclude(tus_uploads__updated_at__gte=cutoff)
+            .order_by('created_at')
+        )
+
+    def collect_abandoned_transfers(self, stats):
+        for transfer in self.abandoned_transfers().iterator():
+            if self.dry_run:
+                files = list(transfer.files.values_list('size', flat=True))
+                stats['abandoned_transfers'] += 1
+                stats['abandoned_files'] += len(files)
+                stats['abandoned_bytes'] += sum(files)
+                continue
+
+            try:
+                for upload in transfer.tus_uploads.all():
+                    freed = purge_tus_upload(upload)
+                    stats['abandoned_bytes'] += freed or 0
+                files, freed = purge_transfer(transfer, self.throttle)
+            except Exception:
+                logger.exception('Failed to purge abandoned transfer %s', transfer.id)
+                stats['errors'] += 1
+                continue
+            stats['abandoned_transfers'] += 1
+            stats['abandoned_files'] += files
+            stats['abandoned_bytes'] += freed
+
+    def collect_orphan_blob_rows(self, stats):
+        """Delete blobs no TransferFile points at (leaked references)."""
+        queryset = Blob.objects.filter(created_at__lt=self.cutoff, files__isnull=True)
+
+        for sha256, size in queryset.values_list('sha256', 'size').iterator():
+            if self.dry_run:
+                stats['orphan_blob_rows'] += 1
+                stats['orphan_blob_rows_bytes'] += size
+                continue
+
+            try:
+                with transaction.atomic():
+                    # Uploads hold this lock until their TransferFile exists
+                    blob = Blob.objects.select_for_update().filter(sha256=sha256).first()
+                    if blob is None or blob.files.exists():
+                        continue
+                    key = blob.storage_key
+                    blob.delete()
+                    self.storage.delete(key)
+            except Exception:
+                logger.exception('Failed to delete orphan blob %s', sha256)
+                stats['errors'] += 1
+                continue
+            stats['orphan_blob_rows'] += 1
+            stats['orphan_blob_rows_bytes'] += size
+            self.throttle()
+
+    def walk(self, stats):
+        """List every walk unit in parallel and sweep unreferenced data."""
+        cursor = cache.get(CURSOR_CACHE_KEY) if self.resume and not self.dry_run else None
+        units = pending_units(cursor)
+        if cursor and len(units) < len(walk_units()):
+            logger.info('Storage GC resuming after %s', cursor)
+
+        chunk_size = self.workers * 4
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for i in range(0, len(units), chunk_size):
+                chunk = units[i:i + chunk_size]
+                for unit_stats in executor.map(self.sweep_unit, chunk):
+                    for name, value in unit_stats.items():
+                        stats[name] += value
+                if not self.dry_run:
+                    cache.set(CURSOR_CACHE_KEY, chunk[-1][1], None)
+
+        if not self.dry_run:
+            cache.delete(CURSOR_CACHE_KEY)
+
+    def sweep_unit(self, unit):
+        """List one unit, mark what is referenced and delete the rest (runs in a worker)."""
+        tree, prefix = unit
+        stats = {'scanned': 0, 'orphans': 0, 'orphan_bytes': 0, 'errors': 0}
+        storage = self.storage if tree in ('blobs', 'transfers') else self.local
+        cutoff = self.cutoff.timestamp()
+        if tree == 'tus_uploads':
+            # Idle uploads belong to the sweeper until they expire
+            from transfers.tus_views import TUS_UPLOAD_EXPIRY
+            cutoff = min(cutoff, self.now.timestamp() - TUS_UPLOAD_EXPIRY)
+
+        try:
+            batch = []
+            for key, size, modified in storage.list(prefix):
+                stats['scanned'] += 1
+                if modified >= cutoff:
+                    continue
+                batch.append((key, size))
+                if len(batch) >= MARK_BATCH_SIZE:
+                    self.sweep_batch(tree, storage, batch, stats)
+                    batch = []
+            if batch:
+                self.sweep_batch(tree, storage, batch, stats)
+        except Exception:
+            logger.exception('Storage GC failed on %s', prefix)
+            stats['errors'] += 1
+        finally:
+            # Each worker thread has its own connection
+            connection.close()
+
+        return stats
+
+    def sweep_batch(self, tree, storage, batch, stats):
+        """Delete the keys of a batch that nothing in the database refers to."""
+        for key, size in self.unreferenced(tree, batch):
+            if not self.dry_run:
+                try:
+                    if tree == 'blobs':
+                        if not self.delete_blob_data(key):
+                            continue
+                    else:
+                        storage.delete(key)
+                except Exception:
+                    logger.exception('Failed to delete %s', key)
+                    stats['errors'] += 1
+                    continue
+                self.throttle()
+            stats['orphans'] += 1
+            stats['orphan_bytes'] += size
+
+    @staticmethod
+    def unreferenced(tree, batch):
+        """Return the (key, size) pairs of a batch with no database row."""
+        if tree == 'tmp':
+            # Leftovers of uploads that died before reaching the store
+            return batch
+
+        if tree == 'blobs':
+            names = {key: os.path.basename(key) for key, _ in batch}
+            referenced = Blob.objects.filter(sha256__in=set(names.values())).values_list('sha256', flat=True)
+        elif tree == 'transfers':
+            names = {key: key[len('transfers/'):] for key, _ in batch}
+            referenced = TransferFile.objects.filter(
+                blob__isnull=True,
+                stored_name__in=set(names.values()),
+            ).values_list('stored_name', flat=True)
+        else:
+            # <id> and its <id>.info sidecar
+            names = {key: os.path.basename(key).split('.')[0] for key, _ in batch}
+            referenced = TusUpload.objects.filter(id__in=set(names.values())).values_list('id', flat=True)
+
+        referenced = set(referenced)
+        return [(key, size) for key, size in batch if names[key] not in referenced]
+
+    def delete_blob_data(self, key):
+        """
+        Delete blob data that has no row, unless one appeared meanwhile.
+
+        A placeholder row is inserted and locked first: Blob.store() of the
+        same content waits on it, then finds no row and stores a fresh copy.
+        Returns False if the blob exists after all.
+        """
+        sha256 = os.path.basename(key)
+        with transaction.atomic():
+            placeholder, created = Blob.objects.select_for_update().get_or_create(
+                sha256=sha256,
+                defaults={'size': 0},
+            )
+            if not created:
+                return False
+            self.storage.delete(key)
+            placeholder.delete()
+        return True
@@ -0,0 +1,204 @@
+"""
+Expiry sweeper: reclaims storage of expired and deleted transfers.
+
+Transfer.is_expired is only evaluated per request, so nothing else ever
+removes expired data. The sweeper (manage.py sweep_transfers, run from
+cron) walks the (status, expires_at) index for READY transfers past their
+expiry, deletes their stored data in bounded batches and marks them
+EXPIRED. Each transfer is purged in its own transaction, so an interrupted
+run simply continues where it stopped the next time. Transfer and
+TransferFile rows are kept for the download page and analytics.
+
+tus uploads idle for longer than TUS_UPLOAD_EXPIRY are removed as well.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from accounts.models import Team
+from transfers.models import Transfer, TusUpload
+
+logger = logging.getLogger(__name__)
+
+# Stats of the last run, for monitoring
+METRICS_CACHE_KEY = 'transfers:sweeper:last_run'
+
+
+class Throttle:
+    """Sleep as needed to keep operations under a number per second (thread-safe)."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, count=1):
+        if not self.rate:
+            return
+        with self.lock:
+            self.count += count
+            ahead = self.count / self.rate - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def expired_transfers(now):
+    """Ready transfers past their expiry, oldest first."""
+    return Transfer.objects.filter(status=Transfer.READY, expires_at__lte=now).order_by('expires_at')
+
+
+def deleted_transfers():
+    """Deleted transfers whose files are still stored."""
+    return Transfer.objects.filter(status=Transfer.DELETED, purged_at__isnull=True).order_by('expires_at')
+
+
+def purge_transfer(transfer, throttle=None):
+    """
+    Delete a transfer's stored data and mark it purged.
+
+    TransferFile rows are kept, with their storage references cleared, so
+    the download page and per-file download history survive. The data is
+    released once the purge commits; if that fails the storage GC finds it
+    unreferenced and collects it.
+
+    Returns (files purged, bytes freed on storage).
+    """
+    freed = []
+
+    def release(transfer_file):
+        freed.append(transfer_file.release_storage())
+        if throttle:
+            throttle()
+
+    with transaction.atomic():
+        transfer = Transfer.objects.select_for_update().get(id=transfer.id)
+        if transfer.purged_at:
+            return 0, 0
+
+        files = list(transfer.files.all())
+        transfer.files.update(blob=None, stored_name='')
+        for transfer_file in files:
+            # The instances still carry the blob reference or file name
+            transaction.on_commit(partial(release, transfer_file))
+
+        # Only finalized transfers were counted against team storage
+        was_finalized = transfer.status != Transfer.UPLOADING
+
+        if transfer.status == Transfer.READY:
+            transfer.status = Transfer.EXPIRED
+        elif transfer.status == Transfer.UPLOADING:
+            transfer.status = Transfer.DELETED
+        transfer.purged_at = timezone.now()
+        transfer.save(update_fields=['status', 'purged_at'])
+
+        if was_finalized and transfer.team_id and transfer.total_size:
+            Team.objects.filter(id=transfer.team_id).update(
+                current_storage_bytes=Greatest(F('current_storage_bytes') - transfer.total_size, Value(0)),
+            )
+
+    return len(files), sum(freed)
+
+
+def purge_tus_upload(upload):
+    """
+    Delete a tus upload's data and state, unless a request is writing to it.
+
+    Returns the bytes freed, or None if the upload was busy.
+    """
+    from transfers.tus_views import delete_upload
+
+    # Take the lease so a late PATCH can't be writing while we delete
+    try:
+        upload, token = TusUpload.acquire(upload.id, upload.offset)
+    except (TusUpload.DoesNotExist, TusUpload.Locked, TusUpload.OffsetMismatch):
+        return None
+
+    freed = 0
+    if os.path.exists(upload.file_path):
+        freed = os.path.getsize(upload.file_path)
+        os.remove(upload.file_path)
+    delete_upload(upload)
+    return freed
+
+
+def purge_abandoned_tus_uploads(now, throttle=None):
+    """Remove tus uploads idle for longer than TUS_UPLOAD_EXPIRY. Returns (uploads, bytes)."""
+    from transfers.tus_views import TUS_UPLOAD_EXPIRY
+
+    cutoff = now - timedelta(seconds=TUS_UPLOAD_EXPIRY)
+    count = 0
+    freed = 0
+
+    for upload in TusUpload.objects.filter(updated_at__lt=cutoff).order_by('updated_at').iterator():
+        upload_freed = purge_tus_upload(upload)
+        if upload_freed is None:
+            continue
+        count += 1
+        freed += upload_freed
+        if throttle:
+            throttle()
+
+    return count, freed
+
+
+def sweep(batch_size=100, rate=50, max_batches=None, pause=0):
+    """
+    Run one sweep and return its stats.
+
+    batch_size transfers are loaded at a time, file deletions are limited
+    to rate per second, and the run stops after max_batches batches (the
+    next run picks up the rest).
+    """
+    started = time.monotonic()
+    now = timezone.now()
+    throttle = Throttle(rate)
+    stats = {
+        'transfers': 0,
+        'files': 0,
+        'bytes_reclaimed': 0,
+        'tus_uploads': 0,
+        'tus_bytes_reclaimed': 0,
+        'errors': 0,
+    }
+
+    failed = set()
+    batches = 0
+    for queryset in (expired_transfers(now), deleted_transfers()):
+        while max_batches is None or batches < max_batches:
+            batch = list(queryset.exclude(id__in=failed)[:batch_size])
+            if not batch:
+                break
+            batches += 1
+
+            for transfer in batch:
+                try:
+                    files, freed = purge_transfer(transfer, throttle)
+                except Exception:
+                    logger.exception('Failed to purge transfer %s', transfer.id)
+                    failed.add(transfer.id)
+                    stats['errors'] += 1
+                    continue
+                stats['transfers'] += 1
+                stats['files'] += files
+                stats['bytes_reclaimed'] += freed
+
+            if pause:
+                time.sleep(pause)
+
+    stats['tus_uploads'], stats['tus_bytes_reclaimed'] = purge_abandoned_tus_uploads(now, throttle)
+
+    stats['seconds'] = round(time.monotonic() - started, 1)
+    stats['finished_at'] = timezone.now().isoformat()
+    cache.set(METRICS_CACHE_KEY, stats, None)
+    logger.info('Sweep finished: %s', stats)
+    return stats
@@ -1,3 +1,1556 @@
-from django.test import TestCase
+import base64
+import hashlib
+import importlib.util
+import io
+import os
+import shutil
+import smtplib
+import tempfile
+import unittest
+import zipfile
+from contextlib import redirect_stdout
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+
+from transfers import mail_queue, storage
+from transfers.clamd import ClamdClient
+from transfers.delivery import accel_uri, serve_file, zip_offload_response
+from transfers.direct_uploads import DirectUploadError, complete_direct_upload, load_upload_token, start_direct_upload, upload_key
+from transfers.fake_clamd import EICAR, EICAR_SIGNATURE, FakeClamd
+from transfers.hashing import ResumableSHA256
+from transfers.mail_templates import render_mail
+from transfers.models import Blob, DownloadEvent, Transfer, TransferFile, TusUpload
+from transfers.ranges import RangeNotSatisfiable, if_range_matches, parse_range_header
+from transfers.security import scan_file_cached, scan_file_for_viruses, scan_transfer
+from transfers.storage_gc import Collector, pending_units, walk_units
+from transfers.sweeper import purge_transfer, sweep
+from transfers.tus_views import concatenate_files
+from transfers.zipstream import ZipStream, ZipStreamError
+from translations import catalog
+from translations.models.translation import Translation
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class StorageTestCase(TestCase):
+    """Runs each test against local storage in a fresh MEDIA_ROOT and an in-memory cache."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            STORAGE_BACKEND=storage.BACKEND_LOCAL,
+            CACHES=LOCMEM_CACHES,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+
+        storage._storage = None
+        self.addCleanup(setattr, storage, '_storage', None)
+
+    def make_transfer(self, **kwargs):
+        kwargs.setdefault('sender_ip', '127.0.0.1')
+        return Transfer.objects.create(**kwargs)
+
+    def make_source(self, data):
+        path = Blob.temp_path()
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def add_blob_file(self, transfer, data, name='file.txt'):
+        """Store data as a blob and attach it to transfer, like an upload does."""
+        path = self.make_source(data)
+        sha256 = hashlib.sha256(data).hexdigest()
+        blob, _ = Blob.store(path, sha256, len(data))
+        return TransferFile.objects.create(
+            transfer=transfer,
+            original_name=name,
+            stored_name=sha256,
+            size=len(data),
+            checksum=sha256,
+            blob=blob,
+            upload_complete=True,
+        )
+
+    def blob_exists(self, sha256):
+        return os.path.exists(os.path.join(self.media_root, Blob.key_for(sha256)))
+
+
+class BlobTests(StorageTestCase):
+
+    def test_same_content_is_stored_once(self):
+        transfer = self.make_transfer()
+        first = self.add_blob_file(transfer, b'same data')
+        second = self.add_blob_file(transfer, b'same data', name='copy.txt')
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(Blob.objects.get(sha256=first.blob_id).ref_count, 2)
+        self.assertTrue(self.blob_exists(first.blob_id))
+
+    def test_release_keeps_shared_data(self):
+        transfer = self.make_transfer()
+        first = self.add_blob_file(transfer, b'shared')
+        self.add_blob_file(transfer, b'shared', name='copy.txt')
+
+        self.assertFalse(Blob.release(first.blob_id))
+        self.assertEqual(Blob.objects.get(sha256=first.blob_id).ref_count, 1)
+        self.assertTrue(self.blob_exists(first.blob_id))
+
+    def test_release_of_last_reference_removes_data(self):
+        transfer = self.make_transfer()
+        transfer_file = self.add_blob_file(transfer, b'only copy')
+        sha256 = transfer_file.blob_id
+        TransferFile.objects.filter(id=transfer_file.id).update(blob=None)
+
+        self.assertTrue(Blob.release(sha256))
+        self.assertFalse(Blob.objects.filter(sha256=sha256).exists())
+        self.assertFalse(self.blob_exists(sha256))
+
+    def test_deleting_last_file_releases_blob_on_commit(self):
+        transfer = self.make_transfer()
+        transfer_file = self.add_blob_file(transfer, b'only copy')
+        sha256 = transfer_file.blob_id
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            transfer_file.delete()
+        # Nothing is removed before the deletion commits
+        self.assertTrue(self.blob_exists(sha256))
+
+        for callback in callbacks:
+            callback()
+        self.assertFalse(Blob.objects.filter(sha256=sha256).exists())
+        self.assertFalse(self.blob_exists(sha256))
+
+    def test_deleting_transfer_releases_each_reference(self):
+        transfer = self.make_transfer()
+        first = self.add_blob_file(transfer, b'twice')
+        self.add_blob_file(transfer, b'twice', name='copy.txt')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer.delete()
+
+        self.assertFalse(Blob.objects.filter(sha256=first.blob_id).exists())
+        self.assertFalse(self.blob_exists(first.blob_id))
+
+
+class StorageGCTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.stats = {
+            'orphan_blob_rows': 0,
+            'orphan_blob_rows_bytes': 0,
+            'orphans': 0,
+            'orphan_bytes': 0,
+            'errors': 0,
+        }
+
+    def write_key(self, key, data=b'data'):
+        path = os.path.join(self.media_root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return key, len(data)
+
+    def test_orphan_blob_row_is_deleted(self):
+        transfer = self.make_transfer()
+        transfer_file = self.add_blob_file(transfer, b'leaked')
+        sha256 = transfer_file.blob_id
+        # The release never runs: the on_commit callback is dropped
+        transfer_file.delete()
+        Blob.objects.filter(sha256=sha256).update(created_at=timezone.now() - timedelta(days=2))
+
+        Collector(grace=3600).collect_orphan_blob_rows(self.stats)
+
+        self.assertEqual(self.stats['orphan_blob_rows'], 1)
+        self.assertEqual(self.stats['errors'], 0)
+        self.assertFalse(Blob.objects.filter(sha256=sha256).exists())
+        self.assertFalse(self.blob_exists(sha256))
+
+    def test_referenced_blob_row_is_kept(self):
+        transfer = self.make_transfer()
+        transfer_file = self.add_blob_file(transfer, b'in use')
+        Blob.objects.update(created_at=timezone.now() - timedelta(days=2))
+
+        Collector(grace=3600).collect_orphan_blob_rows(self.stats)
+
+        self.assertEqual(self.stats['orphan_blob_rows'], 0)
+        self.assertTrue(self.blob_exists(transfer_file.blob_id))
+
+    def test_unreferenced_transfer_files_are_deleted(self):
+        transfer = self.make_transfer()
+        TransferFile.objects.create(transfer=transfer, original_name='kept.txt', stored_name='ab/cd/abcd-kept.txt', size=4)
+        kept = self.write_key('transfers/ab/cd/abcd-kept.txt')
+        orphan = self.write_key('transfers/ab/cd/abcd-orphan.txt')
+
+        collector = Collector(grace=3600)
+        collector.sweep_batch('transfers', collector.storage, [kept, orphan], self.stats)
+
+        self.assertEqual(self.stats['orphans'], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, kept[0])))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, orphan[0])))
+
+    def test_blob_data_without_row_is_deleted(self):
+        sha256 = hashlib.sha256(b'no row').hexdigest()
+        key = self.write_key(Blob.key_for(sha256), b'no row')
+
+        collector = Collector(grace=3600)
+        collector.sweep_batch('blobs', collector.storage, [key], self.stats)
+
+        self.assertEqual(self.stats['orphans'], 1)
+        self.assertFalse(self.blob_exists(sha256))
+        # The placeholder row taken while deleting is gone too
+        self.assertFalse(Blob.objects.filter(sha256=sha256).exists())
+
+    def test_dry_run_deletes_nothing(self):
+        orphan = self.write_key('transfers/ab/cd/abcd-orphan.txt')
+
+        collector = Collector(dry_run=True, grace=3600)
+        collector.sweep_batch('transfers', collector.storage, [orphan], self.stats)
+
+        self.assertEqual(self.stats['orphans'], 1)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, orphan[0])))
+
+    def test_walk_resumes_after_cursor(self):
+        units = pending_units('blobs/ff')
+        self.assertEqual(units[0], ('transfers', 'transfers/00'))
+        self.assertEqual(pending_units(None), walk_units())
+        self.assertEqual(pending_units('unknown'), walk_units())
+
+
+class SweeperTests(StorageTestCase):
+
+    def test_expired_transfer_is_purged(self):
+        transfer = self.make_transfer(status=Transfer.READY, expires_at=timezone.now() - timedelta(hours=1))
+        transfer_file = self.add_blob_file(transfer, b'expired data')
+        sha256 = transfer_file.blob_id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = sweep(rate=0)
+
+        self.assertEqual(stats['transfers'], 1)
+        self.assertEqual(stats['files'], 1)
+        transfer.refresh_from_db()
+        self.assertEqual(transfer.status, Transfer.EXPIRED)
+        self.assertIsNotNone(transfer.purged_at)
+        self.assertFalse(self.blob_exists(sha256))
+        self.assertFalse(Blob.objects.filter(sha256=sha256).exists())
+
+    def test_purge_keeps_file_rows_and_download_history(self):
+        transfer = self.make_transfer(status=Transfer.READY, expires_at=timezone.now() - timedelta(hours=1))
+        transfer_file = self.add_blob_file(transfer, b'downloaded')
+        DownloadEvent.objects.create(transfer=transfer, file=transfer_file, ip_address='127.0.0.1', is_full_download=False)
+        DownloadEvent.objects.create(transfer=transfer, ip_address='127.0.0.1')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            purge_transfer(transfer)
+
+        transfer_file.refresh_from_db()
+        self.assertIsNone(transfer_file.blob_id)
+        self.assertEqual(transfer_file.stored_name, '')
+        self.assertEqual(DownloadEvent.objects.filter(transfer=transfer).count(), 2)
+        self.assertEqual(transfer_file.download_events.count(), 1)
+
+    def test_shared_blob_survives_purge(self):
+        expired = self.make_transfer(status=Transfer.READY, expires_at=timezone.now() - timedelta(hours=1))
+        live = self.make_transfer(status=Transfer.READY)
+        transfer_file = self.add_blob_file(expired, b'shared')
+        self.add_blob_file(live, b'shared')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sweep(rate=0)
+
+        self.assertTrue(self.blob_exists(transfer_file.blob_id))
+        self.assertEqual(Blob.objects.get(sha256=transfer_file.blob_id).ref_count, 1)
+
+    def test_nothing_is_released_on_rollback(self):
+        transfer = self.make_transfer(status=Transfer.READY, expires_at=timezone.now() - timedelta(hours=1))
+        transfer_file = self.add_blob_file(transfer, b'kept')
+
+        with self.captureOnCommitCallbacks(execute=False):
+            purge_transfer(transfer)
+
+        self.assertTrue(self.blob_exists(transfer_file.blob_id))
+
+    def test_purge_runs_once(self):
+        transfer = self.make_transfer(status=Transfer.READY, expires_at=timezone.now() - timedelta(hours=1))
+        self.add_blob_file(transfer, b'once')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            purge_transfer(transfer)
+        self.assertEqual(purge_transfer(transfer), (0, 0))
+
+    def test_live_transfers_are_left_alone(self):
+        transfer = self.make_transfer(status=Transfer.READY)
+        transfer_file = self.add_blob_file(transfer, b'live')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = sweep(rate=0)
+
+        self.assertEqual(stats['transfers'], 0)
+        self.assertTrue(self.blob_exists(transfer_file.blob_id))
+
+
+class RangeHeaderTests(SimpleTestCase):
+
+    def test_missing_or_malformed_header_means_full_response(self):
+        for header in ('', 'items=0-1', 'bytes=', 'bytes=abc', 'bytes=5-3', 'bytes=1'):
+            self.assertIsNone(parse_range_header(header, 100), header)
+
+    def test_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-9', 100), [(0, 9)])
+        self.assertEqual(parse_range_header('bytes=90-', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=-10', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=0-0,-1', 100), [(0, 0), (99, 99)])
+
+    def test_ranges_are_clamped_to_size(self):
+        self.assertEqual(parse_range_header('bytes=50-500', 100), [(50, 99)])
+        self.assertEqual(parse_range_header('bytes=-500', 100), [(0, 99)])
+
+    def test_unsatisfiable_ranges(self):
+        for header in ('bytes=100-', 'bytes=100-200', 'bytes=500-', 'bytes=-0'):
+            with self.assertRaises(RangeNotSatisfiable, msg=header):
+                parse_range_header(header, 100)
+
+    def test_empty_representation_is_unsatisfiable(self):
+        for header in ('bytes=0-', 'bytes=-10'):
+            with self.assertRaises(RangeNotSatisfiable, msg=header):
+                parse_range_header(header, 0)
+
+    def test_unsatisfiable_part_is_skipped_when_another_fits(self):
+        self.assertEqual(parse_range_header('bytes=200-,0-4', 100), [(0, 4)])
+
+    def test_if_range(self):
+        factory = RequestFactory()
+        etag = '"abc"'
+        last_modified = 1700000000
+
+        self.assertTrue(if_range_matches(factory.get('/'), etag, last_modified))
+        self.assertTrue(if_range_matches(factory.get('/', HTTP_IF_RANGE=etag), etag, last_modified))
+        self.assertFalse(if_range_matches(factory.get('/', HTTP_IF_RANGE='"old"'), etag, last_modified))
+        self.assertFalse(if_range_matches(factory.get('/', HTTP_IF_RANGE='W/"abc"'), etag, last_modified))
+        self.assertTrue(if_range_matches(
+            factory.get('/', HTTP_IF_RANGE=http_date(last_modified)), etag, last_modified,
+        ))
+        self.assertFalse(if_range_matches(
+            factory.get('/', HTTP_IF_RANGE=http_date(last_modified - 60)), etag, last_modified,
+        ))
+
+
+class TusTestCase(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.transfer = self.make_transfer()
+
+    def tus_url(self, upload_id=None):
+        if upload_id:
+            return f'/api/tus/{self.transfer.id}/{upload_id}/'
+        return f'/api/tus/{self.transfer.id}/'
+
+    def create_upload(self, length, filename='file.bin', **headers):
+        metadata = 'filename ' + base64.b64encode(filename.encode()).decode()
+        response = self.client.post(
+            self.tus_url(),
+            data=b'',
+            content_type='application/offset+octet-stream',
+            HTTP_TUS_RESUMABLE='1.0.0',
+            HTTP_UPLOAD_LENGTH=str(length),
+            HTTP_UPLOAD_METADATA=metadata,
+            **headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        return response['Location'].rstrip('/').rsplit('/', 1)[-1]
+
+    def patch(self, upload_id, data, offset, **headers):
+        return self.client.patch(
+            self.tus_url(upload_id),
+            data=data,
+            content_type='application/offset+octet-stream',
+            HTTP_TUS_RESUMABLE='1.0.0',
+            HTTP_UPLOAD_OFFSET=str(offset),
+            **headers,
+        )
+
+
+class TusLeaseTests(TusTestCase):
+
+    def test_second_writer_is_locked_out(self):
+        upload_id = self.create_upload(10)
+        upload, token = TusUpload.acquire(upload_id, 0)
+
+        with self.assertRaises(TusUpload.Locked):
+            TusUpload.acquire(upload_id, 0)
+        self.assertEqual(self.patch(upload_id, b'0123456789', 0).status_code, 423)
+
+        upload.release(token)
+        TusUpload.acquire(upload_id, 0)
+
+    def test_offset_mismatch(self):
+        upload_id = self.create_upload(10)
+
+        with self.assertRaises(TusUpload.OffsetMismatch):
+            TusUpload.acquire(upload_id, 5)
+        response = self.patch(upload_id, b'56789', 5)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '0')
+
+    def test_lost_lease_cannot_advance(self):
+        upload_id = self.create_upload(10)
+        upload, token = TusUpload.acquire(upload_id, 0)
+        upload.release(token)
+        TusUpload.acquire(upload_id, 0)
+
+        self.assertFalse(upload.advance(token, 5))
+        self.assertEqual(TusUpload.objects.get(id=upload_id).offset, 0)
+
+    def test_patches_append_and_finalize(self):
+        upload_id = self.create_upload(10, filename='a.txt')
+
+        response = self.patch(upload_id, b'01234', 0)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], '5')
+        self.assertEqual(self.patch(upload_id, b'56789', 5).status_code, 204)
+
+        transfer_file = TransferFile.objects.get(transfer=self.transfer)
+        self.assertEqual(transfer_file.original_name, 'a.txt')
+        self.assertEqual(transfer_file.checksum, hashlib.sha256(b'0123456789').hexdigest())
+        self.assertTrue(self.blob_exists(transfer_file.blob_id))
+        self.assertFalse(TusUpload.objects.filter(id=upload_id).exists())
+
+    def test_head_drops_uncommitted_bytes(self):
+        upload_id = self.create_upload(10)
+        self.patch(upload_id, b'0123', 0)
+        upload = TusUpload.objects.get(id=upload_id)
+        # A PATCH that died after writing but before committing its offset
+        with open(upload.file_path, 'ab') as f:
+            f.write(b'unverified')
+
+        response = self.client.head(self.tus_url(upload_id), HTTP_TUS_RESUMABLE='1.0.0')
+
+        self.assertEqual(response['Upload-Offset'], '4')
+        self.assertEqual(os.path.getsize(upload.file_path), 4)
+
+    def test_reconcile_moves_offset_back_to_lost_data(self):
+        upload_id = self.create_upload(10)
+        self.patch(upload_id, b'0123', 0)
+        upload = TusUpload.objects.get(id=upload_id)
+        with open(upload.file_path, 'r+b') as f:
+            f.truncate(2)
+
+        self.assertEqual(upload.reconcile(), 2)
+        self.assertEqual(TusUpload.objects.get(id=upload_id).offset, 2)
+        self.assertFalse(TusUpload.objects.get(id=upload_id).is_locked)
+
+    def test_reconcile_leaves_locked_upload_alone(self):
+        upload_id = self.create_upload(10)
+        upload, token = TusUpload.acquire(upload_id, 0)
+        with open(upload.file_path, 'wb') as f:
+            f.write(b'in flight')
+
+        self.assertEqual(upload.reconcile(), 0)
+        self.assertEqual(os.path.getsize(upload.file_path), 9)
+
+
+class TusConcatenationTests(TusTestCase):
+
+    def create_partial(self, data, complete=True):
+        upload_id = self.create_upload(len(data), HTTP_UPLOAD_CONCAT='partial')
+        if complete:
+            self.assertEqual(self.patch(upload_id, data, 0).status_code, 204)
+        return upload_id
+
+    def create_final(self, upload_ids, filename='joined.bin'):
+        urls = ' '.join(self.tus_url(upload_id) for upload_id in upload_ids)
+        return self.client.post(
+            self.tus_url(),
+            data=b'',
+            content_type='application/offset+octet-stream',
+            HTTP_TUS_RESUMABLE='1.0.0',
+            HTTP_UPLOAD_CONCAT=f'final;{urls}',
+            HTTP_UPLOAD_METADATA='filename ' + base64.b64encode(filename.encode()).decode(),
+        )
+
+    def test_partials_are_joined_in_order(self):
+        first = self.create_partial(b'hello ')
+        second = self.create_partial(b'world')
+        # Completed partials wait for the final upload
+        self.assertFalse(TransferFile.objects.filter(transfer=self.transfer).exists())
+
+        response = self.create_final([first, second])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Upload-Offset'], '11')
+        transfer_file = TransferFile.objects.get(transfer=self.transfer)
+        self.assertEqual(transfer_file.original_name, 'joined.bin')
+        self.assertEqual(transfer_file.size, 11)
+        self.assertEqual(transfer_file.checksum, hashlib.sha256(b'hello world').hexdigest())
+        with open(os.path.join(self.media_root, transfer_file.storage_key), 'rb') as f:
+            self.assertEqual(f.read(), b'hello world')
+        self.assertFalse(TusUpload.objects.filter(id__in=[first, second]).exists())
+
+    @unittest.skipUnless(hasattr(os, 'copy_file_range'), 'copy_file_range is not available')
+    def test_fallback_copy_keeps_the_order(self):
+        paths = [self.make_source(data) for data in (b'first ', b'second ', b'third')]
+        dest_path = os.path.join(self.media_root, 'joined')
+        copy_file_range = os.copy_file_range
+        calls = []
+
+        def fail_first(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OSError('cross-device')
+            return copy_file_range(*args)
+
+        with mock.patch('os.copy_file_range', fail_first):
+            concatenate_files(paths, dest_path)
+
+        with open(dest_path, 'rb') as f:
+            self.assertEqual(f.read(), b'first second third')
+
+    def test_incomplete_partial_is_rejected(self):
+        first = self.create_partial(b'hello ')
+        second = self.create_partial(b'world', complete=False)
+
+        response = self.create_final([first, second])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TransferFile.objects.filter(transfer=self.transfer).exists())
+        # Nothing stays locked after the failed attempt
+        self.assertFalse(TusUpload.objects.get(id=first).is_locked)
+
+    def test_regular_upload_cannot_be_concatenated(self):
+        first = self.create_partial(b'hello ')
+        regular = self.create_upload(5)
+
+        self.assertEqual(self.create_final([first, regular]).status_code, 400)
+
+    def test_partials_of_another_transfer_are_rejected(self):
+        first = self.create_partial(b'hello ')
+        other_transfer = self.make_transfer()
+        urls = f'/api/tus/{other_transfer.id}/{first}/'
+
+        response = self.client.post(
+            self.tus_url(),
+            data=b'',
+            content_type='application/offset+octet-stream',
+            HTTP_TUS_RESUMABLE='1.0.0',
+            HTTP_UPLOAD_CONCAT=f'final;{urls}',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class TusChecksumTests(TusTestCase):
+
+    @staticmethod
+    def checksum_header(data, algorithm='sha1'):
+        return f'{algorithm} ' + base64.b64encode(hashlib.new(algorithm, data).digest()).decode()
+
+    def test_matching_checksum_is_accepted(self):
+        upload_id = self.create_upload(5)
+
+        response = self.patch(upload_id, b'hello', 0, HTTP_UPLOAD_CHECKSUM=self.checksum_header(b'hello'))
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], '5')
+
+    def test_mismatched_checksum_is_rejected(self):
+        upload_id = self.create_upload(10)
+        self.patch(upload_id, b'01234', 0)
+
+        response = self.patch(upload_id, b'56789', 5, HTTP_UPLOAD_CHECKSUM=self.checksum_header(b'other'))
+
+        self.assertEqual(response.status_code, 460)
+        upload = TusUpload.objects.get(id=upload_id)
+        self.assertEqual(upload.offset, 5)
+        self.assertFalse(upload.is_locked)
+        self.assertEqual(os.path.getsize(upload.file_path), 5)
+
+        # The client retries the same chunk and the file hash still comes out right
+        response = self.patch(upload_id, b'56789', 5, HTTP_UPLOAD_CHECKSUM=self.checksum_header(b'56789', 'sha256'))
+        self.assertEqual(response.status_code, 204)
+        transfer_file = TransferFile.objects.get(transfer=self.transfer)
+        self.assertEqual(transfer_file.checksum, hashlib.sha256(b'0123456789').hexdigest())
+
+    def test_creation_with_upload_checks_the_body(self):
+        response = self.client.post(
+            self.tus_url(),
+            data=b'hello',
+            content_type='application/offset+octet-stream',
+            HTTP_TUS_RESUMABLE='1.0.0',
+            HTTP_UPLOAD_LENGTH='10',
+            HTTP_UPLOAD_CHECKSUM=self.checksum_header(b'other'),
+        )
+
+        self.assertEqual(response.status_code, 460)
+        self.assertEqual(response['Upload-Offset'], '0')
+        upload_id = response['Location'].rstrip('/').rsplit('/', 1)[-1]
+        self.assertEqual(TusUpload.objects.get(id=upload_id).offset, 0)
+
+    def test_hash_state_from_another_host_is_replayed(self):
+        upload_id = self.create_upload(10)
+        self.patch(upload_id, b'01234', 0)
+        # Saved by a worker with another libcrypto: the layout can't be trusted
+        TusUpload.objects.filter(id=upload_id).update(hash_state=b'OpenSSL 1.0.2k;aarch64;little;112|' + bytes(112))
+
+        self.assertEqual(self.patch(upload_id, b'56789', 5).status_code, 204)
+
+        transfer_file = TransferFile.objects.get(transfer=self.transfer)
+        self.assertEqual(transfer_file.checksum, hashlib.sha256(b'0123456789').hexdigest())
+
+    def test_unsupported_or_malformed_checksum(self):
+        upload_id = self.create_upload(5)
+
+        self.assertEqual(self.patch(upload_id, b'hello', 0, HTTP_UPLOAD_CHECKSUM='crc32 AAAA').status_code, 400)
+        self.assertEqual(self.patch(upload_id, b'hello', 0, HTTP_UPLOAD_CHECKSUM='sha1 not-base64!').status_code, 400)
+        self.assertEqual(TusUpload.objects.get(id=upload_id).offset, 0)
+
+
+class ResumableSHA256Tests(SimpleTestCase):
+
+    def test_hash_continues_from_saved_state(self):
+        hasher = ResumableSHA256()
+        hasher.update(b'first half, ')
+        restored = ResumableSHA256.from_state(hasher.state())
+        if restored is None:
+            self.skipTest('libcrypto is not available; callers replay the data from disk')
+        restored.update(b'second half')
+
+        self.assertEqual(restored.hexdigest(), hashlib.sha256(b'first half, second half').hexdigest())
+        # hexdigest doesn't finalize the running hash
+        hasher.update(b'more')
+        self.assertEqual(hasher.hexdigest(), hashlib.sha256(b'first half, more').hexdigest())
+
+    def test_state_of_another_library_is_not_restored(self):
+        hasher = ResumableSHA256()
+        hasher.update(b'first half, ')
+        state = hasher.state()
+        if state is None:
+            self.skipTest('libcrypto is not available; callers replay the data from disk')
+        ctx = state[state.index(b'|') + 1:]
+
+        self.assertIsNone(ResumableSHA256.from_state(b'OpenSSL 1.0.2k;aarch64;little;112|' + ctx))
+        # State saved before it was tagged
+        self.assertIsNone(ResumableSHA256.from_state(ctx))
+
+
+class StorageDriverTests(StorageTestCase):
+
+    def test_local_ranged_reads(self):
+        driver = storage.get_storage()
+        path = self.make_source(b'0123456789')
+        driver.save('transfers/ab/cd/abcd.bin', path)
+
+        for start, length, expected in ((2, 3, b'234'), (5, 0, b''), (8, None, b'89')):
+            f = driver.open('transfers/ab/cd/abcd.bin', start, length)
+            try:
+                self.assertEqual(f.read(), expected)
+            finally:
+                f.close()
+        self.assertEqual(
+            [(key, size) for key, size, _ in driver.list('transfers/ab')],
+            [('transfers/ab/cd/abcd.bin', 10)],
+        )
+
+    def test_s3_zero_length_read_sends_no_request(self):
+        class Client:
+            def get_object(self, **kwargs):
+                raise AssertionError(f'Unexpected request: {kwargs}')
+
+        driver = storage.S3Storage.__new__(storage.S3Storage)
+        driver.bucket = 'bucket'
+        driver.prefix = ''
+        driver.client = Client()
+
+        self.assertEqual(driver.open('blobs/ab/cd/abcd', 10, 0).read(), b'')
+
+
+class ShardLayoutTests(StorageTestCase):
+
+    def test_shard_names(self):
+        self.assertEqual(storage.shard_name('abcdef12.pdf'), 'ab/cd/abcdef12.pdf')
+        self.assertTrue(storage.is_sharded('ab/cd/abcdef12.pdf'))
+        self.assertFalse(storage.is_sharded('abcdef12.pdf'))
+        self.assertEqual(Blob.key_for('9f' * 32), f'blobs/9f/9f/{"9f" * 32}')
+
+    def test_sharded_path(self):
+        path = storage.sharded_path(self.media_root, 'abcdef12.pdf')
+        self.assertEqual(path, os.path.join(self.media_root, 'ab', 'cd', 'abcdef12.pdf'))
+        self.assertFalse(os.path.exists(os.path.dirname(path)))
+
+        storage.sharded_path(self.media_root, 'abcdef12.pdf', create=True)
+        self.assertTrue(os.path.isdir(os.path.dirname(path)))
+
+
+class ShardStorageCommandTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.transfer = self.make_transfer(status=Transfer.READY)
+
+    def make_legacy_file(self, name, data):
+        """A file stored before the sharded layout: transfers/<name>."""
+        path = os.path.join(self.media_root, 'transfers', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return TransferFile.objects.create(
+            transfer=self.transfer,
+            original_name=name,
+            stored_name=name,
+            size=len(data),
+            upload_complete=True,
+        )
+
+    def download(self, transfer_file):
+        response = self.client.get(reverse('download_file', args=[self.transfer.short_id, transfer_file.id]))
+        self.addCleanup(response.close)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def shard(self, *args):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            call_command('shard_storage', *args)
+        return output.getvalue()
+
+    def assert_sharded(self, transfer_file, data):
+        transfer_file.refresh_from_db()
+        self.assertEqual(transfer_file.stored_name, storage.shard_name(transfer_file.original_name))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'transfers', transfer_file.original_name)))
+        self.assertEqual(self.download(transfer_file), data)
+
+    def test_files_are_moved_in_batches(self):
+        files = {self.make_legacy_file(f'{i:02x}aa{i}.bin', b'data %d' % i): b'data %d' % i for i in range(5)}
+
+        output = self.shard('--batch-size', '2')
+
+        self.assertIn('Moved 5 transfer files (0 missing on disk)', output)
+        for transfer_file, data in files.items():
+            self.assert_sharded(transfer_file, data)
+
+    def test_interrupted_run_is_resumed(self):
+        done = self.make_legacy_file('aaaa1.bin', b'one')
+        linked = self.make_legacy_file('bbbb2.bin', b'two')
+        pending = self.make_legacy_file('cccc3.bin', b'three')
+
+        # A previous run moved the first file and died after linking the second
+        transfers_dir = os.path.join(self.media_root, 'transfers')
+        os.link(os.path.join(transfers_dir, 'aaaa1.bin'), storage.sharded_path(transfers_dir, 'aaaa1.bin', create=True))
+        os.remove(os.path.join(transfers_dir, 'aaaa1.bin'))
+        TransferFile.objects.filter(id=done.id).update(stored_name=storage.shard_name('aaaa1.bin'))
+        os.link(os.path.join(transfers_dir, 'bbbb2.bin'), storage.sharded_path(transfers_dir, 'bbbb2.bin', create=True))
+
+        # Downloads resolve in the half-migrated state
+        done.refresh_from_db()
+        self.assertEqual(self.download(done), b'one')
+        self.assertEqual(self.download(linked), b'two')
+
+        output = self.shard()
+
+        self.assertIn('Moved 2 transfer files (0 missing on disk)', output)
+        self.assert_sharded(done, b'one')
+        self.assert_sharded(linked, b'two')
+        self.assert_sharded(pending, b'three')
+
+        # Nothing left to do
+        self.assertIn('Moved 0 transfer files', self.shard())
+
+    def test_missing_file_is_counted(self):
+        transfer_file = self.make_legacy_file('dddd4.bin', b'gone')
+        os.remove(os.path.join(self.media_root, 'transfers', 'dddd4.bin'))
+
+        self.assertIn('Moved 0 transfer files (1 missing on disk)', self.shard())
+        transfer_file.refresh_from_db()
+        self.assertEqual(transfer_file.stored_name, 'dddd4.bin')
+
+    def test_blob_files_are_left_alone(self):
+        transfer_file = self.add_blob_file(self.transfer, b'blob data')
+
+        self.assertIn('Moved 0 transfer files', self.shard())
+        transfer_file.refresh_from_db()
+        self.assertEqual(self.download(transfer_file), b'blob data')
+
+if importlib.util.find_spec('boto3'):
+    from botocore.response import StreamingBody
+    from botocore.stub import ANY, Stubber
+else:
+    Stubber = None
+
+
+@unittest.skipIf(Stubber is None, 'boto3 is not installed')
+class S3StorageTests(SimpleTestCase):
+    """S3Storage against a stubbed boto3 client: checks the requests it sends."""
+
+    def setUp(self):
+        self.driver = storage.S3Storage(
+            bucket='sendfiles',
+            endpoint_url='http://localhost:9000',
+            access_key='key',
+            secret_key='secret',
+            region='us-east-1',
+            prefix='site/',
+        )
+        self.stubber = Stubber(self.driver.client)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+
+    def tearDown(self):
+        self.stubber.assert_no_pending_responses()
+
+    def expect_get(self, data, **params):
+        self.stubber.add_response(
+            'get_object',
+            {'Body': StreamingBody(io.BytesIO(data), len(data)), 'ContentLength': len(data)},
+            dict({'Bucket': 'sendfiles', 'Key': 'site/blobs/ab/cd/abcd'}, **params),
+        )
+
+    def make_source(self, data):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+        return path
+
+    def test_ranged_reads(self):
+        self.expect_get(b'0123456789')
+        self.expect_get(b'234', Range='bytes=2-4')
+        self.expect_get(b'89', Range='bytes=8-')
+
+        self.assertEqual(self.driver.open('blobs/ab/cd/abcd').read(), b'0123456789')
+        self.assertEqual(self.driver.open('blobs/ab/cd/abcd', 2, 3).read(), b'234')
+        self.assertEqual(self.driver.open('blobs/ab/cd/abcd', 8).read(), b'89')
+        # Nothing to fetch, so no request
+        self.assertEqual(self.driver.open('blobs/ab/cd/abcd', 5, 0).read(), b'')
+
+    def test_read_errors(self):
+        self.stubber.add_client_error('get_object', 'NoSuchKey', http_status_code=404)
+        self.stubber.add_client_error('get_object', 'AccessDenied', 'Access Denied', http_status_code=403)
+
+        with self.assertRaises(FileNotFoundError):
+            self.driver.open('blobs/ab/cd/abcd')
+        with self.assertRaisesMessage(storage.StorageError, 'Access Denied'):
+            self.driver.open('blobs/ab/cd/abcd')
+
+    def test_small_file_is_put_in_one_request(self):
+        path = self.make_source(b'small')
+        self.stubber.add_response('put_object', {}, {'Bucket': 'sendfiles', 'Key': 'site/blobs/ab/cd/abcd', 'Body': ANY})
+
+        self.driver.save('blobs/ab/cd/abcd', path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_large_file_is_uploaded_in_parts(self):
+        self.driver.PART_SIZE = 4
+        path = self.make_source(b'0123456789')
+        key = {'Bucket': 'sendfiles', 'Key': 'site/blobs/ab/cd/abcd'}
+        self.stubber.add_response('create_multipart_upload', {'UploadId': 'upload-1'}, key)
+        for number, data in enumerate((b'0123', b'4567', b'89'), 1):
+            self.stubber.add_response(
+                'upload_part',
+                {'ETag': f'"etag-{number}"'},
+                dict(key, UploadId='upload-1', PartNumber=number, Body=data),
+            )
+        self.stubber.add_response('complete_multipart_upload', {}, dict(
+            key,
+            UploadId='upload-1',
+            MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': f'"etag-{n}"'} for n in (1, 2, 3)]},
+        ))
+
+        self.driver.save('blobs/ab/cd/abcd', path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_failed_multipart_upload_is_aborted(self):
+        self.driver.PART_SIZE = 4
+        path = self.make_source(b'0123456789')
+        key = {'Bucket': 'sendfiles', 'Key': 'site/blobs/ab/cd/abcd'}
+        self.stubber.add_response('create_multipart_upload', {'UploadId': 'upload-1'}, key)
+        self.stubber.add_client_error('upload_part', 'InternalError')
+        self.stubber.add_response('abort_multipart_upload', {}, dict(key, UploadId='upload-1'))
+
+        with self.assertRaises(Exception):
+            self.driver.save('blobs/ab/cd/abcd', path)
+        # The source stays for a retry
+        self.assertTrue(os.path.exists(path))
+
+    def test_presigned_url(self):
+        url = self.driver.presigned_url('blobs/ab/cd/abcd', 300, disposition='attachment; filename="a.txt"')
+
+        self.assertTrue(url.startswith('http://localhost:9000/sendfiles/site/blobs/ab/cd/abcd?'))
+        self.assertIn('response-content-disposition=attachment', url)
+        self.assertIn('X-Amz-Expires=300', url)
+
+    def test_local_path(self):
+        self.expect_get(b'0123456789')
+
+        with self.driver.local_path('blobs/ab/cd/abcd') as path:
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'0123456789')
+        self.assertFalse(os.path.exists(path))
+
+    def test_direct_upload_size_mismatch(self):
+        key = {'Bucket': 'sendfiles', 'Key': 'site/transfers/ab/cd/abcd.bin'}
+        self.stubber.add_response('complete_multipart_upload', {}, dict(
+            key,
+            UploadId='upload-1',
+            MultipartUpload={'Parts': [{'PartNumber': 1, 'ETag': '"etag-1"'}]},
+        ))
+        self.stubber.add_response('head_object', {'ContentLength': 12}, key)
+        self.stubber.add_response('delete_object', {}, key)
+
+        storage._storage = self.driver
+        self.addCleanup(setattr, storage, '_storage', None)
+        info = {'stored_name': 'ab/cd/abcd.bin', 'upload_id': 'upload-1', 'size': 10}
+        with self.assertRaisesMessage(DirectUploadError, 'does not match the declared size'):
+            complete_direct_upload(info, [(1, '"etag-1"')])
+
+class VirusScanTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clamd = FakeClamd('127.0.0.1:0').start()
+        self.addCleanup(self.clamd.stop)
+        settings_override = override_settings(CLAMD_ADDRESS=self.clamd.address, VIRUS_SCAN_WORKERS=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_clean_transfer(self):
+        transfer = self.make_transfer(status=Transfer.READY)
+        self.add_blob_file(transfer, b'harmless', name='a.txt')
+        self.add_blob_file(transfer, b'also harmless', name='b.txt')
+
+        self.assertTrue(scan_transfer(transfer))
+        transfer.refresh_from_db()
+        self.assertEqual(transfer.virus_scan_status, Transfer.SCAN_CLEAN)
+
+    def test_infected_transfer(self):
+        transfer = self.make_transfer(status=Transfer.READY)
+        self.add_blob_file(transfer, b'harmless', name='a.txt')
+        self.add_blob_file(transfer, b'prefix ' + EICAR, name='eicar.com')
+
+        self.assertFalse(scan_transfer(transfer))
+        transfer.refresh_from_db()
+        self.assertEqual(transfer.virus_scan_status, Transfer.SCAN_INFECTED)
+        self.assertIn(f'eicar.com: {EICAR_SIGNATURE}', transfer.virus_scan_result)
+
+    def test_verdicts_are_cached_by_content(self):
+        transfer = self.make_transfer(status=Transfer.READY)
+        self.add_blob_file(transfer, b'harmless')
+        self.assertTrue(scan_transfer(transfer))
+
+        # Same content in another transfer; clamd only answers VERSION now
+        other = self.make_transfer(status=Transfer.READY)
+        transfer_file = self.add_blob_file(other, b'harmless')
+        db_version = ClamdClient().database_version()
+        self.clamd.server.max_stream_length = 1
+
+        verdict = scan_file_cached(ClamdClient(), storage.get_storage(), transfer_file, db_version)
+        self.assertEqual(verdict, (True, 'No virus found'))
+
+    def test_unreachable_clamd_is_an_error(self):
+        transfer = self.make_transfer(status=Transfer.READY)
+        self.add_blob_file(transfer, b'harmless')
+
+        with override_settings(CLAMD_ADDRESS=os.path.join(self.media_root, 'no-clamd.sock')):
+            self.assertFalse(scan_transfer(transfer))
+        transfer.refresh_from_db()
+        self.assertEqual(transfer.virus_scan_status, Transfer.SCAN_ERROR)
+
+    def test_storage_errors_are_scan_errors(self):
+        class FailingOpen:
+            def open(self, key):
+                raise storage.StorageError('Service unavailable')
+
+        class FailingRead:
+            def open(self, key):
+                return self
+
+            def read(self, size=-1):
+                raise RuntimeError('Connection reset while reading body')
+
+            def close(self):
+                pass
+
+        for driver in (FailingOpen(), FailingRead()):
+            is_clean, message = scan_file_for_viruses(ClamdClient(), driver, 'blobs/ab/cd/abcd')
+            self.assertIsNone(is_clean)
+            self.assertTrue(message.startswith('Storage error'), message)
+
+    def test_missing_file(self):
+        self.assertEqual(
+            scan_file_for_viruses(ClamdClient(), storage.get_storage(), 'blobs/ab/cd/missing'),
+            (None, 'File not found'),
+        )
+
+
+class ZipStreamTests(SimpleTestCase):
+
+    FILES = {
+        'a.txt': b'hello world\n' * 1000,
+        'b.jpg': bytes(range(256)) * 40,
+        'empty.txt': b'',
+    }
+
+    def make_archive(self, files=None, compress=True, sizes=None):
+        files = files or self.FILES
+        archive = ZipStream(chunk_size=1000, opener=lambda path: io.BytesIO(files[path]))
+        for name, data in files.items():
+            size = (sizes or {}).get(name, len(data))
+            archive.add(name, name, size=size, compress=compress and not name.endswith('.jpg'))
+        return archive
+
+    def test_archive_is_readable(self):
+        data = b''.join(self.make_archive())
+
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            for name, content in self.FILES.items():
+                self.assertEqual(archive.read(name), content)
+            self.assertEqual(archive.getinfo('a.txt').compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(archive.getinfo('b.jpg').compress_type, zipfile.ZIP_STORED)
+
+    def test_content_length_of_stored_archive(self):
+        self.assertIsNone(self.make_archive().content_length())
+
+        archive = self.make_archive(compress=False)
+        self.assertEqual(archive.content_length(), len(b''.join(archive)))
+
+    def test_stream_range(self):
+        full = b''.join(self.make_archive(compress=False))
+        archive = self.make_archive(compress=False)
+
+        self.assertEqual(b''.join(archive.stream_range(100, 5099)), full[100:5100])
+        self.assertEqual(b''.join(self.make_archive(compress=False).stream_range(0, 0)), full[:1])
+
+    def test_unicode_names(self):
+        files = {'résumé €.txt': b'data'}
+        data = b''.join(self.make_archive(files))
+
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(archive.read('résumé €.txt'), b'data')
+
+    def test_truncated_member_aborts_the_stream(self):
+        archive = self.make_archive(sizes={'b.jpg': len(self.FILES['b.jpg']) + 10})
+
+        with self.assertRaises(ZipStreamError):
+            b''.join(archive)
+
+    def test_etag_follows_members(self):
+        self.assertEqual(self.make_archive().etag(), self.make_archive().etag())
+        self.assertNotEqual(
+            self.make_archive().etag(),
+            self.make_archive(sizes={'a.txt': 1}).etag(),
+        )
+
+
+class DirectUploadStorage(storage.LocalStorage):
+    """Local storage posing as an object store; the client's parts are written by the test."""
+
+    supports_presigned = True
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.completed = []
+
+    def start_direct_upload(self, key, size, expires):
+        return {'upload_id': f'upload-{len(self.completed)}', 'part_size': size, 'parts': []}
+
+    def complete_direct_upload(self, key, upload_id, parts):
+        if upload_id in self.completed:
+            # Like S3's NoSuchUpload
+            raise storage.StorageError('The specified upload does not exist')
+        self.completed.append(upload_id)
+
+
+class DirectUploadTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        storage._storage = DirectUploadStorage(self.media_root)
+        self.transfer = self.make_transfer()
+
+    def complete(self, token):
+        return self.client.post(
+            f'/api/transfers/{self.transfer.id}/direct/complete/',
+            {'token': token, 'parts': [{'part_number': 1, 'etag': '"etag"'}]},
+            content_type='application/json',
+        )
+
+    def start(self, data, name='photo.jpg'):
+        upload = start_direct_upload(self.transfer, name, len(data), 'image/jpeg')
+        info = load_upload_token(upload['token'], self.transfer)
+        path = os.path.join(self.media_root, upload_key(info['stored_name']))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return upload['token']
+
+    def test_completion_records_the_file(self):
+        response = self.complete(self.start(b'jpeg data'))
+
+        self.assertEqual(response.status_code, 201)
+        transfer_file = TransferFile.objects.get(transfer=self.transfer)
+        self.assertEqual(transfer_file.size, 9)
+        self.assertEqual(transfer_file.preview_type, TransferFile.PREVIEW_IMAGE)
+        self.transfer.refresh_from_db()
+        self.assertEqual((self.transfer.file_count, self.transfer.total_size), (1, 9))
+
+    def test_retried_completion_is_idempotent(self):
+        token = self.start(b'jpeg data')
+
+        first = self.complete(token)
+        second = self.complete(token)
+
+        self.assertEqual(first.json()['file_id'], second.json()['file_id'])
+        self.assertEqual(TransferFile.objects.filter(transfer=self.transfer).count(), 1)
+        self.assertEqual(len(storage.get_storage().completed), 1)
+        self.transfer.refresh_from_db()
+        self.assertEqual((self.transfer.file_count, self.transfer.total_size), (1, 9))
+
+    def test_upload_completed_by_a_concurrent_callback(self):
+        token = self.start(b'jpeg data')
+        # Another callback completed the upload but has not recorded the file yet
+        complete_direct_upload(load_upload_token(token, self.transfer), [(1, '"etag"')])
+
+        response = self.complete(token)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(TransferFile.objects.filter(transfer=self.transfer).count(), 1)
+
+    def test_missing_upload_is_rejected(self):
+        token = self.start(b'jpeg data')
+        info = load_upload_token(token, self.transfer)
+        storage.get_storage().completed.append(info['upload_id'])
+        os.remove(os.path.join(self.media_root, upload_key(info['stored_name'])))
+
+        self.assertEqual(self.complete(token).status_code, 400)
+        self.assertFalse(TransferFile.objects.filter(transfer=self.transfer).exists())
+
+    def test_size_mismatch_is_rejected(self):
+        token = self.start(b'jpeg data')
+        info = load_upload_token(token, self.transfer)
+        with open(os.path.join(self.media_root, upload_key(info['stored_name'])), 'ab') as f:
+            f.write(b'extra')
+
+        self.assertEqual(self.complete(token).status_code, 400)
+        self.assertFalse(TransferFile.objects.filter(transfer=self.transfer).exists())
+
+    def test_token_of_another_transfer_is_rejected(self):
+        token = self.start(b'jpeg data')
+        self.transfer = self.make_transfer()
+
+        self.assertEqual(self.complete(token).status_code, 400)
+
+
+class DownloadRangeTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.transfer = self.make_transfer(status=Transfer.READY)
+        self.data = bytes(range(256)) * 4
+        self.file = self.add_blob_file(self.transfer, self.data)
+        self.url = reverse('download_file', args=[self.transfer.short_id, self.file.id])
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        self.addCleanup(response.close)
+        return response
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_download(self):
+        response = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.content(response), self.data)
+        self.assertEqual(DownloadEvent.objects.filter(transfer=self.transfer).count(), 1)
+
+    def test_single_range(self):
+        response = self.get(HTTP_RANGE='bytes=100-199')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/1024')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(self.content(response), self.data[100:200])
+        # Resuming is part of an earlier download
+        self.assertFalse(DownloadEvent.objects.exists())
+
+    def test_open_ended_and_suffix_ranges(self):
+        self.assertEqual(self.content(self.get(HTTP_RANGE='bytes=1000-')), self.data[1000:])
+        self.assertEqual(self.content(self.get(HTTP_RANGE='bytes=-24')), self.data[-24:])
+
+    def test_unsatisfiable_range(self):
+        for header in ('bytes=1024-', 'bytes=2000-3000'):
+            response = self.get(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response['Content-Range'], 'bytes */1024')
+        self.assertFalse(DownloadEvent.objects.exists())
+
+    def test_multiple_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=0-9,500-509')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges'))
+        body = self.content(response)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        self.assertIn(b'Content-Range: bytes 500-509/1024\r\n\r\n' + self.data[500:510], body)
+
+    def test_if_range(self):
+        etag = f'"{self.file.checksum}"'
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        # The file changed since the client started: send all of it
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"other"').status_code, 200)
+
+    def test_not_modified(self):
+        response = self.get(HTTP_IF_NONE_MATCH=f'"{self.file.checksum}"')
+        self.assertEqual(response.status_code, 304)
+
+
+class SendfileDeliveryTests(StorageTestCase):
+    """What gunicorn's wsgi.file_wrapper needs to send a response with os.sendfile."""
+
+    def setUp(self):
+        super().setUp()
+        self.transfer = self.make_transfer(status=Transfer.READY)
+        self.data = bytes(range(256)) * 4
+        self.file = self.add_blob_file(self.transfer, self.data)
+
+    def serve(self, **headers):
+        response = serve_file(RequestFactory().get('/', **headers), self.file, 'attachment')
+        self.addCleanup(response.close)
+        return response
+
+    def sendfile(self, response):
+        """Send the response body like gunicorn does: from the descriptor's offset, for Content-Length bytes."""
+        stream = response.file_to_stream
+        in_fd = stream.fileno()
+        offset = os.lseek(in_fd, 0, os.SEEK_CUR)
+        count = int(response['Content-Length'])
+        with tempfile.TemporaryFile() as out:
+            while count:
+                sent = os.sendfile(out.fileno(), in_fd, offset, count)
+                if not sent:
+                    break
+                offset += sent
+                count -= sent
+            out.seek(0)
+            return out.read()
+
+    def test_full_response(self):
+        response = self.serve()
+
+        stream = response.file_to_stream
+        self.assertEqual(os.lseek(stream.fileno(), 0, os.SEEK_CUR), 0)
+        self.assertEqual(response['Content-Length'], '1024')
+        self.assertEqual(self.sendfile(response), self.data)
+
+    def test_ranged_response(self):
+        response = self.serve(HTTP_RANGE='bytes=100-199')
+
+        self.assertEqual(response.status_code, 206)
+        stream = response.file_to_stream
+        self.assertIsInstance(stream, storage.RangeFile)
+        self.assertEqual(os.lseek(stream.fileno(), 0, os.SEEK_CUR), 100)
+        self.assertEqual(stream.remaining, 100)
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(self.sendfile(response), self.data[100:200])
+
+    def test_ranged_response_without_sendfile(self):
+        # The Python fallback stops at the end of the range
+        response = self.serve(HTTP_RANGE='bytes=1000-')
+
+        self.assertEqual(b''.join(response.streaming_content), self.data[1000:])
+
+    @override_settings(FILE_DELIVERY_BLOCK_SIZE=4096)
+    def test_block_size(self):
+        self.assertEqual(self.serve().block_size, 4096)
+
+class OffloadDeliveryTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.transfer = self.make_transfer(status=Transfer.READY)
+        self.file = self.add_blob_file(self.transfer, b'hello world', name='report.pdf')
+
+    def serve(self, **headers):
+        request = RequestFactory().get('/', **headers)
+        return serve_file(request, self.file, 'attachment; filename="report.pdf"')
+
+    @override_settings(FILE_DELIVERY_BACKEND='x-accel-redirect', FILE_DELIVERY_ACCEL_PREFIX='/protected-uploads/')
+    def test_x_accel_redirect(self):
+        response = self.serve(HTTP_RANGE='bytes=5-')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-uploads/' + self.file.storage_key)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="report.pdf"')
+        self.assertNotIn('X-Sendfile', response)
+        # nginx answers the Range; Django only notes it
+        self.assertEqual(response.byte_ranges, [(5, 10)])
+
+    @override_settings(FILE_DELIVERY_BACKEND='x-sendfile')
+    def test_x_sendfile(self):
+        response = self.serve()
+
+        self.assertEqual(response['X-Sendfile'], self.file.storage_path)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertIsNone(response.byte_ranges)
+
+    @override_settings(FILE_DELIVERY_ACCEL_PREFIX='/protected-uploads')
+    def test_accel_uri_escapes_the_path(self):
+        path = os.path.join(self.media_root, 'transfers', 'my file #1?.txt')
+        self.assertEqual(accel_uri(path), '/protected-uploads/transfers/my%20file%20%231%3F.txt')
+
+    @override_settings(FILE_DELIVERY_ACCEL_PREFIX='/protected-uploads/')
+    def test_zip_file_list(self):
+        other = self.add_blob_file(self.transfer, b'second', name='notes.txt')
+
+        response = zip_offload_response([self.file, other])
+
+        self.assertEqual(response['X-Archive-Files'], 'zip')
+        self.assertEqual(response.content.decode().splitlines(), [
+            f'- 11 /protected-uploads/{self.file.storage_key} report.pdf',
+            f'- 6 /protected-uploads/{other.storage_key} notes.txt',
+        ])
+
+    @override_settings(FILE_DELIVERY_ACCEL_PREFIX='/protected-uploads/')
+    def test_zip_file_list_names_cannot_add_lines(self):
+        self.file.original_name = 'a.txt\n- 6 /protected-uploads/transfers/secret b.txt\r'
+
+        lines = zip_offload_response([self.file]).content.decode().splitlines()
+
+        self.assertEqual(lines, [
+            f'- 11 /protected-uploads/{self.file.storage_key} '
+            'a.txt_- 6 /protected-uploads/transfers/secret b.txt_',
+        ])
+
+
+class FakeRedis:
+    """The few Redis commands the mail queue uses, in memory."""
+
+    def __init__(self):
+        self.lists = {}
+        self.hashes = {}
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+    def hincrby(self, key, field, amount):
+        counters = self.hashes.setdefault(key, {})
+        counters[field] = counters.get(field, 0) + amount
+
+    hincrbyfloat = hincrby
+
+    def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value.encode())
+
+    def ltrim(self, key, start, end):
+        self.lists[key] = self.lists.get(key, [])[start:end + 1]
+
+    def lrange(self, key, start, end):
+        return self.lists.get(key, [])[start:None if end == -1 else end + 1]
+
+    def rpop(self, key):
+        values = self.lists.get(key)
+        return values.pop() if values else None
+
+    def delete(self, key):
+        self.lists.pop(key, None)
+        self.hashes.pop(key, None)
+
+
+class RecordingQueue:
+    """Stands in for the rq queue: records jobs instead of running them."""
+
+    def __init__(self):
+        self.connection = FakeRedis()
+        self.jobs = []
+        self.scheduled = []
+
+    def enqueue(self, func, *args, **kwargs):
+        self.jobs.append((func, args))
+
+    def enqueue_in(self, delay, func, *args, **kwargs):
+        self.scheduled.append((delay, func, args))
+
+
+class BouncingEmailBackend(locmem.EmailBackend):
+    """Refuses recipients whose address starts with "bounce"."""
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0].startswith('bounce'):
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    EMAIL_BACKEND='transfers.tests.BouncingEmailBackend',
+    DEFAULT_FROM_EMAIL='noreply@example.com',
+    MAIL_RETRY_DELAYS=(30, 120),
+)
+class MailQueueTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        mail_queue.close_mail_connection()
+        self.addCleanup(mail_queue.close_mail_connection)
+        self.queue = RecordingQueue()
+        patcher = mock.patch.object(mail_queue, 'get_queue', return_value=self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_mail(self, to, **kwargs):
+        return dict({
+            'subject': 'Files shared with you',
+            'message': 'Hello',
+            'html_message': None,
+            'from_email': 'noreply@example.com',
+            'to': to,
+            'dedup_key': None,
+        }, **kwargs)
+
+    def queued_recipients(self):
+        return [[mail['to'] for mail in args[0]] for _, args in self.queue.jobs]
+
+    def test_queue_mail_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            queued = mail_queue.queue_mail('Subject', 'Body', ['a@example.com', 'b@example.com'])
+            self.assertEqual(self.queue.jobs, [])
+
+        self.assertEqual(queued, 2)
+        for callback in callbacks:
+            callback()
+        # One job for every recipient of the notification
+        self.assertEqual(self.queued_recipients(), [['a@example.com', 'b@example.com']])
+
+    def test_queue_mail_dedup(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            mail_queue.queue_mail('Subject', 'Body', ['a@example.com'], dedup_key='download:1')
+        with self.captureOnCommitCallbacks(execute=True):
+            mail_queue.queue_mail('Subject', 'Body', ['a@example.com', 'b@example.com'], dedup_key='download:1')
+        with self.captureOnCommitCallbacks(execute=True):
+            mail_queue.queue_mail('Subject', 'Body', ['a@example.com'], dedup_key='download:1')
+
+        self.assertEqual(self.queued_recipients(), [['a@example.com'], ['b@example.com']])
+
+    def test_rolled_back_mail_does_not_take_the_dedup_key(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    mail_queue.queue_mail('Subject', 'Body', ['a@example.com'], dedup_key='download:1')
+                    raise RuntimeError('rolled back')
+        self.assertEqual(self.queue.jobs, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mail_queue.queue_mail('Subject', 'Body', ['a@example.com'], dedup_key='download:1')
+        self.assertEqual(self.queued_recipients(), [['a@example.com']])
+
+    def test_failed_mail_is_retried_with_backoff(self):
+        sent = mail_queue.deliver_mail([self.make_mail('a@example.com'), self.make_mail('bounce@example.com')])
+
+        self.assertEqual(sent, 1)
+        self.assertEqual(len(self.queue.scheduled), 1)
+        delay, func, (mails, attempt) = self.queue.scheduled[0]
+        self.assertEqual((delay, func, attempt), (timedelta(seconds=30), mail_queue.deliver_mail, 2))
+        self.assertEqual([mail['to'] for mail in mails], ['bounce@example.com'])
+
+        mail_queue.deliver_mail(mails, attempt)
+        self.assertEqual(self.queue.scheduled[1][0], timedelta(seconds=120))
+        self.assertEqual(mail_queue.get_dead_letters(), [])
+
+    def test_mail_is_dead_lettered_after_the_last_attempt(self):
+        self.assertEqual(mail_queue.deliver_mail([self.make_mail('bounce@example.com')], attempt=3), 0)
+
+        self.assertEqual(self.queue.scheduled, [])
+        [dead_letter] = mail_queue.get_dead_letters()
+        self.assertEqual(dead_letter['to'], 'bounce@example.com')
+        self.assertEqual(dead_letter['attempts'], 3)
+        self.assertIn('No such user', dead_letter['error'])
+
+    def test_requeue_dead_letters(self):
+        mail_queue.deliver_mail([self.make_mail('bounce@example.com', subject='First')], attempt=3)
+        mail_queue.deliver_mail([self.make_mail('bounce@example.com', subject='Second')], attempt=3)
+
+        self.assertEqual(mail_queue.requeue_dead_letters(), 2)
+
+        self.assertEqual(mail_queue.get_dead_letters(), [])
+        # Oldest first, as fresh messages
+        self.assertEqual([args[0][0]['subject'] for _, args in self.queue.jobs], ['First', 'Second'])
+        self.assertEqual(self.queue.jobs[0][1][0][0], self.make_mail('bounce@example.com', subject='First'))
+
+    def test_deliver_mail_sends_a_batch(self):
+        sent = mail_queue.deliver_mail([
+            self.make_mail('a@example.com'),
+            self.make_mail('b@example.com', html_message='<p>Hello</p>'),
+        ])
+
+        self.assertEqual(sent, 2)
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com'], ['b@example.com']])
+        self.assertEqual(mail.outbox[0].alternatives, [])
+        self.assertEqual(mail.outbox[1].alternatives[0][1], 'text/html')
+
+    def test_deliver_mail_accepts_a_single_message(self):
+        self.assertEqual(mail_queue.deliver_mail(self.make_mail('a@example.com')), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_connection_is_reused(self):
+        connection = mail_queue.get_mail_connection()
+        self.assertIs(mail_queue.get_mail_connection(), connection)
+
+    @override_settings(MAIL_CONNECTION_IDLE=-1)
+    def test_idle_connection_is_replaced(self):
+        connection = mail_queue.get_mail_connection()
+        self.assertIsNot(mail_queue.get_mail_connection(), connection)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MailTemplateTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        catalog._catalogs.clear()
+        catalog._version = None
+        self.addCleanup(catalog._catalogs.clear)
+
+    def test_english_defaults(self):
+        subject, text, html = render_mail('verification-code', {
+            'transfer_title': 'Holiday <photos>',
+            'code': '123456',
+        })
+
+        self.assertEqual(subject, 'Verify your download - Holiday <photos>')
+        self.assertIn('Your verification code is: 123456', text)
+        self.assertTrue(text.endswith('\n'))
+        self.assertIn('<div class="code">123456</div>', html)
+
+    def test_translated_texts(self):
+        Translation.objects.create(
+            code_name='email_verify_subject',
+            language='fr',
+            text='Vérifiez votre téléchargement',
+        )
+
+        subject, _, _ = render_mail('verification-code', {'transfer_title': 'Photos', 'code': '1'}, 'fr')
+        self.assertEqual(subject, 'Vérifiez votre téléchargement - Photos')
+
+    def test_subject_is_a_single_line(self):
+        subject, _, _ = render_mail('verification-code', {'transfer_title': 'Two\nlines', 'code': '1'})
+        self.assertEqual(subject, 'Verify your download - Two lines')
@@ -8,24 +8,46 @@ Protocol: https://tus.io/protocols/resumable-upload.html
 """
 
 import os
+import json
+import time
+import base64
+import hashlib
 import uuid
+import shutil
 import mimetypes
+from urllib.parse import urlparse
+
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.http import HttpResponse
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from django.core.cache import cache
 
-from transfers.models import Transfer, TransferFile, MonthlyUsage
+from transfers.models import Transfer, TransferFile, MonthlyUsage, TusUpload, Blob
+from transfers.hashing import ResumableSHA256, hash_file_range
+from transfers.storage import sharded_path
 from config import FILES_LIMIT
 
 
-# Cache timeout for upload metadata (24 hours)
-TUS_CACHE_TIMEOUT = 86400
+# Idle uploads are abandoned after this long (24 hours)
+TUS_UPLOAD_EXPIRY = 86400
+
+# Request bodies are copied to disk in blocks of this size
+TUS_BLOCK_SIZE = 1024 * 1024
+
+# Persist the offset (and renew the write lease) at least this often while a
+# body is streaming, so a dropped connection resumes from what reached disk
+TUS_PERSIST_INTERVAL = 16 * 1024 * 1024
+TUS_PERSIST_SECONDS = 30
 
 # Supported tus extensions
-TUS_EXTENSIONS = 'creation,creation-with-upload,termination,expiration'
+TUS_EXTENSIONS = 'creation,creation-with-upload,termination,expiration,concatenation,checksum'
+
+# Algorithms accepted in Upload-Checksum (checksum extension)
+TUS_CHECKSUM_ALGORITHMS = ('sha1', 'md5', 'sha256')
+
 TUS_VERSION = '1.0.0'
 TUS_MAX_SIZE = FILES_LIMIT  # Match our file limit
 
@@ -37,19 +59,73 @@ def get_tus_upload_path():
     return path
 
 
-def get_upload_metadata(upload_id):
-    """Get metadata for an upload from cache."""
-    return cache.get(f'tus_upload:{upload_id}')
+def get_info_path(file_path):
+    """Sidecar file holding an upload's metadata next to its data."""
+    return f'{file_path}.info'
+
 
+def write_upload_info(upload):
+    """Write the metadata sidecar used to rebuild state from disk."""
+    with open(get_info_path(upload.file_path), 'w') as f:
+        json.dump({
+            'id': upload.id,
+            'transfer_id': str(upload.transfer_id),
+            'filename': upload.filename,
+            'filetype': upload.filetype,
+            'length': upload.length,
+            'is_partial': upload.is_partial,
+        }, f)
 
-def set_upload_metadata(upload_id, metadata):
-    """Store metadata for an upload in cache."""
-    cache.set(f'tus_upload:{upload_id}', metadata, TUS_CACHE_TIMEOUT)
 
+def rebuild_upload(upload_id):
+    """
+    Recreate a TusUpload row from its sidecar and data file on disk.
+
+    Used when the state row is missing (e.g. restored database); the offset
+    is taken from the bytes actually on disk.
+    """
+    file_path = sharded_path(get_tus_upload_path(), upload_id)
+    if not os.path.exists(file_path):
+        # Uploads started before the sharded layout
+        file_path = os.path.join(get_tus_upload_path(), upload_id)
+    try:
+        with open(get_info_path(file_path)) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not os.path.exists(file_path) or not Transfer.objects.filter(id=info['transfer_id']).exists():
+        return None
+
+    upload, _ = TusUpload.objects.get_or_create(
+        id=upload_id,
+        defaults={
+            'transfer_id': info['transfer_id'],
+            'filename': info['filename'],
+            'filetype': info['filetype'],
+            'length': info['length'],
+            'offset': min(os.path.getsize(file_path), info['length']),
+            'file_path': file_path,
+            'is_partial': info.get('is_partial', False),
+        }
+    )
+    return upload
 
-def delete_upload_metadata(upload_id):
-    """Delete metadata for an upload from cache."""
-    cache.delete(f'tus_upload:{upload_id}')
+
+def get_upload(upload_id):
+    """Get upload state, rebuilding it from disk if the row is missing."""
+    try:
+        return TusUpload.objects.get(id=upload_id)
+    except TusUpload.DoesNotExist:
+        return rebuild_upload(upload_id)
+
+
+def delete_upload(upload):
+    """Remove an upload's state row and sidecar."""
+    info_path = get_info_path(upload.file_path)
+    if os.path.exists(info_path):
+        os.remove(info_path)
+    upload.delete()
 
 
 def parse_metadata(metadata_header):
@@ -58,7 +134,6 @@ def parse_metadata(metadata_header):
     if not metadata_header:
         return metadata
 
-    import base64
     for item in metadata_header.split(','):
         item = item.strip()
         if ' ' in item:
@@ -73,13 +148,181 @@ def parse_metadata(metadata_header):
     return metadata
 
 
+def get_content_length(request):
+    """Return the request body length declared by the client."""
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
+
+
+class ChecksumMismatch(Exception):
+    """The request body did not match its Upload-Checksum."""
+
+
+def parse_upload_checksum(checksum_header):
+    """
+    Parse an "Upload-Checksum: <algorithm> <base64 digest>" header.
+
+    Returns (algorithm, digest) or None if the header is absent. Raises
+    ValueError if it is malformed or the algorithm is not supported.
+    """
+    if not checksum_header:
+        return None
+
+    algorithm, _, encoded = checksum_header.strip().partition(' ')
+    algorithm = algorithm.lower()
+    if algorithm not in TUS_CHECKSUM_ALGORITHMS:
+        raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+
+    try:
+        digest = base64.b64decode(encoded.strip(), validate=True)
+    except ValueError:
+        raise ValueError("Invalid checksum encoding")
+    return algorithm, digest
+
+
+def resume_hasher(upload):
+    """
+    Return a SHA-256 hasher covering the upload's data up to its offset.
+
+    Restores the state saved by the previous request and only reads from
+    disk the bytes it doesn't cover (none, normally). Call with the lease held.
+    """
+    hasher = None
+    if upload.hash_state and upload.hash_offset <= upload.offset:
+        hasher = ResumableSHA256.from_state(upload.hash_state)
+
+    hashed = upload.hash_offset if hasher else 0
+    if hasher is None:
+        hasher = ResumableSHA256()
+    if hashed < upload.offset:
+        hash_file_range(hasher, upload.file_path, hashed, upload.offset)
+    return hasher
+
+
+def write_request_body(request, upload, token, hasher, checksum=None):
+    """
+    Stream the request body into the upload file at the current offset.
+
+    Reads wsgi.input in fixed-size blocks instead of loading request.body,
+    feeding each block to hasher, and advances the stored offset (with the
+    hash state) as data lands. Stops early if the write lease is lost.
+
+    With checksum (from parse_upload_checksum) nothing is committed until the
+    whole body has been verified; on mismatch the data is discarded and
+    ChecksumMismatch is raised. Returns the new offset.
+    """
+    start_offset = offset = upload.offset
+    persisted_offset = offset
+    persisted_at = time.monotonic()
+    remaining = get_content_length(request)
+
+    body_hash = hashlib.new(checksum[0]) if checksum else None
+    verified = checksum is None
+    lease_lost = False
+
+    with open(upload.file_path, 'r+b') as f:
+        f.seek(offset)
+        try:
+            while remaining > 0:
+                data = request.read(min(TUS_BLOCK_SIZE, remaining))
+                if not data:
+                    # Client went away; keep what we have
+                    break
+                f.write(data)
+                hasher.update(data)
+                if body_hash is not None:
+                    body_hash.update(data)
+                remaining -= len(data)
+                offset += len(data)
+
+                if (offset - persisted_offset >= TUS_PERSIST_INTERVAL
+                        or time.monotonic() - persisted_at >= TUS_PERSIST_SECONDS):
+                    f.flush()
+                    if body_hash is not None:
+                        # Unverified data can't be committed yet, just keep the lease
+                        persisted = upload.renew(token)
+                    else:
+                        persisted = upload.advance(token, offset, hasher.state())
+                    if not persisted:
+                        # Lease expired and another request took over
+                        lease_lost = True
+                        break
+                    persisted_offset = offset
+                    persisted_at = time.monotonic()
+
+            if body_hash is not None and not lease_lost:
+                verified = body_hash.digest() == checksum[1]
+        finally:
+            if not lease_lost:
+                if not verified:
+                    offset = start_offset
+                # Drop any bytes past the offset (left by an earlier interrupted write)
+                f.truncate(offset)
+                f.flush()
+                upload.advance(token, offset, hasher.state() if verified else None)
+
+    if not verified and not lease_lost:
+        raise ChecksumMismatch()
+
+    return upload.offset
+
+
+def concatenate_files(source_paths, dest_path):
+    """
+    Concatenate files into dest_path.
+
+    Uses copy_file_range so the kernel copies (or reflinks) the data without
+    it passing through Python, falling back to a plain copy where that isn't
+    available (non-Linux, cross-device).
+    """
+    with open(dest_path, 'wb') as dest:
+        for source_path in source_paths:
+            with open(source_path, 'rb') as source:
+                remaining = os.fstat(source.fileno()).st_size
+                try:
+                    # Bytes an earlier fallback left in dest's buffer go first
+                    dest.flush()
+                    while remaining > 0:
+                        copied = os.copy_file_range(source.fileno(), dest.fileno(), remaining)
+                        if copied == 0:
+                            break
+                        remaining -= copied
+                except (AttributeError, OSError):
+                    # Both descriptors have advanced past what was copied
+                    shutil.copyfileobj(source, dest, TUS_BLOCK_SIZE)
+
+
+def parse_concat_final(upload_concat, transfer_id):
+    """
+    Parse the upload IDs out of an "Upload-Concat: final;<url> <url>" header.
+
+    Returns None if any URL does not point at an upload of this transfer.
+    """
+    _, _, urls = upload_concat.partition(';')
+    upload_ids = []
+    for url in urls.split():
+        parts = urlparse(url).path.strip('/').split('/')
+        if len(parts) < 2 or parts[-2] != str(transfer_id):
+            return None
+        upload_ids.append(parts[-1])
+    return upload_ids or None
+
+
+def checksum_mismatch_response():
+    """460 response for a body that failed its Upload-Checksum."""
+    response = HttpResponse('Checksum mismatch', status=460, reason='Checksum Mismatch')
+    return add_tus_headers(response)
+
+
 def add_tus_headers(response):
     """Add common tus headers to response."""
     response['Tus-Resumable'] = TUS_VERSION
     response['Access-Control-Allow-Origin'] = '*'
     response['Access-Control-Allow-Methods'] = 'OPTIONS, POST, HEAD, PATCH, DELETE'
-    response['Access-Control-Allow-Headers'] = 'Tus-Resumable, Upload-Length, Upload-Metadata, Upload-Offset, Content-Type, X-CSRFToken, Authorization'
-    response['Access-Control-Expose-Headers'] = 'Upload-Offset, Upload-Length, Location, Tus-Resumable, Tus-Version, Tus-Extension, Tus-Max-Size'
+    response['Access-Control-Allow-Headers'] = 'Tus-Resumable, Upload-Length, Upload-Metadata, Upload-Offset, Upload-Concat, Upload-Checksum, Content-Type, X-CSRFToken, Authorization'
+    response['Access-Control-Expose-Headers'] = 'Upload-Offset, Upload-Length, Upload-Concat, Location, Tus-Resumable, Tus-Version, Tus-Extension, Tus-Max-Size, Tus-Checksum-Algorithm'
     return response
 
 
@@ -102,6 +345,7 @@ class TusUploadView(View):
         response['Tus-Version'] = TUS_VERSION
         response['Tus-Extension'] = TUS_EXTENSIONS
         response['Tus-Max-Size'] = str(TUS_MAX_SIZE)
+        response['Tus-Checksum-Algorithm'] = ','.join(TUS_CHECKSUM_ALGORITHMS)
         return add_tus_headers(response)
 
     def post(self, request, transfer_id):
@@ -115,6 +359,12 @@ class TusUploadView(View):
         if transfer.status != Transfer.UPLOADING:
             return HttpResponse('Transfer is not accepting uploads', status=400)
 
+        # Concatenation extension: stitch completed partial uploads together
+        upload_concat = request.headers.get('Upload-Concat', '').strip()
+        if upload_concat.startswith('final'):
+            return self._create_final_upload(request, transfer, upload_concat)
+        is_partial = upload_concat == 'partial'
+
         # Get upload size
         upload_length = request.headers.get('Upload-Length')
         if not upload_length:
@@ -137,22 +387,33 @@ class TusUploadView(View):
         filename = metadata.get('filename', 'unnamed')
         filetype = metadata.get('filetype', 'application/octet-stream')
 
+        # Reject an initial body that overflows the declared length
+        if get_content_length(request) > upload_length:
+            return HttpResponse('Body exceeds Upload-Length', status=413)
+
+        try:
+            checksum = parse_upload_checksum(request.headers.get('Upload-Checksum'))
+        except ValueError as e:
+            return HttpResponse(str(e), status=400)
+
         # Generate upload ID
         upload_id = uuid.uuid4().hex
 
         # Create empty file for upload
-        file_path = os.path.join(get_tus_upload_path(), upload_id)
+        file_path = sharded_path(get_tus_upload_path(), upload_id, create=True)
         open(file_path, 'wb').close()
 
-        # Store metadata in cache
-        set_upload_metadata(upload_id, {
-            'transfer_id': str(transfer_id),
-            'filename': filename,
-            'filetype': filetype,
-            'length': upload_length,
-            'offset': 0,
-            'file_path': file_path,
-        })
+        # Store upload state
+        upload = TusUpload.objects.create(
+            id=upload_id,
+            transfer=transfer,
+            filename=filename,
+            filetype=filetype,
+            length=upload_length,
+            file_path=file_path,
+            is_partial=is_partial,
+        )
+        write_upload_info(upload)
 
         # Build location URL
         location = request.build_absolute_uri(f'/api/tus/{transfer_id}/{upload_id}/')
@@ -160,20 +421,24 @@ class TusUploadView(View):
         # Handle creation-with-upload extension
         response_status = 201
         new_offset = 0
-        if request.body:
-            # Append the initial data
-            with open(file_path, 'ab') as f:
-                f.write(request.body)
-
-            # Update offset
-            new_offset = len(request.body)
-            upload_meta = get_upload_metadata(upload_id)
-            upload_meta['offset'] = new_offset
-            set_upload_metadata(upload_id, upload_meta)
-
-            # Check if complete
-            if new_offset >= upload_length:
-                self._finalize_upload(upload_id, upload_meta, request)
+        if get_content_length(request):
+            # Stream the initial data to disk
+            upload, token = TusUpload.acquire(upload_id, 0)
+            hasher = ResumableSHA256()
+            try:
+                new_offset = write_request_body(request, upload, token, hasher, checksum)
+
+                # Check if complete (partials wait for the final upload)
+                if upload.is_complete and not upload.is_partial:
+                    self._finalize_upload(upload, request, hasher.hexdigest())
+            except ChecksumMismatch:
+                # The upload exists; the client can retry the data with PATCH
+                response = checksum_mismatch_response()
+                response['Location'] = location
+                response['Upload-Offset'] = '0'
+                return response
+            finally:
+                upload.release(token)
 
         response = HttpResponse(status=response_status)
         response['Location'] = location
@@ -182,26 +447,31 @@ class TusUploadView(View):
 
     def head(self, request, transfer_id, upload_id):
         """Get upload status."""
-        upload_meta = get_upload_metadata(upload_id)
-        if not upload_meta:
+        upload = get_upload(upload_id)
+        if not upload:
             response = HttpResponse('Upload not found', status=404)
             return add_tus_headers(response)
 
+        # Drop bytes a crashed PATCH left past the committed offset
+        offset = upload.reconcile()
+
         response = HttpResponse(status=200)
-        response['Upload-Offset'] = str(upload_meta['offset'])
-        response['Upload-Length'] = str(upload_meta['length'])
+        response['Upload-Offset'] = str(offset)
+        response['Upload-Length'] = str(upload.length)
         response['Cache-Control'] = 'no-store'
+        if upload.is_partial:
+            response['Upload-Concat'] = 'partial'
         return add_tus_headers(response)
 
     def patch(self, request, transfer_id, upload_id):
         """Append data to upload."""
-        upload_meta = get_upload_metadata(upload_id)
-        if not upload_meta:
+        upload = get_upload(upload_id)
+        if not upload:
             response = HttpResponse('Upload not found', status=404)
             return add_tus_headers(response)
 
         # Validate transfer
-        if upload_meta['transfer_id'] != str(transfer_id):
+        if str(upload.transfer_id) != str(transfer_id):
             response = HttpResponse('Invalid transfer', status=400)
             return add_tus_headers(response)
 
@@ -211,28 +481,46 @@ class TusUploadView(View):
             response = HttpResponse('Invalid Content-Type', status=415)
             return add_tus_headers(response)
 
-        # Check offset
+        # Don't accept more than the declared upload length
         client_offset = int(request.headers.get('Upload-Offset', 0))
-        if client_offset != upload_meta['offset']:
-            response = HttpResponse('Offset mismatch', status=409)
-            response['Upload-Offset'] = str(upload_meta['offset'])
+        if client_offset + get_content_length(request) > upload.length:
+            response = HttpResponse('Body exceeds Upload-Length', status=413)
             return add_tus_headers(response)
 
-        # Append data
-        file_path = upload_meta['file_path']
-        data = request.body
-
-        with open(file_path, 'ab') as f:
-            f.write(data)
+        # Checksum extension: verify this request's body before accepting it
+        try:
+            checksum = parse_upload_checksum(request.headers.get('Upload-Checksum'))
+        except ValueError as e:
+            response = HttpResponse(str(e), status=400)
+            return add_tus_headers(response)
 
-        # Update offset
-        new_offset = upload_meta['offset'] + len(data)
-        upload_meta['offset'] = new_offset
-        set_upload_metadata(upload_id, upload_meta)
+        # Take the write lease; this is the atomic offset check
+        try:
+            upload, token = TusUpload.acquire(upload_id, client_offset)
+        except TusUpload.DoesNotExist:
+            response = HttpResponse('Upload not found', status=404)
+            return add_tus_headers(response)
+        except TusUpload.Locked:
+            response = HttpResponse('Upload is locked by another request', status=423)
+            return add_tus_headers(response)
+        except TusUpload.OffsetMismatch as e:
+            response = HttpResponse('Offset mismatch', status=409)
+            response['Upload-Offset'] = str(e.offset)
+            return add_tus_headers(response)
 
-        # Check if complete
-        if new_offset >= upload_meta['length']:
-            self._finalize_upload(upload_id, upload_meta, request)
+        try:
+            # Stream data to disk at the validated offset, continuing the
+            # file's SHA-256 from the state saved by the previous request
+            hasher = resume_hasher(upload)
+            new_offset = write_request_body(request, upload, token, hasher, checksum)
+
+            # Check if complete (partials wait for the final upload)
+            if upload.is_complete and not upload.is_partial:
+                self._finalize_upload(upload, request, hasher.hexdigest())
+        except ChecksumMismatch:
+            return checksum_mismatch_response()
+        finally:
+            upload.release(token)
 
         response = HttpResponse(status=204)
         response['Upload-Offset'] = str(new_offset)
@@ -240,69 +528,139 @@ class TusUploadView(View):
 
     def delete(self, request, transfer_id, upload_id):
         """Cancel upload."""
-        upload_meta = get_upload_metadata(upload_id)
-        if not upload_meta:
+        upload = get_upload(upload_id)
+        if not upload:
             response = HttpResponse('Upload not found', status=404)
             return add_tus_headers(response)
 
+        if upload.is_locked:
+            response = HttpResponse('Upload is locked by another request', status=423)
+            return add_tus_headers(response)
+
         # Delete file
-        file_path = upload_meta['file_path']
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if os.path.exists(upload.file_path):
+            os.remove(upload.file_path)
 
-        # Delete metadata
-        delete_upload_metadata(upload_id)
+        # Delete state
+        delete_upload(upload)
 
         response = HttpResponse(status=204)
         return add_tus_headers(response)
 
-    def _finalize_upload(self, upload_id, upload_meta, request):
+    def _create_final_upload(self, request, transfer, upload_concat):
+        """Create a final upload from completed partial uploads."""
+        upload_ids = parse_concat_final(upload_concat, transfer.id)
+        if not upload_ids:
+            response = HttpResponse('Invalid Upload-Concat header', status=400)
+            return add_tus_headers(response)
+
+        # Lock every partial; they must all belong here and be complete
+        partials = []
+        try:
+            for partial_id in upload_ids:
+                partial = get_upload(partial_id)
+                if not partial or not partial.is_partial or partial.transfer_id != transfer.id:
+                    response = HttpResponse(f'Invalid partial upload {partial_id}', status=400)
+                    return add_tus_headers(response)
+
+                try:
+                    partial, token = TusUpload.acquire(partial_id, partial.length)
+                except TusUpload.Locked:
+                    response = HttpResponse(f'Partial upload {partial_id} is locked', status=423)
+                    return add_tus_headers(response)
+                except TusUpload.OffsetMismatch:
+                    response = HttpResponse(f'Partial upload {partial_id} is not complete', status=400)
+                    return add_tus_headers(response)
+                partials.append((partial, token))
+
+            upload_length = sum(partial.length for partial, _ in partials)
+            if upload_length > TUS_MAX_SIZE:
+                response = HttpResponse('File too large', status=413)
+                return add_tus_headers(response)
+
+            # Parse metadata (the final upload carries the file name)
+            metadata = parse_metadata(request.headers.get('Upload-Metadata', ''))
+
+            upload_id = uuid.uuid4().hex
+            file_path = sharded_path(get_tus_upload_path(), upload_id, create=True)
+            concatenate_files([partial.file_path for partial, _ in partials], file_path)
+
+            # Partial hash states can't be combined, so the final file is
+            # hashed once; it was just written and is still in the page cache
+            checksum = hash_file_range(hashlib.sha256(), file_path, 0, upload_length).hexdigest()
+
+            upload = TusUpload.objects.create(
+                id=upload_id,
+                transfer=transfer,
+                filename=metadata.get('filename', 'unnamed'),
+                filetype=metadata.get('filetype', 'application/octet-stream'),
+                length=upload_length,
+                offset=upload_length,
+                file_path=file_path,
+            )
+            self._finalize_upload(upload, request, checksum)
+
+            # The partials have served their purpose
+            for partial, _ in partials:
+                if os.path.exists(partial.file_path):
+                    os.remove(partial.file_path)
+                delete_upload(partial)
+        finally:
+            for partial, token in partials:
+                partial.release(token)
+
+        response = HttpResponse(status=201)
+        response['Location'] = request.build_absolute_uri(f'/api/tus/{transfer.id}/{upload_id}/')
+        response['Upload-Offset'] = str(upload_length)
+        return add_tus_headers(response)
+
+    def _finalize_upload(self, upload, request, checksum):
         """Finalize a completed upload - create TransferFile record."""
         try:
-            transfer = Transfer.objects.get(id=upload_meta['transfer_id'])
+            transfer = Transfer.objects.get(id=upload.transfer_id)
         except Transfer.DoesNotExist:
             return
 
-        # Move file to permanent storage
-        tus_path = upload_meta['file_path']
-        original_name = upload_meta['filename']
+        # Move file to permanent storage (the blob store, keyed by content)
+        tus_path = upload.file_path
+        original_name = upload.filename
         file_ext = os.path.splitext(original_name)[1]
         stored_name = f"{uuid.uuid4().hex}{file_ext}"
 
-        transfers_dir = os.path.join(settings.MEDIA_ROOT, 'transfers')
-        os.makedirs(transfers_dir, exist_ok=True)
-
-        final_path = os.path.join(transfers_dir, stored_name)
-        os.rename(tus_path, final_path)
-
         # Get file size
-        file_size = os.path.getsize(final_path)
+        file_size = os.path.getsize(tus_path)
 
         # Determine mime type
-        mime_type = upload_meta.get('filetype')
+        mime_type = upload.filetype
         if not mime_type or mime_type == 'application/octet-stream':
             mime_type, _ = mimetypes.guess_type(original_name)
             if not mime_type:
                 mime_type = 'application/octet-stream'
 
-        # Create file record
-        transfer_file = TransferFile.objects.create(
-            transfer=transfer,
-            original_name=original_name,
-            stored_name=stored_name,
-            size=file_size,
-            mime_type=mime_type,
-            upload_complete=True,
-        )
+        # Store the data and create the file record together, so the blob row
+        # stays locked until its new reference exists
+        with transaction.atomic():
+            blob, _ = Blob.store(tus_path, checksum, file_size)
+            transfer_file = TransferFile.objects.create(
+                transfer=transfer,
+                original_name=original_name,
+                stored_name=stored_name,
+                size=file_size,
+                mime_type=mime_type,
+                checksum=checksum,
+                blob=blob,
+                upload_complete=True,
+            )
 
         # Set preview type
         transfer_file.set_preview_type()
         transfer_file.save(update_fields=['preview_type'])
 
-        # Update transfer totals
-        transfer.total_size += file_size
-        transfer.file_count += 1
-        transfer.save(update_fields=['total_size', 'file_count'])
+        # Update transfer totals (atomically; parallel uploads finish concurrently)
+        Transfer.objects.filter(id=transfer.id).update(
+            total_size=F('total_size') + file_size,
+            file_count=F('file_count') + 1,
+        )
 
-        # Delete upload metadata
-        delete_upload_metadata(upload_id)
+        # Delete upload state
+        delete_upload(upload)
@@ -2,6 +2,7 @@ from django.urls import path
 from transfers.views import (
     CreateTransferAPI,
     UploadFileAPI,
+    DirectUploadCompleteAPI,
     FinalizeTransferAPI,
     DownloadPageView,
     DownloadFileView,
@@ -27,6 +28,7 @@ urlpatterns = [
     # API endpoints
     path('api/transfers/', CreateTransferAPI.as_view(), name='create_transfer'),
     path('api/transfers/<uuid:transfer_id>/upload/', UploadFileAPI.as_view(), name='upload_file'),
+    path('api/transfers/<uuid:transfer_id>/direct/complete/', DirectUploadCompleteAPI.as_view(), name='direct_upload_complete'),
     path('api/transfers/<uuid:transfer_id>/finalize/', FinalizeTransferAPI.as_view(), name='finalize_transfer'),
 
     # TUS resumable upload endpoints
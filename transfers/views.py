@@ -1,30 +1,39 @@
 import os
 import uuid
 import json
+import hashlib
 import mimetypes
-import zipfile
 from datetime import timedelta
-from io import BytesIO
 
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse, HttpResponse, FileResponse, Http404
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.utils import timezone
-from django.conf import settings
-from django.core.files.storage import default_storage
+from django.core import signing
+from django.db import transaction
+from django.db.models import F
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
 from accounts.views import GlobalVars
+from app.utils import Utils
 from accounts.models import Team, TeamMember, AuditLog
-from transfers.models import Transfer, TransferFile, DownloadEvent, MonthlyUsage, UploadPortal, PortalUpload
+from transfers.models import Transfer, TransferFile, DownloadEvent, MonthlyUsage, UploadPortal, PortalUpload, Blob
 from transfers.notifications import send_download_notification, send_transfer_ready_notification
-from transfers.security import scan_transfer, check_file_extension_safety
+from transfers.security import check_file_extension_safety
+from transfers.jobs import enqueue_virus_scan
 from transfers.analytics import get_user_analytics, get_transfer_analytics, format_bytes
+from transfers.delivery import serve_file, starts_download, zip_offload_enabled, zip_offload_response
+from transfers.ranges import RangeNotSatisfiable, parse_range_header, if_range_matches, content_range
+from transfers.storage import get_storage
+from transfers.direct_uploads import (
+    DirectUploadError, direct_uploads_enabled, start_direct_upload, complete_direct_upload, load_upload_token,
+)
+from transfers.zipstream import ZipStream
 from config import ROOT_DOMAIN, FILES_LIMIT
 
 
@@ -140,13 +149,48 @@ class CreateTransferAPI(APIView):
             except Team.DoesNotExist:
                 pass  # Silently ignore invalid team_id
 
+        # Direct-to-storage uploads: check the file list before creating anything
+        direct_files = None
+        if data.get('direct_upload') and direct_uploads_enabled():
+            direct_files = []
+            try:
+                for item in data.get('files') or []:
+                    direct_files.append((str(item['name']), int(item['size']), str(item.get('type', ''))))
+            except (KeyError, TypeError, ValueError):
+                return Response({'error': 'Invalid file list'}, status=400)
+
+            if not direct_files or any(size < 0 for _, size, _ in direct_files):
+                return Response({'error': 'Invalid file list'}, status=400)
+
+            total_size = sum(size for _, size, _ in direct_files)
+            if total_size > FILES_LIMIT:
+                return Response({'error': 'Transfer size limit exceeded'}, status=400)
+
+            if not request.user.is_authenticated or not getattr(request.user, 'is_plan_active', False):
+                monthly_usage = MonthlyUsage.get_or_create_for_request(request, request.user if request.user.is_authenticated else None)
+                if monthly_usage.remaining_bytes < total_size:
+                    return Response({
+                        'error': 'Monthly transfer limit exceeded',
+                        'remaining_bytes': monthly_usage.remaining_bytes,
+                    }, status=429)
+
         transfer.save()
 
-        return Response({
+        response_data = {
             'transfer_id': str(transfer.id),
             'short_id': transfer.short_id,
             'upload_url': f'/api/transfers/{transfer.id}/upload/',
-        }, status=status.HTTP_201_CREATED)
+        }
+
+        # Presigned multipart URLs; the client reports back to complete_url
+        if direct_files is not None:
+            response_data['direct_uploads'] = [
+                start_direct_upload(transfer, name, size, mime_type)
+                for name, size, mime_type in direct_files
+            ]
+            response_data['complete_url'] = f'/api/transfers/{transfer.id}/direct/complete/'
+
+        return Response(response_data, status=status.HTTP_201_CREATED)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -184,30 +228,35 @@ class UploadFileAPI(APIView):
         # Generate storage name
         stored_name = f"{uuid.uuid4().hex}{os.path.splitext(uploaded_file.name)[1]}"
 
-        # Ensure uploads directory exists
-        uploads_dir = os.path.join(settings.MEDIA_ROOT, 'transfers')
-        os.makedirs(uploads_dir, exist_ok=True)
-
-        # Save the file
-        file_path = os.path.join(uploads_dir, stored_name)
+        # Save the file, hashing chunks as they are written
+        file_path = Blob.temp_path()
+        hasher = hashlib.sha256()
         with open(file_path, 'wb+') as destination:
             for chunk in uploaded_file.chunks():
                 destination.write(chunk)
+                hasher.update(chunk)
 
         # Determine mime type
         mime_type, _ = mimetypes.guess_type(uploaded_file.name)
         if not mime_type:
             mime_type = 'application/octet-stream'
 
-        # Create file record
-        transfer_file = TransferFile.objects.create(
-            transfer=transfer,
-            original_name=uploaded_file.name,
-            stored_name=stored_name,
-            size=uploaded_file.size,
-            mime_type=mime_type,
-            upload_complete=True,
-        )
+        # Move it into the blob store (or drop it if the content is already
+        # there) and record the file in one transaction, so the blob row stays
+        # locked until its new reference exists (see storage_gc)
+        checksum = hasher.hexdigest()
+        with transaction.atomic():
+            blob, _ = Blob.store(file_path, checksum, uploaded_file.size)
+            transfer_file = TransferFile.objects.create(
+                transfer=transfer,
+                original_name=uploaded_file.name,
+                stored_name=stored_name,
+                size=uploaded_file.size,
+                mime_type=mime_type,
+                checksum=checksum,
+                blob=blob,
+                upload_complete=True,
+            )
 
         # Set preview type
         transfer_file.set_preview_type()
@@ -225,6 +274,77 @@ class UploadFileAPI(APIView):
         }, status=status.HTTP_201_CREATED)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class DirectUploadCompleteAPI(APIView):
+    """Callback after the client uploaded a file straight to storage."""
+
+    def post(self, request, transfer_id):
+        try:
+            transfer = Transfer.objects.get(id=transfer_id)
+        except Transfer.DoesNotExist:
+            return Response({'error': 'Transfer not found'}, status=404)
+
+        if transfer.status != Transfer.UPLOADING:
+            return Response({'error': 'Transfer is not accepting uploads'}, status=400)
+
+        try:
+            info = load_upload_token(request.data.get('token', ''), transfer)
+        except signing.BadSignature:
+            return Response({'error': 'Invalid upload token'}, status=400)
+
+        try:
+            parts = [(int(p['part_number']), str(p['etag'])) for p in request.data.get('parts') or []]
+        except (KeyError, TypeError, ValueError):
+            return Response({'error': 'Invalid parts list'}, status=400)
+
+        # A retried callback gets the file recorded the first time
+        transfer_file = TransferFile.objects.filter(transfer=transfer, stored_name=info['stored_name']).first()
+        if transfer_file is None:
+            # Talks to the object store, so it runs before taking any lock
+            try:
+                file_size = complete_direct_upload(info, parts)
+            except DirectUploadError as e:
+                return Response({'error': str(e)}, status=400)
+
+            mime_type = info['mime_type']
+            if not mime_type or mime_type == 'application/octet-stream':
+                mime_type, _ = mimetypes.guess_type(info['name'])
+                if not mime_type:
+                    mime_type = 'application/octet-stream'
+
+            # Completions of a transfer are recorded one at a time on its
+            # row, so concurrent retries of a callback add the file once
+            with transaction.atomic():
+                transfer = Transfer.objects.select_for_update().get(id=transfer.id)
+                transfer_file = TransferFile.objects.filter(transfer=transfer, stored_name=info['stored_name']).first()
+                if transfer_file is None:
+                    if transfer.status != Transfer.UPLOADING:
+                        # The object is left for the storage GC
+                        return Response({'error': 'Transfer is not accepting uploads'}, status=400)
+
+                    transfer_file = TransferFile(
+                        transfer=transfer,
+                        original_name=info['name'],
+                        stored_name=info['stored_name'],
+                        size=file_size,
+                        mime_type=mime_type,
+                        upload_complete=True,
+                    )
+                    transfer_file.set_preview_type()
+                    transfer_file.save()
+
+                    Transfer.objects.filter(id=transfer.id).update(
+                        total_size=F('total_size') + file_size,
+                        file_count=F('file_count') + 1,
+                    )
+
+        return Response({
+            'file_id': str(transfer_file.id),
+            'name': transfer_file.original_name,
+            'size': transfer_file.size,
+        }, status=status.HTTP_201_CREATED)
+
+
 class FinalizeTransferAPI(APIView):
     """API endpoint to finalize a transfer after all files are uploaded."""
 
@@ -276,9 +396,13 @@ class FinalizeTransferAPI(APIView):
                 metadata={'transfer_id': str(transfer.id), 'short_id': transfer.short_id},
             )
 
+        enqueue_virus_scan(transfer)
+
         # Send email notifications to recipients
         if transfer.get_recipients_list():
-            send_transfer_ready_notification(transfer)
+            # Resolved like the page does: the session only holds a language
+            # the sender picked explicitly
+            send_transfer_ready_notification(transfer, lang=Utils.get_language(request))
 
         return Response({
             'success': True,
@@ -363,26 +487,26 @@ class DownloadFileView(View):
         # Get file
         transfer_file = get_object_or_404(TransferFile, id=file_id, transfer=transfer)
 
-        # Log download event
-        DownloadEvent.objects.create(
-            transfer=transfer,
-            file=transfer_file,
-            ip_address=get_client_ip(request),
-            user_agent=request.META.get('HTTP_USER_AGENT', ''),
-            is_full_download=False,
-        )
-
-        # Serve file
-        file_path = transfer_file.storage_path
-        if not os.path.exists(file_path):
+        # Serve file (supports Range requests for resuming)
+        if not get_storage().exists(transfer_file.storage_key):
             raise Http404("File not found")
 
-        response = FileResponse(
-            open(file_path, 'rb'),
-            content_type=transfer_file.mime_type,
+        response = serve_file(
+            request,
+            transfer_file,
+            f'attachment; filename="{transfer_file.original_name}"',
         )
-        response['Content-Disposition'] = f'attachment; filename="{transfer_file.original_name}"'
-        response['Content-Length'] = transfer_file.size
+
+        # Log download event (resumed ranges are part of an earlier download)
+        if starts_download(response):
+            DownloadEvent.objects.create(
+                transfer=transfer,
+                file=transfer_file,
+                ip_address=get_client_ip(request),
+                user_agent=request.META.get('HTTP_USER_AGENT', ''),
+                is_full_download=False,
+            )
+
         return response
 
 
@@ -409,33 +533,88 @@ class DownloadAllView(View):
         # Get files
         files = transfer.files.filter(upload_complete=True)
 
-        # Create ZIP in memory
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for f in files:
-                if os.path.exists(f.storage_path):
-                    zip_file.write(f.storage_path, f.original_name)
+        # Let nginx (mod_zip) build and send the archive when configured
+        storage = get_storage()
+        if zip_offload_enabled():
+            files = [f for f in files if storage.exists(f.storage_key)]
 
-        # Log download event
-        download_event = DownloadEvent.objects.create(
-            transfer=transfer,
-            ip_address=get_client_ip(request),
-            user_agent=request.META.get('HTTP_USER_AGENT', ''),
-            is_full_download=True,
-        )
+            download_event = DownloadEvent.objects.create(
+                transfer=transfer,
+                ip_address=get_client_ip(request),
+                user_agent=request.META.get('HTTP_USER_AGENT', ''),
+                is_full_download=True,
+            )
+            transfer.increment_downloads()
+            send_download_notification(transfer, download_event)
+
+            zip_name = transfer.title or f"sendfiles-{transfer.short_id}"
+            zip_name = "".join(c for c in zip_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
+
+            response = zip_offload_response(files)
+            response['Content-Disposition'] = f'attachment; filename="{zip_name}.zip"'
+            return response
+
+        # Build the ZIP lazily; files are read and compressed while streaming.
+        # Already-compressed formats are stored as-is to save CPU.
+        archive = ZipStream(opener=storage.open)
+        for f in files:
+            if storage.exists(f.storage_key):
+                archive.add(
+                    f.storage_key,
+                    f.original_name,
+                    size=f.size,
+                    date_time=f.uploaded_at,
+                    compress=not f.is_compressed_format,
+                )
+
+        # When every member is stored the archive size is known, so the
+        # download can carry Content-Length and be resumed with Range
+        content_length = archive.content_length()
+        etag = archive.etag()
+        byte_range = None
+        if content_length is not None and if_range_matches(request, etag):
+            try:
+                ranges = parse_range_header(request.headers.get('Range'), content_length)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{content_length}'
+                return response
+            # Multiple ranges are not worth it for an archive; send it whole
+            if ranges and len(ranges) == 1:
+                byte_range = ranges[0]
+
+        # Resuming a partial download is not a new download
+        if byte_range is None or byte_range[0] == 0:
+            download_event = DownloadEvent.objects.create(
+                transfer=transfer,
+                ip_address=get_client_ip(request),
+                user_agent=request.META.get('HTTP_USER_AGENT', ''),
+                is_full_download=True,
+            )
 
-        # Increment download count
-        transfer.increment_downloads()
+            # Increment download count
+            transfer.increment_downloads()
 
-        # Send download notification
-        send_download_notification(transfer, download_event)
+            # Send download notification
+            send_download_notification(transfer, download_event)
 
         # Serve ZIP
-        zip_buffer.seek(0)
         zip_name = transfer.title or f"sendfiles-{transfer.short_id}"
         zip_name = "".join(c for c in zip_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
 
-        response = HttpResponse(zip_buffer.read(), content_type='application/zip')
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(archive.stream_range(start, end), status=206, content_type='application/zip')
+            response['Content-Range'] = content_range(start, end, content_length)
+            response['Content-Length'] = end - start + 1
+        else:
+            response = StreamingHttpResponse(archive, content_type='application/zip')
+            if content_length is not None:
+                response['Content-Length'] = content_length
+
+        if content_length is not None:
+            response['Accept-Ranges'] = 'bytes'
+            response['ETag'] = etag
         response['Content-Disposition'] = f'attachment; filename="{zip_name}.zip"'
         return response
 
@@ -515,28 +694,29 @@ class RawFileView(View):
             raise Http404("Preview not available")
 
         # Serve file
-        file_path = transfer_file.storage_path
-        if not os.path.exists(file_path):
+        storage = get_storage()
+        if not storage.exists(transfer_file.storage_key):
             raise Http404("File not found")
 
         # For text files, read content
         if transfer_file.preview_type == TransferFile.PREVIEW_TEXT:
             try:
-                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                    content = f.read(1024 * 1024)  # Max 1MB
+                f = storage.open(transfer_file.storage_key, 0, min(transfer_file.size, 1024 * 1024))  # Max 1MB
+                try:
+                    content = f.read().decode('utf-8', errors='replace')
+                finally:
+                    f.close()
                 response = HttpResponse(content, content_type='text/plain; charset=utf-8')
             except Exception:
                 raise Http404("Cannot read file")
+            response['Content-Disposition'] = f'inline; filename="{transfer_file.original_name}"'
         else:
-            # Stream binary files
-            response = FileResponse(
-                open(file_path, 'rb'),
-                content_type=transfer_file.mime_type,
+            # Stream binary files (Range support lets media players seek)
+            response = serve_file(
+                request,
+                transfer_file,
+                f'inline; filename="{transfer_file.original_name}"',
             )
-            response['Content-Length'] = transfer_file.size
-
-        # Set inline disposition for preview
-        response['Content-Disposition'] = f'inline; filename="{transfer_file.original_name}"'
 
         # Allow embedding
         response['X-Content-Type-Options'] = 'nosniff'
@@ -756,6 +936,8 @@ class PortalFinalizeAPI(APIView):
         transfer.status = Transfer.READY
         transfer.save(update_fields=['status'])
 
+        enqueue_virus_scan(transfer)
+
         # Update portal stats
         portal.total_uploads += 1
         portal.total_files += transfer.file_count
@@ -0,0 +1,339 @@
+"""
+Streaming ZIP archive generation for file transfers.
+
+Builds a ZIP archive chunk by chunk from files on disk so a whole transfer can
+be sent through a StreamingHttpResponse without holding the archive in memory.
+Members are written with data descriptors (sizes and CRC follow the data) and
+switch to ZIP64 records when sizes or offsets outgrow the classic format. A
+member whose data turns out shorter than its declared size aborts the stream
+with ZipStreamError, so a client never receives a silently corrupt archive.
+
+Format: https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT
+"""
+import hashlib
+import struct
+import zlib
+from datetime import datetime
+
+# Read size for member data (memory per download stays around this)
+CHUNK_SIZE = 64 * 1024
+
+# Same threshold zipfile uses before it switches to ZIP64 records
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+ZIP_MAX_VALUE = 0xFFFFFFFF
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# General purpose flags: sizes in data descriptor, UTF-8 file names
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+CREATE_SYSTEM_UNIX = 3
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = 0x04034b50
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+CENTRAL_HEADER_SIGNATURE = 0x02014b50
+DATA_DESCRIPTOR = struct.Struct('<IIII')
+DATA_DESCRIPTOR64 = struct.Struct('<IIQQ')
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+END_RECORD = struct.Struct('<IHHHHIIH')
+END_RECORD_SIGNATURE = 0x06054b50
+END_RECORD64 = struct.Struct('<IQHHIIQQQQ')
+END_RECORD64_SIGNATURE = 0x06064b50
+END_LOCATOR64 = struct.Struct('<IIQI')
+END_LOCATOR64_SIGNATURE = 0x07064b50
+ZIP64_EXTRA_ID = 0x0001
+
+
+class ZipStreamError(Exception):
+    """A member's data did not match its declared size; the archive is aborted."""
+
+
+def dos_datetime(value):
+    """Return (dos_time, dos_date) for a datetime, clamped to the 1980 epoch."""
+    if value is None:
+        value = datetime.now()
+    if value.year < 1980:
+        value = datetime(1980, 1, 1)
+    dos_time = (value.hour << 11) | (value.minute << 5) | (value.second // 2)
+    dos_date = ((value.year - 1980) << 9) | (value.month << 5) | value.day
+    return dos_time, dos_date
+
+
+class ZipMember:
+    """A file to be added to a streamed archive."""
+
+    def __init__(self, path, arcname, size, date_time=None, compress=True):
+        self.path = path
+        self.arcname = arcname
+        self.size = size
+        self.date_time = date_time
+        self.method = ZIP_DEFLATED if compress else ZIP_STORED
+
+        # Filled in while streaming
+        self.crc = 0
+        self.compressed_size = 0
+        self.header_offset = 0
+
+    @property
+    def encoded_name(self):
+        return self.arcname.encode('utf-8')
+
+    @property
+    def zip64(self):
+        """Whether this member needs ZIP64 size fields (decided before writing)."""
+        return self.size * 1.05 > ZIP64_LIMIT
+
+    @property
+    def version_needed(self):
+        return VERSION_ZIP64 if self.zip64 else VERSION_DEFAULT
+
+
+class ZipStream:
+    """
+    Iterable that yields a ZIP archive as a sequence of byte chunks.
+
+    Usage:
+        archive = ZipStream()
+        archive.add(path, 'photo.jpg', size=1234)
+        response = StreamingHttpResponse(archive, content_type='application/zip')
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, opener=None):
+        self.chunk_size = chunk_size
+        self.members = []
+        # Called with a member's path to open its data (e.g. a storage
+        # driver's open); defaults to reading local files
+        self.opener = opener or (lambda path: open(path, 'rb'))
+
+    def add(self, path, arcname, size, date_time=None, compress=True):
+        """Queue a file for the archive. Nothing is read until iteration."""
+        member = ZipMember(path, arcname, size, date_time=date_time, compress=compress)
+        self.members.append(member)
+        return member
+
+    def content_length(self):
+        """
+        Return the exact size of the archive in bytes, or None if unknown.
+
+        The size can only be known up front when every member is stored, since
+        the compressed size of a deflated member depends on its content.
+        """
+        if any(member.method != ZIP_STORED for member in self.members):
+            return None
+
+        offset = 0
+        cd_size = 0
+        for member in self.members:
+            name_length = len(member.encoded_name)
+
+            zip64_fields = 0
+            if member.zip64:
+                zip64_fields += 2
+            if offset > ZIP64_LIMIT:
+                zip64_fields += 1
+            cd_extra = 4 + 8 * zip64_fields if zip64_fields else 0
+            cd_size += CENTRAL_HEADER.size + name_length + cd_extra
+
+            local_extra = 20 if member.zip64 else 0
+            descriptor = DATA_DESCRIPTOR64 if member.zip64 else DATA_DESCRIPTOR
+            offset += LOCAL_HEADER.size + name_length + local_extra + member.size + descriptor.size
+
+        return offset + cd_size + len(self._end_records(offset, cd_size))
+
+    def etag(self):
+        """Return a strong ETag identifying this archive's layout and members."""
+        digest = hashlib.md5()
+        for member in self.members:
+            digest.update(
+                f'{member.arcname}\0{member.size}\0{member.method}\0{member.date_time}\0'.encode('utf-8')
+            )
+        return f'"zip-{digest.hexdigest()}"'
+
+    def stream_range(self, start, end):
+        """
+        Yield only bytes start..end (inclusive) of the archive.
+
+        Members before `start` are still read so their CRCs are available for
+        the data descriptors and central directory, but nothing outside the
+        range is sent to the client.
+        """
+        position = 0
+        for chunk in self:
+            chunk_end = position + len(chunk)
+            if chunk_end > start:
+                yield chunk[max(start - position, 0):end + 1 - position]
+            position = chunk_end
+            if position > end:
+                return
+
+    def __iter__(self):
+        offset = 0
+
+        for member in self.members:
+            member.header_offset = offset
+            for chunk in self._member_chunks(member):
+                offset += len(chunk)
+                yield chunk
+
+        central_directory = b''.join(self._central_header(m) for m in self.members)
+        yield central_directory
+        yield self._end_records(offset, len(central_directory))
+
+    def _member_chunks(self, member):
+        """Yield the local header, data and data descriptor of one member."""
+        yield self._local_header(member)
+
+        crc = 0
+        compressed_size = 0
+        compressor = None
+        if member.method == ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+
+        # Never read past the declared size, so headers and lengths stay exact
+        remaining = member.size
+        f = self.opener(member.path)
+        try:
+            while remaining > 0:
+                data = f.read(min(self.chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                crc = zlib.crc32(data, crc)
+                if compressor:
+                    data = compressor.compress(data)
+                    if not data:
+                        continue
+                compressed_size += len(data)
+                yield data
+        finally:
+            f.close()
+
+        if compressor:
+            data = compressor.flush()
+            compressed_size += len(data)
+            if data:
+                yield data
+
+        if remaining:
+            # The declared size is already in the archive layout (and possibly
+            # in Content-Length); abort rather than send a corrupt archive
+            raise ZipStreamError(
+                f'{member.arcname}: expected {member.size} bytes, got {member.size - remaining}'
+            )
+
+        member.crc = crc
+        member.compressed_size = compressed_size
+
+        if member.zip64:
+            yield DATA_DESCRIPTOR64.pack(
+                DATA_DESCRIPTOR_SIGNATURE, crc, compressed_size, member.size
+            )
+        else:
+            yield DATA_DESCRIPTOR.pack(
+                DATA_DESCRIPTOR_SIGNATURE, crc, compressed_size, member.size
+            )
+
+    def _local_header(self, member):
+        name = member.encoded_name
+        dos_time, dos_date = dos_datetime(member.date_time)
+
+        if member.zip64:
+            # Real sizes go in the data descriptor; the extra field reserves room
+            extra = struct.pack('<HHQQ', ZIP64_EXTRA_ID, 16, 0, 0)
+            size_field = ZIP_MAX_VALUE
+        else:
+            extra = b''
+            size_field = 0
+
+        header = LOCAL_HEADER.pack(
+            LOCAL_HEADER_SIGNATURE,
+            member.version_needed,
+            FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+            member.method,
+            dos_time,
+            dos_date,
+            0,  # CRC follows in the data descriptor
+            size_field,
+            size_field,
+            len(name),
+            len(extra),
+        )
+        return header + name + extra
+
+    def _central_header(self, member):
+        name = member.encoded_name
+        dos_time, dos_date = dos_datetime(member.date_time)
+
+        extra_fields = []
+        size = member.size
+        compressed_size = member.compressed_size
+        header_offset = member.header_offset
+        version_needed = member.version_needed
+
+        if member.zip64:
+            extra_fields.extend([size, compressed_size])
+            size = compressed_size = ZIP_MAX_VALUE
+        if header_offset > ZIP64_LIMIT:
+            extra_fields.append(header_offset)
+            header_offset = ZIP_MAX_VALUE
+            version_needed = VERSION_ZIP64
+
+        extra = b''
+        if extra_fields:
+            extra = struct.pack(
+                f'<HH{len(extra_fields)}Q', ZIP64_EXTRA_ID, 8 * len(extra_fields), *extra_fields
+            )
+
+        header = CENTRAL_HEADER.pack(
+            CENTRAL_HEADER_SIGNATURE,
+            (CREATE_SYSTEM_UNIX << 8) | version_needed,
+            version_needed,
+            FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+            member.method,
+            dos_time,
+            dos_date,
+            member.crc,
+            compressed_size,
+            size,
+            len(name),
+            len(extra),
+            0,  # comment length
+            0,  # disk number start
+            0,  # internal attributes
+            (0o100644 << 16),  # regular file, rw-r--r--
+            header_offset,
+        )
+        return header + name + extra
+
+    def _end_records(self, cd_offset, cd_size):
+        """Return the end of central directory record (with ZIP64 variants if needed)."""
+        count = len(self.members)
+        records = b''
+
+        if count > ZIP_FILECOUNT_LIMIT or cd_offset > ZIP64_LIMIT or cd_size > ZIP64_LIMIT:
+            zip64_end_offset = cd_offset + cd_size
+            records += END_RECORD64.pack(
+                END_RECORD64_SIGNATURE,
+                END_RECORD64.size - 12,  # size of the rest of the record
+                (CREATE_SYSTEM_UNIX << 8) | VERSION_ZIP64,
+                VERSION_ZIP64,
+                0,
+                0,
+                count,
+                count,
+                cd_size,
+                cd_offset,
+            )
+            records += END_LOCATOR64.pack(END_LOCATOR64_SIGNATURE, 0, zip64_end_offset, 1)
+            count = min(count, ZIP_FILECOUNT_LIMIT)
+            cd_offset = min(cd_offset, ZIP_MAX_VALUE)
+            cd_size = min(cd_size, ZIP_MAX_VALUE)
+
+        records += END_RECORD.pack(END_RECORD_SIGNATURE, 0, 0, count, count, cd_size, cd_offset, 0)
+        return records
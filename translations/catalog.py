@@ -0,0 +1,263 @@
+"""
+Per-process translation catalog and language index.
+
+Each process loads a language's texts, and the list of languages, once and
+keeps them in memory, so resolving the language and building the i18n dict
+for a page costs nothing. A version number in the shared cache (Redis) is
+bumped whenever a Translation or Language is saved or deleted; processes
+compare it at most once per CHECK_INTERVAL and reload on change.
+
+Pages get a LazyI18n instead of the catalog itself: it looks keys up only
+when a template uses them, logs keys missing from the catalog when DEBUG
+is on, and with I18N_USAGE_TRACKING records which keys each page template
+uses (manage.py i18n_usage), as a base for per-page bundles. The page
+template is the one rendering() was entered for, which the template
+backend in translations.template_backend does for every render.
+"""
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'translations:catalog_version'
+
+# Redis set of the keys used by a template, per template name
+USAGE_KEY_PREFIX = 'translations:i18n_usage:'
+USAGE_TEMPLATES_KEY = 'translations:i18n_usage_templates'
+
+# Seconds between version checks in a process
+CHECK_INTERVAL = 1
+
+FALLBACK_LANGUAGE = 'en'
+
+_catalogs = {}
+_languages = None
+_version = None
+_checked_at = 0
+_lock = threading.Lock()
+
+# Misses already logged, and (template, key) pairs seen / not yet saved
+_logged_misses = set()
+_usage_seen = set()
+_usage_pending = set()
+
+# Name of the page template being rendered
+_template_name = ContextVar('i18n_template_name', default=None)
+
+
+def get_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        # Missing (first run or cache flushed): start a version so every
+        # process agrees from now on
+        cache.add(VERSION_CACHE_KEY, 1, None)
+        version = cache.get(VERSION_CACHE_KEY, 1)
+    return version
+
+
+def bump_version():
+    """Make every process reload its catalogs."""
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, None)
+
+
+def _check_version():
+    global _languages, _version, _checked_at
+
+    now = time.monotonic()
+    if now - _checked_at < CHECK_INTERVAL:
+        return
+    _checked_at = now
+
+    version = get_version()
+    if version != _version:
+        _catalogs.clear()
+        _languages = None
+        _version = version
+
+
+def load_texts(lang):
+    from translations.models.translation import Translation
+
+    return dict(Translation.objects.filter(language=lang).values_list('code_name', 'text'))
+
+
+def get_catalog(lang):
+    """
+    Return the texts of a language as a read-only mapping of code_name to text.
+
+    Languages without any texts get the fallback language's catalog.
+    """
+    _check_version()
+
+    catalog = _catalogs.get(lang)
+    if catalog is None:
+        with _lock:
+            catalog = _catalogs.get(lang)
+            if catalog is None:
+                texts = load_texts(lang)
+                if not texts and lang != FALLBACK_LANGUAGE:
+                    catalog = None
+                else:
+                    catalog = MappingProxyType(texts)
+                    _catalogs[lang] = catalog
+
+        if catalog is None:
+            catalog = get_catalog(FALLBACK_LANGUAGE)
+            _catalogs[lang] = catalog
+
+    return catalog
+
+
+class LanguageIndex:
+    """Immutable snapshot of the Language rows: by_iso lookup and the ordered list."""
+
+    __slots__ = ('by_iso', 'languages')
+
+    def __init__(self, languages):
+        self.languages = tuple(languages)
+        self.by_iso = MappingProxyType({language.iso: language for language in self.languages})
+
+    def get(self, iso, default=None):
+        return self.by_iso.get(iso, default)
+
+
+def get_language_index():
+    """Return the in-process LanguageIndex, loading it on first use."""
+    global _languages
+
+    _check_version()
+
+    index = _languages
+    if index is None:
+        from translations.models.language import Language
+
+        index = LanguageIndex(Language.objects.order_by('id'))
+        _languages = index
+    return index
+
+
+def usage_tracking_enabled():
+    return getattr(settings, 'I18N_USAGE_TRACKING', settings.DEBUG)
+
+
+@contextmanager
+def rendering(template_name):
+    """
+    Attribute the keys looked up in this block to template_name.
+
+    Templates rendered inside another one (includes) keep the outer name,
+    so keys are recorded against the page.
+    """
+    if not template_name or _template_name.get() is not None:
+        yield
+        return
+
+    token = _template_name.set(template_name)
+    try:
+        yield
+    finally:
+        _template_name.reset(token)
+
+
+class LazyI18n(Mapping):
+    """
+    Read-only view of a language's catalog that resolves keys on access.
+
+    The catalog is fetched on the first lookup, so pages that never use a
+    text don't touch it.
+    """
+
+    __slots__ = ('lang', '_catalog', '_track')
+
+    def __init__(self, lang):
+        self.lang = lang
+        self._catalog = None
+        self._track = usage_tracking_enabled()
+
+    @property
+    def catalog(self):
+        if self._catalog is None:
+            self._catalog = get_catalog(self.lang)
+        return self._catalog
+
+    def __getitem__(self, key):
+        if self._track:
+            self._record(key)
+        try:
+            return self.catalog[key]
+        except KeyError:
+            if settings.DEBUG and (self.lang, key) not in _logged_misses:
+                _logged_misses.add((self.lang, key))
+                logger.warning('Missing translation %r for language %r', key, self.lang)
+            raise
+
+    def __iter__(self):
+        return iter(self.catalog)
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def __contains__(self, key):
+        return key in self.catalog
+
+    @staticmethod
+    def _record(key):
+        template_name = _template_name.get()
+        if template_name and (template_name, key) not in _usage_seen:
+            _usage_seen.add((template_name, key))
+            _usage_pending.add((template_name, key))
+
+
+@receiver(request_finished)
+def flush_usage(**kwargs):
+    """Save the template/key pairs this process saw for the first time."""
+    if not _usage_pending:
+        return
+
+    from django_redis import get_redis_connection
+
+    pending = list(_usage_pending)
+    _usage_pending.difference_update(pending)
+    try:
+        pipeline = get_redis_connection('default').pipeline()
+        for template_name, key in pending:
+            pipeline.sadd(USAGE_TEMPLATES_KEY, template_name)
+            pipeline.sadd(USAGE_KEY_PREFIX + template_name, key)
+        pipeline.execute()
+    except Exception as e:
+        logger.warning('Could not save i18n usage: %s', e)
+
+
+def get_usage():
+    """Return {template name: sorted keys used} recorded so far."""
+    from django_redis import get_redis_connection
+
+    connection = get_redis_connection('default')
+    usage = {}
+    for template_name in sorted(name.decode() for name in connection.smembers(USAGE_TEMPLATES_KEY)):
+        keys = connection.smembers(USAGE_KEY_PREFIX + template_name)
+        usage[template_name] = sorted(key.decode() for key in keys)
+    return usage
+
+
+def reset_usage():
+    from django_redis import get_redis_connection
+
+    connection = get_redis_connection('default')
+    for template_name in connection.smembers(USAGE_TEMPLATES_KEY):
+        connection.delete(USAGE_KEY_PREFIX + template_name.decode())
+    connection.delete(USAGE_TEMPLATES_KEY)
+    _usage_seen.clear()
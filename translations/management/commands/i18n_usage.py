@@ -0,0 +1,34 @@
+import json
+
+from django.core.management import BaseCommand
+
+from translations.catalog import FALLBACK_LANGUAGE, get_catalog, get_usage, reset_usage
+
+
+class Command(BaseCommand):
+    help = 'Report which i18n keys each page template uses (recorded with I18N_USAGE_TRACKING)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print {template: [keys]} bundles as JSON')
+        parser.add_argument('--reset', action='store_true', help='Forget the recorded usage')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            reset_usage()
+            print('i18n usage reset')
+            return
+
+        usage = get_usage()
+        if options['json']:
+            print(json.dumps(usage, indent=2))
+            return
+
+        catalog = get_catalog(FALLBACK_LANGUAGE)
+        print('%s keys in the %s catalog' % (len(catalog), FALLBACK_LANGUAGE))
+        for template_name, keys in sorted(usage.items(), key=lambda item: -len(item[1])):
+            missing = [key for key in keys if key not in catalog]
+            print('%-45s %4s keys%s' % (
+                template_name,
+                len(keys),
+                ' (%s missing: %s)' % (len(missing), ', '.join(missing)) if missing else '',
+            ))
@@ -1,67 +1,34 @@
-from multiprocessing.pool import ThreadPool
+import time
 
-import requests
 from django.core.management import BaseCommand
 
-from translations.models.language import Language
-from translations.models.textbase import TextBase
-from translations.models.translation import Translation
-from config import GOOGLE_API
+from translations import pipeline
+from translations.translators import get_translator
+
 
 class Command(BaseCommand):
     help = 'Start translating'
 
-    def handle(self, *args, **options):
-        pool = ThreadPool(processes=5)
-        variables = TextBase.objects.filter(translated=False)
-        langs = Language.objects.all()
-
-        if not len(variables):
-            print('Nothing to translate')
-            return
-
-        for item in variables:
-            item.translated = True
-            item.save()
-            async_results = [
-                pool.apply_async(self.google_translation_request, (lang.iso, item.text)) for lang in langs
-            ]
-
-            for ar in async_results:
-                results = ar.get()
-                result = results.get('request')
-                lang = results.get('lang')
+    def add_arguments(self, parser):
+        parser.add_argument('--translator', help="Backend to use: 'google' or 'fake' (default: TRANSLATION_BACKEND)")
+        parser.add_argument('--batch-size', type=int, help='Texts per API call (default and maximum: the backend limit)')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent API calls')
+        parser.add_argument('--languages', nargs='+', help='Only translate into these language codes')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint of an interrupted run')
 
-                try:
-                    r = result.json()
-                    meta = '%s' % r['data']['translations'][0]['translatedText']
-                    meta = meta.replace('&#39;', "'").replace('&quot;', '"')
-                except Exception as e:
-                    print('run_translation: %s' % str(e))
-                    meta = item.text
-
-                params = {
-                    'language': lang,
-                    'code_name': item.code_name,
-                    'text': meta
-                }
-                var, msg = Translation.register_text_translated(params)
-
-                if var:
-                    print('Translated text saved: %s' % var.text)
-                else:
-                    print('Translated text not saved: %s' % msg)
-
-    @staticmethod
-    def google_translation_request(lang, text, lang_source='en'):
-        meta_url = 'https://www.googleapis.com/language/translate/v2?key=%s&source=%s&target=%s&q=%s' % (
-            GOOGLE_API,
-            lang_source,
-            lang,
-            text
+    def handle(self, *args, **options):
+        translator = get_translator(options['translator'])
+        started = time.monotonic()
+
+        done, failed, texts = pipeline.run(
+            translator,
+            languages=options['languages'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            restart=options['restart'],
         )
 
-        return {
-            'request': requests.get(meta_url),
-            'lang': lang
-        }
+        if done or failed:
+            print('Translated %s unique texts into %s languages in %.1fs' % (texts, done, time.monotonic() - started))
+        if failed:
+            print('%s languages failed; run again to resume them' % failed)
@@ -1,4 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from translations import catalog
 
 
 class Language(models.Model):
@@ -8,3 +12,10 @@ class Language(models.Model):
 
     def __str__(self):
         return self.name
+
+
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def invalidate_language_index(sender, **kwargs):
+    """Reload the language index everywhere once the change is committed."""
+    transaction.on_commit(catalog.bump_version)
@@ -1,4 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from translations import catalog
 
 
 class Translation(models.Model):
@@ -14,16 +18,8 @@ class Translation(models.Model):
 
     @staticmethod
     def get_text_by_lang(lang):
-        i18n = {}
-        text = Translation.objects.filter(language=lang)
-
-        if not text:
-            text = Translation.objects.filter(language='en')
-
-        for i in text:
-            i18n[i.code_name] = i.text
-
-        return i18n
+        """Return the texts of a language (read-only, from the in-process catalog)."""
+        return catalog.get_catalog(lang)
 
     @staticmethod
     def register_text_translated(data):
@@ -43,3 +39,10 @@ class Translation(models.Model):
         translation.save()
 
         return translation, 'ok'
+
+
+@receiver(post_save, sender=Translation)
+@receiver(post_delete, sender=Translation)
+def invalidate_translation_catalog(sender, **kwargs):
+    """Reload the catalogs everywhere once the change is committed."""
+    transaction.on_commit(catalog.bump_version)
@@ -0,0 +1,121 @@
+"""
+Batched machine translation of untranslated TextBase entries.
+
+Source texts are deduplicated, so a string used under several code names
+is translated once per language, and sent to the translator in batches of
+max_batch strings, with batches of all languages in flight on a thread pool.
+Each language's results are upserted with one bulk_create and then
+checkpointed in the cache, so an interrupted run resumes with the
+remaining languages. Entries are marked translated once every language is
+done, and the translation catalogs are reloaded.
+"""
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.cache import cache
+
+from translations import catalog
+from translations.models.language import Language
+from translations.models.textbase import TextBase
+from translations.models.translation import Translation
+from translations.translators import TranslationError
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_CACHE_KEY = 'translations:run_translation:checkpoint'
+
+SOURCE_LANGUAGE = 'en'
+
+
+def run_fingerprint(entries):
+    """Identify a set of pending entries, so a checkpoint only applies to the same work."""
+    digest = hashlib.sha256()
+    for code_name, text in entries:
+        digest.update(code_name.encode())
+        digest.update(b'\0')
+        digest.update(text.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def translate_language(translator, texts, lang, batch_size):
+    """Translate the unique texts into lang, in batches of batch_size. Returns {text: translation}."""
+    if lang == SOURCE_LANGUAGE:
+        return {text: text for text in texts}
+
+    results = {}
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        results.update(zip(batch, translator.translate(batch, lang, SOURCE_LANGUAGE)))
+    return results
+
+
+def save_language(entries, translations, lang):
+    """Upsert a language's translations in one query."""
+    Translation.objects.bulk_create(
+        [Translation(code_name=code_name, language=lang, text=translations[text]) for code_name, text in entries],
+        update_conflicts=True,
+        unique_fields=['language', 'code_name'],
+        update_fields=['text'],
+    )
+
+
+def run(translator, languages=None, batch_size=None, workers=8, restart=False, progress=print):
+    """
+    Translate every untranslated TextBase entry into every language.
+
+    Returns (languages done, languages failed, texts translated).
+    """
+    items = list(TextBase.objects.filter(translated=False).order_by('id').values_list('id', 'code_name', 'text'))
+    if not items:
+        progress('Nothing to translate')
+        return 0, 0, 0
+
+    entries = [(code_name, text) for _, code_name, text in items]
+    texts = sorted({text for _, text in entries})
+    batch_size = min(batch_size or translator.max_batch, translator.max_batch)
+
+    fingerprint = run_fingerprint(entries)
+    checkpoint = cache.get(CHECKPOINT_CACHE_KEY)
+    if restart or not checkpoint or checkpoint['run'] != fingerprint:
+        checkpoint = {'run': fingerprint, 'done': []}
+
+    all_languages = list(Language.objects.order_by('id').values_list('iso', flat=True))
+    if languages:
+        all_languages = [lang for lang in all_languages if lang in languages]
+    pending = [lang for lang in all_languages if lang not in checkpoint['done']]
+
+    progress('%s entries, %s unique texts, %s languages (%s already done)' % (
+        len(entries), len(texts), len(all_languages), len(all_languages) - len(pending),
+    ))
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(translate_language, translator, texts, lang, batch_size): lang
+            for lang in pending
+        }
+        for future in as_completed(futures):
+            lang = futures[future]
+            try:
+                translations = future.result()
+            except TranslationError as e:
+                logger.error('run_translation: %s failed: %s', lang, e)
+                progress('Language %s failed: %s' % (lang, e))
+                failed.append(lang)
+                continue
+
+            save_language(entries, translations, lang)
+            checkpoint['done'].append(lang)
+            cache.set(CHECKPOINT_CACHE_KEY, checkpoint, None)
+            progress('Language %s saved (%s texts)' % (lang, len(entries)))
+
+    # bulk_create sends no signals; reload the catalogs once for everything
+    catalog.bump_version()
+
+    if not failed and not languages:
+        TextBase.objects.filter(id__in=[item_id for item_id, _, _ in items]).update(translated=True)
+        cache.delete(CHECKPOINT_CACHE_KEY)
+
+    return len(all_languages) - len(failed), len(failed), len(texts)
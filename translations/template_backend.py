@@ -0,0 +1,30 @@
+"""
+Django template backend that tells the i18n usage tracking which page is rendering.
+
+Configured as the TEMPLATES backend in app/settings.py. It behaves like
+Django's own, except that rendering a template runs in
+catalog.rendering(<template name>), so LazyI18n knows which page a key is
+used by.
+"""
+from django.template.backends import django as django_backend
+
+from translations.catalog import rendering
+
+
+class Template(django_backend.Template):
+
+    def render(self, context=None, request=None):
+        with rendering(self.origin.template_name):
+            return super().render(context, request)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except django_backend.TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
@@ -1,3 +1,316 @@
-from django.test import TestCase
+import io
+from contextlib import redirect_stdout
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.template import engines
+from django.test import TestCase, override_settings
+
+from translations import catalog, pipeline
+from translations.models.language import Language
+from translations.models.textbase import TextBase
+from translations.models.translation import Translation
+from translations.translators import FakeTranslator, TranslationError, get_translator
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class RecordingTranslator(FakeTranslator):
+    """Fake translator that records its calls and can fail for some languages."""
+
+    def __init__(self, failing=(), max_batch=100):
+        super().__init__()
+        self.failing = set(failing)
+        self.max_batch = max_batch
+        self.requests = []
+
+    def translate(self, texts, target, source='en'):
+        self.requests.append((target, list(texts)))
+        if target in self.failing:
+            raise TranslationError(f'{target} is unavailable')
+        return super().translate(texts, target, source)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RunTranslationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for iso in ('en', 'fr', 'de'):
+            Language.objects.create(name=iso, en_label=iso, iso=iso)
+        TextBase.objects.create(code_name='save', text='Save')
+        TextBase.objects.create(code_name='save_button', text='Save')
+        TextBase.objects.create(code_name='cancel', text='Cancel')
+
+    def run_pipeline(self, translator, **kwargs):
+        return pipeline.run(translator, progress=lambda message: None, **kwargs)
+
+    def texts(self, lang):
+        return dict(Translation.objects.filter(language=lang).values_list('code_name', 'text'))
+
+    def test_translates_every_entry_into_every_language(self):
+        translator = RecordingTranslator()
+
+        self.assertEqual(self.run_pipeline(translator), (3, 0, 2))
+
+        self.assertEqual(self.texts('en'), {'save': 'Save', 'save_button': 'Save', 'cancel': 'Cancel'})
+        self.assertEqual(self.texts('fr'), {'save': '[fr] Save', 'save_button': '[fr] Save', 'cancel': '[fr] Cancel'})
+        self.assertFalse(TextBase.objects.filter(translated=False).exists())
+        self.assertIsNone(cache.get(pipeline.CHECKPOINT_CACHE_KEY))
+
+    def test_identical_texts_are_translated_once_per_language(self):
+        translator = RecordingTranslator()
+        self.run_pipeline(translator)
+
+        # English is copied, the others take one batch each with unique texts
+        self.assertEqual(sorted(target for target, _ in translator.requests), ['de', 'fr'])
+        for _, texts in translator.requests:
+            self.assertEqual(sorted(texts), ['Cancel', 'Save'])
+
+    def test_batches_respect_the_batch_size(self):
+        translator = RecordingTranslator()
+        self.run_pipeline(translator, languages=['fr'], batch_size=1)
+        self.assertEqual(len(translator.requests), 2)
+
+        # Never more than the backend accepts
+        translator = RecordingTranslator(max_batch=1)
+        self.run_pipeline(translator, languages=['de'], batch_size=50)
+        self.assertEqual(len(translator.requests), 2)
+
+    def test_existing_translations_are_updated(self):
+        Translation.objects.create(code_name='save', language='fr', text='Old')
+
+        self.run_pipeline(RecordingTranslator())
+
+        self.assertEqual(Translation.objects.filter(code_name='save', language='fr').count(), 1)
+        self.assertEqual(self.texts('fr')['save'], '[fr] Save')
+
+    def test_failed_language_is_resumed(self):
+        self.assertEqual(self.run_pipeline(RecordingTranslator(failing={'de'})), (2, 1, 2))
+
+        self.assertEqual(self.texts('de'), {})
+        self.assertEqual(len(self.texts('fr')), 3)
+        # Nothing is marked translated until every language is done
+        self.assertEqual(TextBase.objects.filter(translated=False).count(), 3)
+
+        translator = RecordingTranslator()
+        self.assertEqual(self.run_pipeline(translator), (3, 0, 2))
+        self.assertEqual([target for target, _ in translator.requests], ['de'])
+        self.assertEqual(len(self.texts('de')), 3)
+        self.assertFalse(TextBase.objects.filter(translated=False).exists())
+
+    def test_restart_ignores_the_checkpoint(self):
+        self.run_pipeline(RecordingTranslator(failing={'de'}))
+
+        translator = RecordingTranslator()
+        self.run_pipeline(translator, restart=True)
+        self.assertEqual(sorted(target for target, _ in translator.requests), ['de', 'fr'])
+
+    def test_checkpoint_of_other_work_is_ignored(self):
+        self.run_pipeline(RecordingTranslator(failing={'de'}))
+        TextBase.objects.create(code_name='delete', text='Delete')
+
+        translator = RecordingTranslator()
+        self.run_pipeline(translator)
+        self.assertEqual(sorted(target for target, _ in translator.requests), ['de', 'fr'])
+        self.assertEqual(self.texts('fr')['delete'], '[fr] Delete')
+
+    def test_selected_languages_leave_entries_pending(self):
+        self.run_pipeline(RecordingTranslator(), languages=['fr'])
+
+        self.assertEqual(len(self.texts('fr')), 3)
+        self.assertEqual(self.texts('de'), {})
+        self.assertEqual(TextBase.objects.filter(translated=False).count(), 3)
+
+    def test_catalogs_are_reloaded(self):
+        version = catalog.get_version()
+        self.run_pipeline(RecordingTranslator())
+        self.assertGreater(catalog.get_version(), version)
+
+    def test_nothing_to_translate(self):
+        TextBase.objects.update(translated=True)
+        translator = RecordingTranslator()
+
+        self.assertEqual(self.run_pipeline(translator), (0, 0, 0))
+        self.assertEqual(translator.requests, [])
+
+    @override_settings(TRANSLATION_BACKEND='fake')
+    def test_fake_backend(self):
+        translator = get_translator()
+        self.assertIsInstance(translator, FakeTranslator)
+        self.assertEqual(translator.translate(['Hello'], 'de'), ['[de] Hello'])
+
+    def test_command_with_fake_backend(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            call_command('run_translation', '--translator', 'fake', '--workers', '2')
+
+        self.assertEqual(self.texts('de')['cancel'], '[de] Cancel')
+        self.assertIn('Translated 2 unique texts into 3 languages', output.getvalue())
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogTestCase(TestCase):
+    """Starts each test with empty per-process catalogs."""
+
+    def setUp(self):
+        cache.clear()
+        self.reset_process_state()
+        self.addCleanup(self.reset_process_state)
+
+    @staticmethod
+    def reset_process_state():
+        catalog._catalogs.clear()
+        catalog._languages = None
+        catalog._version = None
+        catalog._checked_at = 0
+        catalog._logged_misses.clear()
+        catalog._usage_seen.clear()
+        catalog._usage_pending.clear()
+
+    @staticmethod
+    def expire_check_interval():
+        catalog._checked_at = 0
+
+
+class TranslationCatalogTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Translation.objects.create(code_name='hello', language='en', text='Hello')
+        Translation.objects.create(code_name='hello', language='fr', text='Bonjour')
+
+    def test_catalog_of_a_language(self):
+        texts = Translation.get_text_by_lang('fr')
+        self.assertEqual(texts['hello'], 'Bonjour')
+        with self.assertRaises(TypeError):
+            texts['hello'] = 'Salut'
+
+    def test_language_without_texts_falls_back_to_english(self):
+        self.assertEqual(catalog.get_catalog('xx')['hello'], 'Hello')
+
+    def test_catalog_is_loaded_once(self):
+        catalog.get_catalog('fr')
+        with self.assertNumQueries(0):
+            self.expire_check_interval()
+            self.assertEqual(catalog.get_catalog('fr')['hello'], 'Bonjour')
+
+    def test_saved_translation_reloads_catalogs_after_commit(self):
+        catalog.get_catalog('fr')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Translation.objects.filter(code_name='hello', language='fr').update(text='Salut')
+            Translation.objects.create(code_name='bye', language='fr', text='Au revoir')
+
+        self.expire_check_interval()
+        texts = catalog.get_catalog('fr')
+        self.assertEqual(texts['hello'], 'Salut')
+        self.assertEqual(texts['bye'], 'Au revoir')
+
+    def test_version_is_only_checked_once_per_interval(self):
+        catalog.get_catalog('fr')
+        catalog.bump_version()
+
+        # Within the interval the loaded catalog is used as is
+        self.assertNotIn('bye', catalog.get_catalog('fr'))
+        Translation.objects.create(code_name='bye', language='fr', text='Au revoir')
+        self.expire_check_interval()
+        self.assertIn('bye', catalog.get_catalog('fr'))
+
+
+class LanguageIndexTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for iso, name in (('en', 'English'), ('fr', 'Français')):
+            Language.objects.create(name=name, en_label=name, iso=iso)
+
+    def test_index(self):
+        index = catalog.get_language_index()
+
+        self.assertEqual([language.iso for language in index.languages], ['en', 'fr'])
+        self.assertEqual(index.get('fr').name, 'Français')
+        self.assertIsNone(index.get('xx'))
+
+    def test_index_is_loaded_once(self):
+        catalog.get_language_index()
+        self.expire_check_interval()
+        with self.assertNumQueries(0):
+            catalog.get_language_index()
+
+    def test_new_language_is_picked_up_after_commit(self):
+        catalog.get_language_index()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Language.objects.create(name='Deutsch', en_label='German', iso='de')
+
+        self.expire_check_interval()
+        self.assertEqual(catalog.get_language_index().get('de').name, 'Deutsch')
+
+
+TEMPLATE_BACKEND = {'BACKEND': 'translations.template_backend.DjangoTemplates', 'NAME': 'django', 'DIRS': []}
+
+PAGE_TEMPLATES = {'includes/footer.html': '{{ i18n.footer|default:"" }}'}
+
+
+class LazyI18nTests(CatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Translation.objects.create(code_name='hello', language='fr', text='Bonjour')
+
+    def render(self, source, name='pages/home.html'):
+        templates = dict(PAGE_TEMPLATES, **{name: source})
+        with self.settings(TEMPLATES=[dict(TEMPLATE_BACKEND, OPTIONS={'loaders': [
+            ('django.template.loaders.locmem.Loader', templates),
+        ]})]):
+            return engines['django'].get_template(name).render({'i18n': catalog.LazyI18n('fr')})
+
+    def test_catalog_is_fetched_on_first_lookup(self):
+        with self.assertNumQueries(0):
+            i18n = catalog.LazyI18n('fr')
+        self.assertEqual(i18n['hello'], 'Bonjour')
+        self.assertIn('hello', i18n)
+
+    def test_missing_key(self):
+        with self.assertRaises(KeyError):
+            catalog.LazyI18n('fr')['missing']
+
+        self.assertEqual(self.render('{{ i18n.missing|default:"Fallback" }}'), 'Fallback')
+
+    @override_settings(DEBUG=True)
+    def test_missing_key_is_logged_in_debug(self):
+        with self.assertLogs('translations.catalog', 'WARNING') as logs:
+            self.render('{{ i18n.missing }}')
+        self.assertIn("'missing'", logs.output[0])
+        self.assertIn(('fr', 'missing'), catalog._logged_misses)
+
+    @override_settings(I18N_USAGE_TRACKING=True)
+    def test_usage_is_recorded_per_template(self):
+        self.assertEqual(self.render('{{ i18n.hello }}'), 'Bonjour')
+        self.render('{{ i18n.hello }}{{ i18n.missing }}', name='pages/about.html')
+
+        self.assertEqual(catalog._usage_pending, {
+            ('pages/home.html', 'hello'),
+            ('pages/about.html', 'hello'),
+            ('pages/about.html', 'missing'),
+        })
+
+    @override_settings(I18N_USAGE_TRACKING=True)
+    def test_usage_in_includes_is_recorded_for_the_page(self):
+        self.render('{{ i18n.hello }}{% include "includes/footer.html" %}')
+
+        self.assertEqual(catalog._usage_pending, {
+            ('pages/home.html', 'hello'),
+            ('pages/home.html', 'footer'),
+        })
+
+    @override_settings(I18N_USAGE_TRACKING=True)
+    def test_usage_outside_templates_is_not_recorded(self):
+        self.assertEqual(catalog.LazyI18n('fr')['hello'], 'Bonjour')
+        self.assertEqual(catalog._usage_pending, set())
+
+    @override_settings(I18N_USAGE_TRACKING=False)
+    def test_usage_is_not_recorded_when_disabled(self):
+        self.render('{{ i18n.hello }}')
+        self.assertEqual(catalog._usage_pending, set())